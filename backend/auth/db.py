@@ -0,0 +1,838 @@
+'''
+Business: Общий слой доступа к PostgreSQL для облачных функций
+Каждая функция деплоится отдельно, поэтому файл лежит копией в каждой
+папке backend/*/ и должен оставаться одинаковым во всех копиях.
+'''
+
+import base64
+import functools
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+# Схема школы по умолчанию; в ней же реестр школ (tenants) и общий список отзыва токенов
+DB_SCHEMA = os.environ.get('DB_SCHEMA', 't_p2953915_edu_schedule_platfor')
+# Сколько соединений пула может держать одна школа: занятая школа не забирает весь пул
+TENANT_MAX_CONNECTIONS = int(os.environ.get('TENANT_MAX_CONNECTIONS', str(max(1, POOL_SIZE // 2))))
+TENANT_CACHE_TTL = float(os.environ.get('TENANT_CACHE_TTL', '30'))
+PREPARED_LIMIT = int(os.environ.get('DB_PREPARED_LIMIT', '256'))
+TIMING_SAMPLE_RATE = float(os.environ.get('TIMING_SAMPLE_RATE', '0.01'))
+MAX_LOGGED_QUERIES = 50
+
+
+class RequestTimer:
+    '''Разбивка времени одного запроса: соединение, SQL, формирование ответа, сериализация'''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}
+        self.queries: List[Dict[str, Any]] = []
+
+    def add(self, name: str, seconds: float) -> None:
+        span = self.spans.setdefault(name, [0.0, 0])
+        span[0] += seconds
+        span[1] += 1
+
+    def query(self, sql: Any, seconds: float, rows: int) -> None:
+        self.add('sql', seconds)
+        if len(self.queries) < MAX_LOGGED_QUERIES:
+            digest, text = fingerprint(sql if isinstance(sql, str) else str(sql))
+            self.queries.append({'fingerprint': digest, 'sql': text, 'ms': round(seconds * 1000, 3), 'rows': rows})
+
+    def finish(self, event: Dict[str, Any], context: Any, response: Optional[Dict[str, Any]]) -> None:
+        total = time.perf_counter() - self.started
+        app = total - sum(seconds for seconds, _ in self.spans.values())
+        parts = [f'{name};dur={seconds * 1000:.3f}' + (f';desc="{count} queries"' if name == 'sql' else '')
+                 for name, (seconds, count) in self.spans.items()]
+        parts += [f'app;dur={max(app, 0) * 1000:.3f}', f'total;dur={total * 1000:.3f}']
+        if response is not None:
+            # Новый dict: обработчики могут отдавать общий на модуль словарь заголовков
+            headers = dict(response.get('headers') or {})
+            exposed = headers.get('Access-Control-Expose-Headers')
+            headers['Access-Control-Expose-Headers'] = f'{exposed}, Server-Timing' if exposed else 'Server-Timing'
+            headers['Server-Timing'] = ', '.join(parts)
+            headers['Timing-Allow-Origin'] = '*'
+            response['headers'] = headers
+        print(json.dumps({'timing': {
+            'function': getattr(context, 'function_name', None),
+            'request_id': getattr(context, 'request_id', None),
+            'method': event.get('httpMethod'),
+            'params': event.get('queryStringParameters') or {},
+            'status': response.get('statusCode') if response is not None else 500,
+            'total_ms': round(total * 1000, 3),
+            'app_ms': round(max(app, 0) * 1000, 3),
+            **{f'{name}_ms': round(seconds * 1000, 3) for name, (seconds, _) in self.spans.items()},
+            'sql_count': self.spans.get('sql', [0, 0])[1],
+            'queries': self.queries
+        }}, ensure_ascii=False, default=str))
+
+
+_current_timer: ContextVar[Optional[RequestTimer]] = ContextVar('request_timer', default=None)
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql: str) -> Tuple[str, str]:
+    '''Запрос без литералов и лишних пробелов и его короткий хэш - одинаковый для всех значений параметров'''
+    normalized = ' '.join(_SQL_LITERALS.sub('?', sql).split())
+    return hashlib.md5(normalized.encode()).hexdigest()[:12], normalized[:200]
+
+
+def _error_response(status: int, message: str, extra_headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **(extra_headers or {})},
+        'isBase64Encoded': False,
+        'body': json.dumps({'error': message})
+    }
+
+
+def instrumented(handler: Callable) -> Callable:
+    '''
+    Обёртка handler: для доли запросов TIMING_SAMPLE_RATE (и всегда при заголовке
+    X-Timing: 1) добавляет Server-Timing в ответ и пишет строку JSON в лог.
+    Остальные запросы проходят без замеров.
+    '''
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        # Школа определяется до try обработчика, поэтому её ошибки превращаются в ответ здесь
+        try:
+            tenant = tenants.resolve(tenant_slug(event))
+        except UnknownTenant:
+            return _error_response(404, 'Школа не найдена')
+        except (TypeError, ValueError):
+            return _error_response(401, 'Некорректный токен')
+        except (PoolTimeout, psycopg2.OperationalError):
+            return _error_response(503, 'База данных перегружена, повторите запрос', {'Retry-After': '1'})
+        tenant_token = _current_tenant.set(tenant)
+        try:
+            if request_header(event, 'X-Timing') != '1' and random.random() >= TIMING_SAMPLE_RATE:
+                return handler(event, context)
+            timer = RequestTimer()
+            token = _current_timer.set(timer)
+            response = None
+            try:
+                response = handler(event, context)
+                return response
+            finally:
+                _current_timer.reset(token)
+                timer.finish(event, context, response)
+        finally:
+            _current_tenant.reset(tenant_token)
+    return wrapper
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+def dumps(payload: Any, **kwargs) -> str:
+    with span('serialize'):
+        return json.dumps(payload, **kwargs)
+
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        timer = _current_timer.get()
+        if timer is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            # В логе - исходный текст подготовленного запроса, а не EXECUTE q_...
+            source = query
+            if isinstance(query, str) and query.startswith('EXECUTE '):
+                source = _prepared_sources.get(query[8:].split('(', 1)[0], query)
+            timer.query(source, time.perf_counter() - started, self.rowcount)
+
+
+_timed_cursors: Dict[type, type] = {}
+
+
+def timed_cursor_class(base: type) -> type:
+    if base not in _timed_cursors:
+        _timed_cursors[base] = type('Timed' + base.__name__, (_TimedCursorMixin, base), {})
+    return _timed_cursors[base]
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    '''
+    Соединение, чьи курсоры (любого cursor_factory) сообщают время запросов в
+    RequestTimer. Помнит имена подготовленных на нём запросов (см. run).
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        # Схема в search_path соединения (см. ConnectionPool.acquire)
+        self.schema: Optional[str] = None
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    '''
+    Пул соединений уровня модуля: живёт между тёплыми вызовами функции,
+    поэтому повторный запрос в тот же контейнер не платит за connect.
+    Соединения общие для всех школ: search_path переключается при выдаче,
+    а одна школа держит не больше своей квоты соединений одновременно.
+    '''
+
+    def __init__(self, dsn: str, size: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.size = size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle: List[Tuple[Any, float]] = []
+        self._opened = 0
+        self._in_use: Dict[str, int] = {}
+        self._closed = False
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, schema: str = DB_SCHEMA, quota: Optional[int] = None):
+        started = time.monotonic()
+        waited = False
+        quota = quota or self.size
+        with self._cond:
+            while True:
+                if self._in_use.get(schema, 0) < quota:
+                    if self._idle:
+                        conn, last_used = self._take_idle(schema)
+                        break
+                    if self._opened < self.size:
+                        self._opened += 1
+                        conn, last_used = None, 0.0
+                        break
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise PoolTimeout('Нет свободных соединений с БД')
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use[schema] = self._in_use.get(schema, 0) + 1
+            if waited:
+                elapsed = time.monotonic() - started
+                self.waits += 1
+                self.wait_time += elapsed
+                self.max_wait = max(self.max_wait, elapsed)
+
+        try:
+            if conn is not None and not self._healthy(conn, last_used):
+                self._close_quietly(conn)
+                conn = None
+                with self._cond:
+                    self.reconnects += 1
+            if conn is None:
+                conn = psycopg2.connect(self.dsn, connection_factory=TimedConnection)
+                with self._cond:
+                    self.misses += 1
+            else:
+                with self._cond:
+                    self.hits += 1
+            if conn.schema != schema:
+                use_schema(conn, schema)
+        except Exception:
+            if conn is not None:
+                self._close_quietly(conn)
+            with self._cond:
+                self._in_use[schema] -= 1
+                self._opened -= 1
+                self._cond.notify_all()
+            raise
+        return conn
+
+    def _take_idle(self, schema: str) -> Tuple[Any, float]:
+        '''Свободное соединение, лучше уже настроенное на эту схему (без лишнего SET)'''
+        for i in range(len(self._idle) - 1, -1, -1):
+            if self._idle[i][0].schema == schema:
+                return self._idle.pop(i)
+        return self._idle.pop()
+
+    def release(self, conn) -> None:
+        reusable = not conn.closed and not self._closed
+        if reusable and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+        with self._cond:
+            self._in_use[conn.schema] -= 1
+            if reusable:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._opened -= 1
+            # Ждущие разных школ ждут разного (квоты или свободного места), будим всех
+            self._cond.notify_all()
+        if not reusable:
+            self._close_quietly(conn)
+
+    def close(self) -> None:
+        '''Закрывает свободные соединения; занятые закрываются при возврате'''
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'size': self.size,
+                'opened': self._opened,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'reconnects': self.reconnects,
+                'waits': self.waits,
+                'wait_ms': round(self.wait_time * 1000, 3),
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+                'in_use': {schema: count for schema, count in self._in_use.items() if count}
+            }
+
+    def _healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ.get('DATABASE_URL'), POOL_SIZE, POOL_TIMEOUT, POOL_PING_AFTER)
+    return _pool
+
+
+def close_pool() -> None:
+    '''Закрывает пул модуля, когда экземпляр функции выгружается (локальный шлюз)'''
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+def use_schema(conn, schema: str) -> None:
+    '''search_path на уровне сессии: переживает rollback в release и действует до следующей смены'''
+    with conn.cursor() as cur:
+        cur.execute('SELECT set_config(%s, %s, false)',
+                    ('search_path', f'{psycopg2.extensions.quote_ident(schema, conn)}, public'))
+    conn.commit()
+    conn.schema = schema
+
+
+class Tenant(NamedTuple):
+    slug: str
+    schema: str
+    max_connections: int
+
+
+class UnknownTenant(LookupError):
+    pass
+
+
+DEFAULT_TENANT = Tenant('default', DB_SCHEMA, TENANT_MAX_CONNECTIONS)
+
+
+class TenantRegistry:
+    '''
+    Школы из DB_SCHEMA.tenants в памяти процесса: таблица перечитывается целиком не чаще
+    раза в TENANT_CACHE_TTL секунд, так что запрос с неизвестной школой не ходит в БД.
+    Без заголовка и без школы в токене запрос идёт в DEFAULT_TENANT.
+    '''
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._tenants: Dict[str, Tenant] = {}
+        self._loaded_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def resolve(self, slug: Optional[str]) -> Tenant:
+        if not slug or slug == DEFAULT_TENANT.slug:
+            return DEFAULT_TENANT
+        if time.monotonic() - self._loaded_at >= self.ttl:
+            self.reload()
+        tenant = self._tenants.get(slug)
+        if tenant is None:
+            raise UnknownTenant(slug)
+        return tenant
+
+    def reload(self) -> None:
+        with self._lock:
+            if time.monotonic() - self._loaded_at < self.ttl:
+                return
+            pool = get_pool()
+            conn = pool.acquire()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f'''
+                        SELECT slug, schema_name, COALESCE(max_connections, %s) FROM {DB_SCHEMA}.tenants WHERE active
+                    ''', (TENANT_MAX_CONNECTIONS,))
+                    loaded = {row[0]: Tenant(*row) for row in cur.fetchall()}
+                conn.rollback()
+            except psycopg2.Error:
+                # Реестра ещё нет (миграция не применена) - известна только школа по умолчанию
+                conn.rollback()
+                loaded = {}
+            finally:
+                pool.release(conn)
+            self._tenants = loaded
+            self._loaded_at = time.monotonic()
+
+
+tenants = TenantRegistry(TENANT_CACHE_TTL)
+_current_tenant: ContextVar[Tenant] = ContextVar('tenant', default=DEFAULT_TENANT)
+
+
+def current_tenant() -> Tenant:
+    return _current_tenant.get()
+
+
+def tenant_slug(event: Dict[str, Any]) -> Optional[str]:
+    '''
+    Школа из сессионного токена (токен одной школы не открывает другую), иначе из X-Tenant,
+    иначе из ?tenant= - календарные клиенты по ссылке подписки заголовков не шлют.
+    '''
+    claims = session_from_event(event)
+    if claims:
+        # Токен без школы выдан школой по умолчанию
+        return claims.get('tenant')
+    return request_header(event, 'X-Tenant') or (event.get('queryStringParameters') or {}).get('tenant')
+
+
+def acquire():
+    tenant = current_tenant()
+    with span('conn'):
+        conn = get_pool().acquire(tenant.schema, tenant.max_connections)
+    revocations.sync_if_due(conn)
+    return conn
+
+
+def release(conn) -> None:
+    get_pool().release(conn)
+
+
+def pool_stats_response(event: Dict[str, Any]) -> Dict[str, Any]:
+    '''Счётчики пула - только администратору по токену; занятые соединения - только его школы'''
+    session = session_from_event(event)
+    if not session:
+        return _error_response(401, 'Нужен токен администратора')
+    if session.get('role') != 'admin':
+        return _error_response(403, 'Только для администратора')
+    stats = get_pool().stats()
+    schema = current_tenant().schema
+    stats['in_use'] = {schema: stats['in_use'].get(schema, 0)}
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': json.dumps(stats)
+    }
+
+
+def request_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    lowered = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == lowered:
+            return value
+    return None
+
+
+def table_versions(conn, tables: List[str]) -> List[int]:
+    '''Версия таблицы - xid последней завершённой для всех транзакции, писавшей в неё (V0008)'''
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT (SELECT v.xid::text FROM entity_versions v
+                    WHERE v.table_name = t.name AND v.xid < pg_snapshot_xmin(pg_current_snapshot())
+                    ORDER BY v.xid DESC
+                    LIMIT 1)
+            FROM unnest(%s::text[]) WITH ORDINALITY AS t(name, position)
+            ORDER BY t.position
+        ''', (list(tables),))
+        return [int(row[0] or 0) for row in cur.fetchall()]
+
+
+def make_etag(name: str, conn, tables: List[str]) -> str:
+    '''ETag списка из версий всех таблиц, от которых зависит ответ; у версий каждой школы свой счёт'''
+    if current_tenant() is not DEFAULT_TENANT:
+        name = f'{current_tenant().slug}.{name}'
+    return '"%s-%s"' % (name, '.'.join(str(v) for v in table_versions(conn, tables)))
+
+
+def is_not_modified(event: Dict[str, Any], etag: str) -> bool:
+    value = request_header(event, 'If-None-Match')
+    if not value:
+        return False
+    candidates = [v.strip().removeprefix('W/') for v in value.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    return {'ETag': etag, 'Cache-Control': 'no-cache', 'Access-Control-Expose-Headers': 'ETag', 'Vary': 'X-Tenant'}
+
+
+def not_modified_response(etag: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {'Access-Control-Allow-Origin': '*', **etag_headers(etag)},
+        'isBase64Encoded': False,
+        'body': ''
+    }
+
+
+REFERENCE_CACHE_TTL = float(os.environ.get('REFERENCE_CACHE_TTL', '10'))
+
+# Справочник -> (таблица с версией в entity_versions, запрос; первая колонка - id)
+REFERENCE_QUERIES = {
+    'subjects': ('subjects', 'SELECT id, name, color FROM subjects'),
+    'classes': ('classes', 'SELECT id, name FROM classes'),
+    'users': ('users', 'SELECT id, full_name FROM users')
+}
+
+
+class ReferenceCache:
+    '''
+    Кэш справочников на процесс (read-through). В пределах TTL отдаётся без
+    обращения к БД; после TTL сверяется версия таблицы в entity_versions и
+    справочник перечитывается, только если версия изменилась. Запись в этом
+    же процессе сбрасывает справочник сразу через invalidate().
+    '''
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[Optional[str], str], Tuple[int, float, Dict[Any, Tuple]]] = {}
+        self.hits = 0
+        self.checks = 0
+        self.reloads = 0
+
+    def get(self, conn, name: str) -> Dict[Any, Tuple]:
+        now = time.monotonic()
+        key = (conn.schema, name)
+        entry = self._entries.get(key)
+        if entry and now - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[2]
+
+        table, query = REFERENCE_QUERIES[name]
+        version = table_versions(conn, [table])[0]
+        if entry and entry[0] == version:
+            self.checks += 1
+            self._entries[key] = (version, now, entry[2])
+            return entry[2]
+
+        with conn.cursor() as cur:
+            cur.execute(query)
+            data = {row[0]: tuple(row[1:]) for row in cur.fetchall()}
+        self.reloads += 1
+        self._entries[key] = (version, now, data)
+        return data
+
+    def lookup(self, conn, name: str, default: Tuple) -> Callable[[Any], Tuple]:
+        '''
+        Поиск по справочнику для строк одного ответа. Ключа нет в снимке - значит,
+        запись появилась после него в другом процессе (ссылки в ДЗ и оценках
+        защищены FK): справочник перечитывается, но не больше одного раза за ответ.
+        '''
+        data = self.get(conn, name)
+        refreshed = False
+
+        def find(key: Any) -> Tuple:
+            nonlocal data, refreshed
+            if key not in data and not refreshed:
+                refreshed = True
+                self._entries.pop((conn.schema, name), None)
+                data = self.get(conn, name)
+            return data.get(key, default)
+
+        return find
+
+    def invalidate(self, *names: str) -> None:
+        '''Сбрасывает справочники во всех схемах: запись редкая, а соединение сюда не передаётся'''
+        for key in list(self._entries):
+            if not names or key[1] in names:
+                self._entries.pop(key, None)
+
+
+reference_cache = ReferenceCache(REFERENCE_CACHE_TTL)
+
+
+_PLACEHOLDERS = re.compile(r'%\((\w+)\)s|%s|%%')
+_prepared_sources: Dict[str, str] = {}
+
+
+@functools.lru_cache(maxsize=1024)
+def prepared_form(sql: str) -> Tuple[str, str, Tuple[str, ...]]:
+    '''
+    Имя подготовленного запроса (по хэшу текста) и его текст с $1..$n вместо
+    %s / %(name)s. Для именованных параметров возвращает порядок имён.
+    '''
+    names: List[str] = []
+    positional = 0
+
+    def number(match) -> str:
+        nonlocal positional
+        if match.group(0) == '%%':
+            return '%'
+        if match.group(1):
+            if match.group(1) not in names:
+                names.append(match.group(1))
+            return f'${names.index(match.group(1)) + 1}'
+        positional += 1
+        return f'${positional}'
+
+    text = _PLACEHOLDERS.sub(number, sql)
+    name = 'q_' + hashlib.md5(sql.encode()).hexdigest()[:16]
+    _prepared_sources[name] = sql
+    return name, text, tuple(names)
+
+
+def run(cur, sql: str, params: Any = None):
+    '''
+    Выполняет запрос как серверный prepared statement: PREPARE один раз на
+    соединение пула, дальше только EXECUTE - без повторного разбора и
+    планирования. Параметры - как у cursor.execute (%s или %(name)s).
+    Соединения вне пула и запросы сверх PREPARED_LIMIT идут обычным execute.
+    '''
+    prepared = getattr(cur.connection, 'prepared', None)
+    name, text, names = prepared_form(sql)
+    if prepared is None or (name not in prepared and len(prepared) >= PREPARED_LIMIT):
+        return cur.execute(sql, params)
+    if name not in prepared:
+        cur.execute(f'PREPARE {name} AS {text}')
+        prepared.add(name)
+    values = [params[n] for n in names] if names else list(params or ())
+    if not values:
+        return cur.execute(f'EXECUTE {name}')
+    return cur.execute(f'EXECUTE {name}({", ".join(["%s"] * len(values))})', values)
+
+
+# OID типов колонок (cursor.description.type_code) и их представление в JSON
+ISO_TYPES = {1082, 1083, 1114, 1184, 1266}  # date, time, timestamp, timestamptz, timetz -> isoformat()
+FLOAT_TYPES = {1700}  # numeric -> float
+
+Extra = Sequence[Tuple[str, Callable[[Tuple], Any]]]
+
+
+def column_value(index: int, type_code: int) -> str:
+    if type_code in ISO_TYPES:
+        return f'(None if r[{index}] is None else r[{index}].isoformat())'
+    if type_code in FLOAT_TYPES:
+        return f'(None if r[{index}] is None else float(r[{index}]))'
+    return f'r[{index}]'
+
+
+@functools.lru_cache(maxsize=256)
+def row_encoder(columns: Tuple[Tuple[str, int], ...], extra: Tuple[str, ...], skip: Tuple[str, ...]) -> Callable:
+    '''
+    Собирает под набор колонок функцию кортеж -> dict с конвертерами по типу
+    колонки: без циклов по полям и проверок типов на каждой строке.
+    Дополнительные поля считаются функциями x[i](row).
+    '''
+    fields = [f'{name!r}: {column_value(i, type_code)}'
+              for i, (name, type_code) in enumerate(columns) if name not in skip]
+    fields += [f'{name!r}: x[{i}](r)' for i, name in enumerate(extra)]
+    return eval('lambda r, x: {' + ', '.join(fields) + '}')
+
+
+def shape_rows(cur, rows: List[Tuple], extra: Extra = (), skip: Sequence[str] = (), columnar: bool = False) -> Any:
+    '''
+    Строки курсора -> JSON-готовые данные. По умолчанию список объектов;
+    columnar=True - {"columns": [...], "values": [[значения колонки], ...]}:
+    имена колонок один раз и по массиву на колонку.
+    '''
+    columns = tuple((c.name, c.type_code) for c in cur.description)
+    if columnar:
+        return columnar_rows(columns, rows, extra, skip)
+    encode = row_encoder(columns, tuple(name for name, _ in extra), tuple(skip))
+    functions = tuple(fn for _, fn in extra)
+    with span('shape'):
+        return [encode(row, functions) for row in rows]
+
+
+def columnar_rows(columns: Tuple[Tuple[str, int], ...], rows: List[Tuple], extra: Extra, skip: Sequence[str]) -> Dict[str, Any]:
+    with span('shape'):
+        transposed = list(zip(*rows)) if rows else [()] * len(columns)
+        names: List[str] = []
+        values: List[Any] = []
+        for (name, type_code), column in zip(columns, transposed):
+            if name in skip:
+                continue
+            if type_code in ISO_TYPES:
+                column = [None if v is None else v.isoformat() for v in column]
+            elif type_code in FLOAT_TYPES:
+                column = [None if v is None else float(v) for v in column]
+            names.append(name)
+            values.append(column)
+        for name, fn in extra:
+            names.append(name)
+            values.append([fn(row) for row in rows])
+        return {'columns': names, 'values': values}
+
+
+def wants_columnar(event: Dict[str, Any]) -> bool:
+    return (event.get('queryStringParameters') or {}).get('format') == 'columnar'
+
+
+SESSION_SECRET = os.environ.get('SESSION_SECRET', '')
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(12 * 3600)))
+REVOCATION_SYNC = float(os.environ.get('REVOCATION_SYNC', '10'))
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def _signature(payload: str) -> str:
+    return _b64encode(hmac.new(SESSION_SECRET.encode(), payload.encode(), hashlib.sha256).digest()[:16])
+
+
+def issue_token(user_id: int, role: str, class_id: Optional[int]) -> Tuple[str, int]:
+    '''Токен "payload.signature": id, роль, класс, школа, срок и jti, подписанные HMAC-SHA256 секретом SESSION_SECRET'''
+    if not SESSION_SECRET:
+        raise RuntimeError('SESSION_SECRET не задан')
+    expires_at = int(time.time()) + SESSION_TTL
+    claims = {'id': user_id, 'role': role, 'class_id': class_id, 'exp': expires_at, 'jti': secrets.token_urlsafe(9)}
+    if current_tenant() is not DEFAULT_TENANT:
+        claims['tenant'] = current_tenant().slug
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f'{payload}.{_signature(payload)}', expires_at
+
+
+def verify_token(token: Optional[str]) -> Optional[Dict[str, Any]]:
+    '''Claims токена или None: подпись, срок и список отзыва проверяются без обращения к БД'''
+    if not token or not SESSION_SECRET or token.count('.') != 1:
+        return None
+    payload, signature = token.split('.')
+    try:
+        # Байты, а не str: compare_digest не принимает строки с не-ASCII символами
+        if not hmac.compare_digest(signature.encode(), _signature(payload).encode()):
+            return None
+    except UnicodeEncodeError:
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get('exp', 0) <= time.time() or revocations.is_revoked(claims.get('jti')):
+        return None
+    return claims
+
+
+def session_from_event(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    token = request_header(event, 'X-Auth-Token')
+    if not token:
+        authorization = request_header(event, 'Authorization') or ''
+        token = authorization[7:] if authorization.startswith('Bearer ') else None
+    return verify_token(token)
+
+
+class RevocationList:
+    '''
+    Отозванные jti в памяти процесса. Отзыв в этом процессе виден сразу; отзывы
+    из других функций подтягиваются из revoked_tokens не чаще раза в
+    REVOCATION_SYNC секунд - попутно при выдаче соединения из пула.
+    '''
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._revoked: Dict[str, int] = {}
+        self._synced_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        return jti in self._revoked
+
+    def revoke(self, conn, claims: Dict[str, Any]) -> None:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                INSERT INTO {DB_SCHEMA}.revoked_tokens (jti, user_id, expires_at) VALUES (%s, %s, %s)
+                ON CONFLICT (jti) DO NOTHING
+            ''', (claims['jti'], claims.get('id'), claims['exp']))
+            cur.execute(f'DELETE FROM {DB_SCHEMA}.revoked_tokens WHERE expires_at < %s', (int(time.time()),))
+        conn.commit()
+        with self._lock:
+            self._revoked[claims['jti']] = claims['exp']
+
+    def due(self) -> bool:
+        return time.monotonic() - self._synced_at >= self.interval
+
+    def sync_if_due(self, conn) -> None:
+        if not self.due():
+            return
+        self._synced_at = time.monotonic()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'SELECT jti, expires_at FROM {DB_SCHEMA}.revoked_tokens WHERE expires_at > %s', (int(time.time()),))
+                revoked = dict(cur.fetchall())
+            conn.rollback()
+        except psycopg2.Error:
+            # Без таблицы (миграция не применена) работаем с тем, что отозвано в этом процессе
+            conn.rollback()
+            return
+        with self._lock:
+            self._revoked = revoked
+
+
+revocations = RevocationList(REVOCATION_SYNC)
@@ -6,11 +6,12 @@ Returns: HTTP response dict with user data or error
 '''
 
 import json
-import os
 from typing import Dict, Any
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+import db
+
+@db.instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -21,31 +22,71 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Tenant, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    # Get database connection
-    db_url = os.environ.get('DATABASE_URL')
+    params = event.get('queryStringParameters') or {}
+    if params.get('pool') == 'stats':
+        return db.pool_stats_response(event)
+    
+    # GET ?action=session - проверить токен (подпись и срок, без запроса к users)
+    if method == 'GET' and params.get('action') == 'session':
+        # Соединение нужно, только когда пора подтянуть отзывы токенов из других функций
+        if db.revocations.due():
+            db.release(db.acquire())
+        session = db.session_from_event(event)
+        if not session:
+            return session_error()
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'success': True, 'session': session})
+        }
     
     try:
-        conn = psycopg2.connect(db_url)
+        conn = db.acquire()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
+        # POST ?action=logout - отозвать токен
+        if method == 'POST' and params.get('action') == 'logout':
+            session = db.session_from_event(event)
+            if not session:
+                return session_error()
+            db.revocations.revoke(conn, session)
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'success': True})
+            }
+        
         if method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             email = body_data.get('email', '')
             password = body_data.get('password', '')
             
-            # Simple query protocol - no parameters
-            query = f"SELECT id, email, role, full_name FROM users WHERE email = '{email}' AND password = '{password}'"
-            cur.execute(query)
+            db.run(cur, 'SELECT id, email, role, full_name, class_id FROM users WHERE email = %s AND password = %s', (email, password))
             user = cur.fetchone()
             
             if user:
+                result = {
+                    'success': True,
+                    'user': dict(user)
+                }
+                # Без SESSION_SECRET вход работает как раньше, только без токена
+                if db.SESSION_SECRET:
+                    result['token'], result['expires_at'] = db.issue_token(user['id'], user['role'], user['class_id'])
                 return {
                     'statusCode': 200,
                     'headers': {
@@ -53,10 +94,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Access-Control-Allow-Origin': '*'
                     },
                     'isBase64Encoded': False,
-                    'body': json.dumps({
-                        'success': True,
-                        'user': dict(user)
-                    })
+                    'body': json.dumps(result)
                 }
             else:
                 return {
@@ -96,4 +134,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
+            db.release(conn)
+
+
+def session_error() -> Dict[str, Any]:
+    return {
+        'statusCode': 401,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': json.dumps({'success': False, 'message': 'Сессия недействительна или истекла'})
+    }
@@ -0,0 +1,322 @@
+'''
+Business: Замеры всех сущностей и методов облачных функций на заданной конкурентности
+Args: --concurrency, --requests, --out; DATABASE_URL из окружения (данные - из backend/seed.py)
+Returns: файл с p50/p95/p99, rows/s и пиковым RSS по каждому сценарию, удобный для diff между прогонами
+
+Запуск: DATABASE_URL=postgresql://... python backend/bench.py --concurrency 1,8,32 --out bench.jsonl
+Обработчики вызываются в процессе через экземпляры из gateway.py, без HTTP.
+'''
+
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import psycopg2
+
+from gateway import FunctionHost
+
+# (params, body) для i-го запроса сценария
+Build = Callable[[Dict[str, Any], int], Tuple[Dict[str, str], Optional[Dict[str, Any]]]]
+
+
+class Scenario:
+    def __init__(self, name: str, function: str, method: str, build: Build, creates: Optional[str] = None):
+        self.name = name
+        self.function = function
+        self.method = method
+        self.build = build
+        # Созданные id складываются в очередь creates, PUT/DELETE берут их оттуда
+        self.creates = creates
+
+
+def taken(ctx: Dict[str, Any], queue: str) -> int:
+    with ctx['lock']:
+        ids: Deque[int] = ctx['created'][queue]
+        return ids.popleft() if ids else 0
+
+
+def peek(ctx: Dict[str, Any], queue: str, i: int) -> int:
+    ids: Deque[int] = ctx['created'][queue]
+    return ids[i % len(ids)] if ids else 0
+
+
+def unique(ctx: Dict[str, Any], i: int) -> str:
+    return f'{ctx["run"]}-{next(ctx["serial"])}'
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario('auth.login', 'auth', 'POST', lambda ctx, i: ({}, {'email': '22', 'password': '22'})),
+
+    Scenario('students.list', 'students', 'GET', lambda ctx, i: ({}, None)),
+    Scenario('students.create', 'students', 'POST', lambda ctx, i: (
+        {}, {'email': f'bench-{unique(ctx, i)}@bench.local', 'password': 'x', 'full_name': 'Бенчмарк Ученик'}
+    ), creates='students'),
+    Scenario('students.delete', 'students', 'DELETE', lambda ctx, i: ({'id': str(taken(ctx, 'students'))}, None)),
+
+    Scenario('subjects.list', 'subjects', 'GET', lambda ctx, i: ({}, None)),
+    Scenario('subjects.create', 'subjects', 'POST', lambda ctx, i: ({}, {'name': f'Бенчмарк {unique(ctx, i)}'}),
+             creates='subjects'),
+    Scenario('subjects.update', 'subjects', 'PUT', lambda ctx, i: (
+        {}, {'id': peek(ctx, 'subjects', i), 'name': f'Бенчмарк {unique(ctx, i)}', 'color': '#10b981'}
+    )),
+    Scenario('subjects.delete', 'subjects', 'DELETE', lambda ctx, i: ({'id': str(taken(ctx, 'subjects'))}, None)),
+
+    Scenario('school.classes.list', 'school', 'GET', lambda ctx, i: ({'entity': 'classes'}, None)),
+    Scenario('school.classes.create', 'school', 'POST', lambda ctx, i: (
+        {'entity': 'classes'}, {'name': f'b-{unique(ctx, i)}'[:50]}
+    ), creates='classes'),
+    Scenario('school.classes.delete', 'school', 'DELETE', lambda ctx, i: (
+        {'entity': 'classes', 'id': str(taken(ctx, 'classes'))}, None
+    )),
+
+    Scenario('school.teachers.list', 'school', 'GET', lambda ctx, i: ({'entity': 'teachers'}, None)),
+    Scenario('school.teachers.create', 'school', 'POST', lambda ctx, i: (
+        {'entity': 'teachers'},
+        {'email': f'bench-t-{unique(ctx, i)}@bench.local', 'full_name': 'Бенчмарк Учитель', 'subject_id': ctx['subject_id']}
+    ), creates='teachers'),
+    Scenario('school.teachers.update', 'school', 'PUT', lambda ctx, i: (
+        {'entity': 'teachers'},
+        {'id': peek(ctx, 'teachers', i), 'email': f'bench-t-{unique(ctx, i)}@bench.local',
+         'full_name': 'Бенчмарк Учитель', 'subject_id': ctx['subject_id']}
+    )),
+    Scenario('school.teachers.delete', 'school', 'DELETE', lambda ctx, i: (
+        {'entity': 'teachers', 'id': str(taken(ctx, 'teachers'))}, None
+    )),
+
+    Scenario('school.homework.list', 'school', 'GET', lambda ctx, i: ({'entity': 'homework'}, None)),
+    Scenario('school.homework.class', 'school', 'GET', lambda ctx, i: (
+        {'entity': 'homework', 'class_id': str(ctx['class_id'])}, None
+    )),
+    Scenario('school.homework.stream', 'school', 'GET', lambda ctx, i: ({'entity': 'homework', 'format': 'ndjson'}, None)),
+    Scenario('school.homework.create', 'school', 'POST', lambda ctx, i: (
+        {'entity': 'homework'},
+        {'class_id': ctx['class_id'], 'subject_id': ctx['subject_id'], 'teacher_id': ctx['teacher_id'],
+         'title': f'Бенчмарк {unique(ctx, i)}', 'description': '', 'due_date': '2099-01-01'}
+    ), creates='homework'),
+    Scenario('school.homework.delete', 'school', 'DELETE', lambda ctx, i: (
+        {'entity': 'homework', 'id': str(taken(ctx, 'homework'))}, None
+    )),
+
+    Scenario('school.grades.student', 'school', 'GET', lambda ctx, i: (
+        {'entity': 'grades', 'student_id': str(ctx['student_ids'][i % len(ctx['student_ids'])])}, None
+    )),
+    Scenario('school.grades.student_stats', 'school', 'GET', lambda ctx, i: (
+        {'entity': 'grades', 'stats': 'true', 'student_id': str(ctx['student_ids'][i % len(ctx['student_ids'])])}, None
+    )),
+    Scenario('school.grades.teacher', 'school', 'GET', lambda ctx, i: (
+        {'entity': 'grades', 'teacher_id': str(ctx['teacher_id'])}, None
+    )),
+    Scenario('school.grades.create', 'school', 'POST', lambda ctx, i: (
+        {'entity': 'grades'},
+        {'student_id': ctx['student_ids'][i % len(ctx['student_ids'])], 'subject_id': ctx['subject_id'],
+         'teacher_id': ctx['teacher_id'], 'grade': 1 + i % 5, 'lesson_date': '2099-01-01'}
+    ), creates='grades'),
+    Scenario('school.grades.delete', 'school', 'DELETE', lambda ctx, i: (
+        {'entity': 'grades', 'id': str(taken(ctx, 'grades'))}, None
+    )),
+    Scenario('school.grades.bulk', 'school', 'POST', lambda ctx, i: (
+        {'entity': 'grades', 'bulk': 'true'},
+        {'grades': [{'student_id': s, 'subject_id': ctx['subject_id'], 'teacher_id': ctx['teacher_id'],
+                     'grade': 1 + (s + i) % 5, 'comment': 'bench', 'lesson_date': '2099-01-02'}
+                    for s in ctx['student_ids'][:30]]}
+    )),
+    Scenario('school.dashboard', 'school', 'GET', lambda ctx, i: (
+        {'entity': 'dashboard', 'student_id': str(ctx['student_ids'][i % len(ctx['student_ids'])])}, None
+    )),
+    Scenario('school.grade_stats.verify', 'school', 'GET', lambda ctx, i: ({'entity': 'grade_stats'}, None)),
+
+    Scenario('schedule.page', 'schedule', 'GET', lambda ctx, i: ({'limit': '100'}, None)),
+    Scenario('schedule.class_week', 'schedule', 'GET', lambda ctx, i: (
+        {'class_id': str(ctx['class_id']), 'date_from': ctx['week_from'], 'date_to': ctx['week_to']}, None
+    )),
+    Scenario('schedule.week_grid', 'schedule', 'GET', lambda ctx, i: (
+        {'action': 'week', 'class_id': str(ctx['class_id']), 'date': ctx['week_from']}, None
+    )),
+    Scenario('schedule.clashes', 'schedule', 'GET', lambda ctx, i: (
+        {'action': 'clashes', 'date_from': ctx['week_from'], 'date_to': ctx['week_to']}, None
+    )),
+    Scenario('schedule.create', 'schedule', 'POST', lambda ctx, i: (
+        {}, {'day_of_week': 'monday', 'time_start': '08:00', 'time_end': '08:45', 'subject': 'Бенчмарк',
+             'teacher': '', 'lesson_date': '2099-01-05', 'notes': unique(ctx, i)}
+    ), creates='schedule'),
+    Scenario('schedule.update', 'schedule', 'PUT', lambda ctx, i: (
+        {}, {'id': peek(ctx, 'schedule', i), 'day_of_week': 'monday', 'time_start': '09:00', 'time_end': '09:45',
+             'subject': 'Бенчмарк', 'teacher': '', 'lesson_date': '2099-01-05', 'notes': unique(ctx, i)}
+    )),
+    Scenario('schedule.delete', 'schedule', 'DELETE', lambda ctx, i: ({'id': str(taken(ctx, 'schedule'))}, None)),
+]
+
+
+def load_context(dsn: str, run: str) -> Dict[str, Any]:
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, subject_id FROM users WHERE role = 'teacher' AND subject_id IS NOT NULL ORDER BY id LIMIT 1")
+        teacher = cur.fetchone()
+        cur.execute("SELECT class_id FROM users WHERE role = 'student' AND class_id IS NOT NULL GROUP BY class_id ORDER BY count(*) DESC LIMIT 1")
+        class_row = cur.fetchone()
+        cur.execute("SELECT id FROM users WHERE role = 'student' ORDER BY id LIMIT 200")
+        students = [r[0] for r in cur.fetchall()]
+        cur.execute('SELECT min(lesson_date) FROM schedule WHERE lesson_date IS NOT NULL')
+        first_day = cur.fetchone()[0]
+    finally:
+        conn.close()
+    if not teacher or not class_row or not students or not first_day:
+        raise SystemExit('Мало данных для замеров: сначала запустите backend/seed.py')
+    return {
+        'run': run,
+        'lock': threading.Lock(),
+        'serial': itertools.count(),
+        'created': {name: deque() for name in ('students', 'subjects', 'classes', 'teachers', 'homework', 'grades', 'schedule')},
+        'teacher_id': teacher[0],
+        'subject_id': teacher[1],
+        'class_id': class_row[0],
+        'student_ids': students,
+        'week_from': first_day.isoformat(),
+        'week_to': first_day.fromordinal(first_day.toordinal() + 6).isoformat()
+    }
+
+
+def cleanup(dsn: str) -> None:
+    '''Пакетные оценки сценария school.grades.bulk не удаляются через API'''
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM grades WHERE comment = 'bench' AND lesson_date = '2099-01-02'")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def count_rows(body: str) -> int:
+    if body.startswith('{"') and '\n{"' in body:
+        return body.count('\n') + (0 if body.endswith('\n') else 1)
+    try:
+        payload = json.loads(body) if body else None
+    except ValueError:
+        return 0
+    if isinstance(payload, list):
+        return len(payload)
+    if isinstance(payload, dict):
+        for value in payload.values():
+            if isinstance(value, list):
+                return len(value)
+        return 1
+    return 0
+
+
+def percentile(samples: List[float], p: float) -> float:
+    return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+
+
+def reset_peak_rss() -> bool:
+    '''Сбрасывает пик RSS процесса (VmHWM), чтобы пик считался по одному сценарию; Linux 4.0+'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        with open('/proc/self/status') as f:
+            match = re.search(r'^VmHWM:\s+(\d+) kB', f.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return round(int(match.group(1)) / 1024, 1) if match else None
+
+
+def run_scenario(host: FunctionHost, scenario: Scenario, ctx: Dict[str, Any],
+                 concurrency: int, requests: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    rows = 0
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        nonlocal rows, errors
+        params, body = scenario.build(ctx, i)
+        event = {
+            'httpMethod': scenario.method,
+            'headers': {},
+            'queryStringParameters': params,
+            'body': json.dumps(body) if body is not None else '',
+            'isBase64Encoded': False
+        }
+        response, _, elapsed = host.invoke(event)
+        text = response.get('body') or ''
+        ok = response.get('statusCode', 500) < 400
+        with lock:
+            latencies.append(elapsed)
+            if ok:
+                rows += count_rows(text)
+            else:
+                errors += 1
+        if ok and scenario.creates:
+            created = json.loads(text).get('id')
+            if created:
+                with ctx['lock']:
+                    ctx['created'][scenario.creates].append(created)
+
+    # Без сброса пик остался бы максимумом за весь прогон, а не за этот сценарий
+    peak_resettable = reset_peak_rss()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'scenario': scenario.name,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'req_per_s': round(requests / wall, 1),
+        'rows_per_s': round(rows / wall, 1),
+        'peak_rss_mb': peak_rss_mb() if peak_resettable else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замеры обработчиков облачных функций')
+    parser.add_argument('--concurrency', default='1,8,32', help='уровни конкурентности через запятую')
+    parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий и уровень')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--only', default='', help='префикс имени сценария, например school.grades')
+    parser.add_argument('--out', default='bench.jsonl')
+    args = parser.parse_args()
+
+    context = load_context(os.environ['DATABASE_URL'], str(int(time.time())))
+    levels = [int(level) for level in args.concurrency.split(',')]
+    hosts: Dict[str, FunctionHost] = {}
+    results = []
+    for level in levels:
+        for scenario in SCENARIOS:
+            if not scenario.name.startswith(args.only):
+                continue
+            # Экземпляров столько же, сколько потоков: как облако под такой нагрузкой
+            host = hosts.setdefault(f'{scenario.function}:{level}',
+                                    FunctionHost(scenario.function, level, float('inf'), False))
+            run_scenario(host, scenario, context, 1, args.warmup)
+            result = run_scenario(host, scenario, context, level, args.requests)
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+
+    cleanup(os.environ['DATABASE_URL'])
+
+    # Одна строка на сценарий в стабильном порядке - файлы прогонов сравниваются через diff
+    with open(args.out, 'w') as f:
+        for result in sorted(results, key=lambda r: (r['scenario'], r['concurrency'])):
+            f.write(json.dumps(result, ensure_ascii=False, sort_keys=True) + '\n')
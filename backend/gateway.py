@@ -0,0 +1,273 @@
+'''
+Business: Локальный шлюз для нагрузочного тестирования всех облачных функций в одном процессе
+Args: --port, --workers, --max-instances, --keep-warm, --cold; DATABASE_URL из окружения
+Returns: HTTP-сервер: /<функция>?... -> handler(event, context) из backend/<функция>/index.py
+
+Запуск: DATABASE_URL=postgresql://... python backend/gateway.py --port 8080 --workers 32
+Статистика по функциям (cold/warm старты, p50/p95/p99): GET /_gateway/stats
+'''
+
+import argparse
+import asyncio
+import base64
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from types import ModuleType, SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+LATENCY_SAMPLES = 10000
+MAX_BODY_BYTES = 50 * 1024 * 1024
+
+_import_lock = threading.Lock()
+
+
+def function_names() -> List[str]:
+    with open(os.path.join(BACKEND_DIR, 'func2url.json')) as f:
+        return sorted(json.load(f))
+
+
+def load_function(name: str, instance: int) -> ModuleType:
+    '''
+    Загружает свежую копию backend/<name>/index.py вместе с соседними модулями
+    (db.py и т.п.). У каждой функции свой db.py, поэтому на время импорта
+    одноимённые модули убираются из sys.modules: каждый экземпляр получает
+    собственные копии, а значит и собственный пул соединений, как отдельный контейнер.
+    '''
+    directory = os.path.join(BACKEND_DIR, name)
+    siblings = [f[:-3] for f in os.listdir(directory) if f.endswith('.py') and f != 'index.py']
+    with _import_lock:
+        saved = {s: sys.modules.pop(s) for s in siblings if s in sys.modules}
+        sys.path.insert(0, directory)
+        try:
+            spec = importlib.util.spec_from_file_location(f'gateway_{name}_{instance}_index', os.path.join(directory, 'index.py'))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        finally:
+            sys.path.remove(directory)
+            for s in siblings:
+                sys.modules.pop(s, None)
+            sys.modules.update(saved)
+    return module
+
+
+def unload_function(module: ModuleType) -> None:
+    '''Выгружаемый экземпляр закрывает свой пул, как при остановке контейнера'''
+    db = getattr(module, 'db', None)
+    if db is not None and hasattr(db, 'close_pool'):
+        db.close_pool()
+
+
+class FunctionHost:
+    '''
+    Экземпляры одной функции. Экземпляр обслуживает один запрос за раз, как
+    контейнер в облаке: свободный тёплый экземпляр переиспользуется, иначе
+    поднимается новый (холодный старт), если не превышен max_instances.
+    Экземпляры, простоявшие дольше keep_warm, выгружаются.
+    '''
+
+    def __init__(self, name: str, max_instances: int, keep_warm: float, always_cold: bool):
+        self.name = name
+        self.max_instances = max_instances
+        self.keep_warm = keep_warm
+        self.always_cold = always_cold
+        self._idle: List[Tuple[ModuleType, float]] = []
+        self._running = 0
+        self._created = 0
+        self._cond = threading.Condition()
+        self.cold_starts = 0
+        self.warm_starts = 0
+        self.requests = 0
+        self.errors = 0
+        self.latencies: List[float] = []
+
+    def _expire(self) -> List[ModuleType]:
+        '''Убирает из простаивающих экземпляры старше keep_warm; вызывается под _cond'''
+        now = time.monotonic()
+        expired = [m for m, t in self._idle if now - t >= self.keep_warm]
+        self._idle = [(m, t) for m, t in self._idle if now - t < self.keep_warm]
+        return expired
+
+    def _take(self) -> Tuple[Optional[ModuleType], bool]:
+        with self._cond:
+            expired = self._expire()
+            while not self._idle and self._running >= self.max_instances:
+                self._cond.wait()
+                expired += self._expire()
+            self._running += 1
+            if self._idle and not self.always_cold:
+                self.warm_starts += 1
+                module, cold = self._idle.pop()[0], False
+            else:
+                self.cold_starts += 1
+                self._created += 1
+                module, cold = None, True
+        for old in expired:
+            unload_function(old)
+        return module, cold
+
+    def _give_back(self, module: Optional[ModuleType]) -> None:
+        with self._cond:
+            self._running -= 1
+            keep = module is not None and not self.always_cold
+            if keep:
+                self._idle.append((module, time.monotonic()))
+            self._cond.notify()
+        if module is not None and not keep:
+            unload_function(module)
+
+    def invoke(self, event: Dict[str, Any]) -> Tuple[Dict[str, Any], bool, float]:
+        module, cold = self._take()
+        started = time.perf_counter()
+        try:
+            if module is None:
+                module = load_function(self.name, self._created)
+            context = SimpleNamespace(request_id=str(uuid.uuid4()), function_name=self.name)
+            response = module.handler(event, context)
+        except Exception as e:
+            # Экземпляр после исключения не переиспользуется, как упавший контейнер
+            if module is not None:
+                unload_function(module)
+            module = None
+            response = {'statusCode': 502, 'headers': {'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': f'{type(e).__name__}: {e}'})}
+        finally:
+            self._give_back(module)
+        elapsed = time.perf_counter() - started
+        with self._cond:
+            self.requests += 1
+            if response.get('statusCode', 500) >= 500:
+                self.errors += 1
+            if len(self.latencies) >= LATENCY_SAMPLES:
+                self.latencies[self.requests % LATENCY_SAMPLES] = elapsed
+            else:
+                self.latencies.append(elapsed)
+        return response, cold, elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            samples = sorted(self.latencies)
+            idle = len(self._idle)
+
+        def pct(p: float) -> Optional[float]:
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3) if samples else None
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'cold_starts': self.cold_starts,
+            'warm_starts': self.warm_starts,
+            'idle_instances': idle,
+            'p50_ms': pct(0.50),
+            'p95_ms': pct(0.95),
+            'p99_ms': pct(0.99)
+        }
+
+
+class Gateway:
+    def __init__(self, args: argparse.Namespace):
+        self.hosts = {name: FunctionHost(name, args.max_instances, args.keep_warm, args.cold)
+                      for name in function_names()}
+        self.executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='handler')
+
+    def build_event(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Tuple[str, Dict[str, Any]]:
+        parts = urlsplit(target)
+        segments = parts.path.strip('/').split('/', 1)
+        name = segments[0]
+        try:
+            text, is_base64 = body.decode('utf-8'), False
+        except UnicodeDecodeError:
+            text, is_base64 = base64.b64encode(body).decode('ascii'), True
+        return name, {
+            'httpMethod': method,
+            'path': '/' + (segments[1] if len(segments) > 1 else ''),
+            'headers': headers,
+            'queryStringParameters': dict(parse_qsl(parts.query, keep_blank_values=True)),
+            'body': text,
+            'isBase64Encoded': is_base64,
+            'requestContext': {'requestId': str(uuid.uuid4())}
+        }
+
+    async def dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        if urlsplit(target).path.rstrip('/') == '/_gateway/stats':
+            payload = {name: host.stats() for name, host in self.hosts.items()}
+            return 200, {'Content-Type': 'application/json'}, json.dumps(payload).encode()
+
+        name, event = self.build_event(method, target, headers, body)
+        host = self.hosts.get(name)
+        if host is None:
+            return 404, {'Content-Type': 'application/json'}, json.dumps({'error': f'Нет функции {name}'}).encode()
+
+        loop = asyncio.get_running_loop()
+        response, cold, elapsed = await loop.run_in_executor(self.executor, host.invoke, event)
+        out_headers = {str(k): str(v) for k, v in (response.get('headers') or {}).items()}
+        out_headers['X-Gateway-Start'] = 'cold' if cold else 'warm'
+        out_headers['X-Gateway-Duration-Ms'] = f'{elapsed * 1000:.3f}'
+        raw = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            payload = base64.b64decode(raw)
+        else:
+            payload = raw.encode('utf-8') if isinstance(raw, str) else bytes(raw)
+        return int(response.get('statusCode', 200)), out_headers, payload
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                method, target, version = lines[0].split(' ', 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        key, value = line.split(':', 1)
+                        headers[key.strip()] = value.strip()
+                lowered = {k.lower(): v for k, v in headers.items()}
+                length = int(lowered.get('content-length', '0'))
+                if length > MAX_BODY_BYTES:
+                    status, out_headers, payload = 413, {}, b''
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, out_headers, payload = await self.dispatch(method, target, headers, body)
+
+                keep_alive = version == 'HTTP/1.1' and lowered.get('connection', '').lower() != 'close'
+                out_headers['Content-Length'] = str(len(payload))
+                out_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+                reason = HTTPStatus(status).phrase if status in HTTPStatus._value2member_map_ else ''
+                response_head = f'HTTP/1.1 {status} {reason}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in out_headers.items())
+                writer.write(response_head.encode('latin-1') + b'\r\n' + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+
+async def main(args: argparse.Namespace) -> None:
+    gateway = Gateway(args)
+    server = await asyncio.start_server(gateway.serve_connection, args.host, args.port, backlog=1024)
+    for name in gateway.hosts:
+        print(f'{name}: http://{args.host}:{args.port}/{name}', file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальный шлюз облачных функций')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=32, help='потоков для обработчиков')
+    parser.add_argument('--max-instances', type=int, default=8, help='экземпляров на функцию')
+    parser.add_argument('--keep-warm', type=float, default=600, help='секунд простоя до выгрузки экземпляра')
+    parser.add_argument('--cold', action='store_true', help='каждый запрос - холодный старт')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,73 @@
+'''
+Business: Поиск пересечений уроков по учителю, классу и кабинету (sweep line)
+Args: rows - кортежи (id, day_of_week, lesson_date, time_start, time_end, teacher_id, class_id, room)
+Returns: список найденных пересечений (не больше limit) и признак, что были ещё
+'''
+
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+LessonRow = Tuple[Any, ...]
+
+
+def resource_keys(row: LessonRow) -> List[Tuple[str, Any]]:
+    keys = []
+    if row[5] is not None:
+        keys.append(('teacher', row[5]))
+    if row[6] is not None:
+        keys.append(('class', row[6]))
+    if row[7]:
+        keys.append(('room', row[7]))
+    return keys
+
+
+def sweep(lessons: List[LessonRow]) -> Iterator[Tuple[LessonRow, LessonRow]]:
+    '''Пары пересекающихся по времени уроков: идём по началу, держа список ещё не закончившихся'''
+    lessons.sort(key=lambda r: r[3])
+    active: List[LessonRow] = []
+    for lesson in lessons:
+        start = lesson[3]
+        active = [other for other in active if other[4] > start]
+        for other in active:
+            yield other, lesson
+        active.append(lesson)
+
+
+def find_clashes(rows: Sequence[LessonRow], limit: Optional[int] = None,
+                 lesson_ids: Optional[Set[Any]] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    '''
+    Раскладывает уроки по (ресурс, день недели, дата). Урок без даты повторяется
+    каждую неделю, поэтому еженедельная корзина ресурса добавляется к каждой его
+    датированной корзине того же дня недели. Внутри корзины - sweep line, так что
+    урок сравнивается только с одновременно идущими, а не со всеми уроками ресурса.
+    lesson_ids оставляет только пересечения с этими уроками. Проход останавливается,
+    как только набрано limit пересечений; второе значение - были ли ещё.
+    '''
+    buckets: Dict[Tuple[str, Any, str, Any], List[LessonRow]] = defaultdict(list)
+    for row in rows:
+        for kind, resource in resource_keys(row):
+            buckets[(kind, resource, row[1], row[2])].append(row)
+
+    clashes: List[Dict[str, Any]] = []
+    for (kind, resource, day, lesson_date), lessons in buckets.items():
+        if lesson_date is not None:
+            lessons = lessons + buckets.get((kind, resource, day, None), [])
+        if len(lessons) < 2:
+            continue
+        for first, second in sweep(lessons):
+            # Пары двух еженедельных уроков считаются в их собственной корзине
+            if lesson_date is not None and first[2] is None and second[2] is None:
+                continue
+            if lesson_ids is not None and first[0] not in lesson_ids and second[0] not in lesson_ids:
+                continue
+            if limit is not None and len(clashes) >= limit:
+                return clashes, True
+            clashes.append({
+                'resource': kind,
+                'resource_id': resource,
+                'day_of_week': day,
+                'lesson_date': lesson_date.isoformat() if lesson_date else None,
+                'lesson_ids': [first[0], second[0]]
+            })
+
+    return clashes, False
@@ -0,0 +1,124 @@
+'''
+Business: Лента iCalendar (RFC 5545) из уроков класса или учителя
+Args: rows - кортежи (id, day_of_week, lesson_date, time_start, time_end, subject, room, notes,
+      homework, created_at); урок без даты повторяется каждую неделю до конца учебного года,
+      кроме недель, где у владельца есть уроки с датой (как в недельной сетке)
+Returns: текст .ics с CRLF и переносом строк длиннее 75 байт
+'''
+
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Iterator, List, Sequence, Set, Tuple
+from zoneinfo import ZoneInfo
+
+SCHOOL_TZ = os.environ.get('SCHOOL_TZ', 'Europe/Moscow')
+PRODID = '-//edu-schedule-platform//schedule//RU'
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+RRULE_DAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+LessonRow = Tuple[Any, ...]
+
+
+def school_year(today: date) -> Tuple[date, date]:
+    start_year = today.year if today.month >= 9 else today.year - 1
+    return date(start_year, 9, 1), date(start_year + 1, 8, 31)
+
+
+def escape_text(value: str) -> str:
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold(line: str) -> str:
+    '''Перенос по 75 байт UTF-8, не разрывая символы; продолжение начинается с пробела'''
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts: List[str] = []
+    current, size, limit = [], 0, 75
+    for ch in line:
+        width = len(ch.encode('utf-8'))
+        if size + width > limit:
+            parts.append(''.join(current))
+            current, size, limit = [], 0, 74
+        current.append(ch)
+        size += width
+    parts.append(''.join(current))
+    return '\r\n '.join(parts)
+
+
+def local_stamp(day: date, moment: time) -> str:
+    return datetime.combine(day, moment).strftime('%Y%m%dT%H%M%S')
+
+
+def utc_stamp(moment: datetime) -> str:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def vtimezone(zone: str, today: date) -> List[str]:
+    '''
+    Пояс со смещением на начало учебного года. В России переходов на летнее время нет,
+    поэтому одного STANDARD достаточно; для поясов с переходами нужен полный VTIMEZONE.
+    '''
+    offset = datetime.combine(today, time(12), ZoneInfo(zone)).strftime('%z')
+    return [
+        'BEGIN:VTIMEZONE', f'TZID:{zone}',
+        'BEGIN:STANDARD', 'DTSTART:19700101T000000',
+        f'TZOFFSETFROM:{offset}', f'TZOFFSETTO:{offset}',
+        'END:STANDARD', 'END:VTIMEZONE'
+    ]
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def lesson_event(row: LessonRow, year_start: date, year_end: date, zone: str,
+                 dated_weeks: Set[date], uid_domain: str) -> List[str]:
+    row_id, day_of_week, lesson_date, time_start, time_end, subject, room, notes, homework, created_at = row
+    if lesson_date is None:
+        weekday = WEEKDAYS.index(day_of_week)
+        first = year_start + timedelta(days=(weekday - year_start.weekday()) % 7)
+        repeat = [f'RRULE:FREQ=WEEKLY;BYDAY={RRULE_DAYS[weekday]};UNTIL={utc_stamp(datetime.combine(year_end, time(23, 59, 59)))}']
+        # Неделю с датированными уроками недельная сетка показывает только по ним
+        skipped = sorted(day for day in (week + timedelta(days=weekday) for week in dated_weeks)
+                         if first <= day <= year_end)
+        if skipped:
+            repeat.append(f'EXDATE;TZID={zone}:' + ','.join(local_stamp(day, time_start) for day in skipped))
+    else:
+        first, repeat = lesson_date, []
+    description = '\n'.join(part for part in (f'ДЗ: {homework}' if homework else '', notes or '') if part)
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:lesson-{row_id}@{uid_domain}',
+        f'DTSTAMP:{utc_stamp(created_at or datetime(1970, 1, 1))}',
+        f'DTSTART;TZID={zone}:{local_stamp(first, time_start)}',
+        f'DTEND;TZID={zone}:{local_stamp(first, time_end)}',
+        *repeat,
+        f'SUMMARY:{escape_text(subject or "")}'
+    ]
+    if room:
+        lines.append(f'LOCATION:{escape_text(room)}')
+    if description:
+        lines.append(f'DESCRIPTION:{escape_text(description)}')
+    lines.append('END:VEVENT')
+    return lines
+
+
+def render_calendar(name: str, rows: Sequence[LessonRow], year_start: date, year_end: date,
+                    schema: str, zone: str = SCHOOL_TZ) -> str:
+    '''schema школы входит в UID: id уроков в схемах разных школ совпадают'''
+    dated_weeks = {week_start(row[2]) for row in rows if row[2] is not None}
+    uid_domain = f'{schema}.edu-schedule-platform'
+
+    def lines() -> Iterator[str]:
+        yield from ['BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN',
+                    f'X-WR-CALNAME:{escape_text(name)}', f'X-WR-TIMEZONE:{zone}']
+        yield from vtimezone(zone, year_start)
+        for row in rows:
+            yield from lesson_event(row, year_start, year_end, zone, dated_weeks, uid_domain)
+        yield 'END:VCALENDAR'
+
+    return ''.join(fold(line) + '\r\n' for line in lines())
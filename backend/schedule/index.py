@@ -5,12 +5,749 @@ Args: event - dict with httpMethod, body, queryStringParameters
 Returns: HTTP response dict with schedule data or error
 '''
 
+import base64
+import hashlib
 import json
-import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import time as clock
+from datetime import date, time, timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Any, List, Optional, Set, Tuple
+from urllib.parse import quote
+from psycopg2.extras import RealDictCursor, execute_values
 
+import db
+import ical
+import storage
+import timetable
+from clashes import find_clashes
+
+SCHEDULE_COLUMNS = (
+    's.id, s.day_of_week, s.time_start, s.time_end, s.subject, s.subject_id, s.teacher, s.teacher_id, '
+    's.class_id, s.room, s.notes, s.lesson_date, s.homework, s.homework_files, s.template_id, s.created_at'
+)
+
+DAY_ORDER = {
+    'monday': 1, 'tuesday': 2, 'wednesday': 3, 'thursday': 4,
+    'friday': 5, 'saturday': 6, 'sunday': 7
+}
+
+MAX_PAGE_SIZE = 500
+MAX_TERM_DAYS = 400
+MAX_CLASHES_REPORTED = 500
+MAX_GENERATOR_SECONDS = 55
+
+TEMPLATE_COLUMNS = 'id, class_id, day_of_week, time_start, time_end, subject, subject_id, teacher, teacher_id, room, notes'
+
+CLASH_COLUMNS = 'id, day_of_week, lesson_date, time_start, time_end, teacher_id, class_id, room'
+
+# Недельная сетка: scope -> колонка владельца в schedule
+WEEK_GRID_OWNERS = {'class': 'class_id', 'teacher': 'teacher_id'}
+
+WEEK_GRID_LOOKUP = 'SELECT payload FROM schedule_week_grid WHERE scope = %s AND owner_id = %s AND week_start = %s'
+
+# Уроки недели владельца с датой, а если их нет - еженедельные (как на главном экране ученика)
+WEEK_GRID_BUILD = '''
+    INSERT INTO schedule_week_grid (scope, owner_id, week_start, payload)
+    SELECT %(scope)s::text, %(owner_id)s::integer, %(week_start)s::date, json_build_object(
+        'scope', %(scope)s::text,
+        'owner_id', %(owner_id)s::integer,
+        'week', %(week)s::text,
+        'week_start', %(week_start)s::date,
+        'lessons', COALESCE((SELECT json_agg(l ORDER BY l.lesson_date NULLS FIRST,
+            array_position(ARRAY['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']::varchar[], l.day_of_week),
+            l.time_start, l.id) FROM (
+                SELECT {columns}, sub.name AS subject_name, sub.color AS subject_color
+                FROM schedule s
+                LEFT JOIN subjects sub ON sub.id = s.subject_id
+                WHERE s.{owner} = %(owner_id)s
+                  AND (s.lesson_date BETWEEN %(week_start)s AND %(week_end)s
+                       OR (s.lesson_date IS NULL AND NOT EXISTS (
+                            SELECT 1 FROM schedule d
+                            WHERE d.{owner} = %(owner_id)s AND d.lesson_date BETWEEN %(week_start)s AND %(week_end)s)))
+            ) l), '[]')
+    )::text
+    ON CONFLICT (scope, owner_id, week_start) DO UPDATE SET payload = EXCLUDED.payload, built_at = CURRENT_TIMESTAMP
+    RETURNING payload
+'''
+
+ICAL_LOOKUP = '''
+    SELECT payload, etag, modified_at FROM schedule_ical
+    WHERE scope = %s AND owner_id = %s AND window_start = %s AND payload IS NOT NULL
+'''
+
+ICAL_NAMES = {
+    'class': "SELECT 'Класс ' || name FROM classes WHERE id = %s",
+    'teacher': "SELECT COALESCE(full_name, email) FROM users WHERE id = %s"
+}
+
+# Уроки с датой до начала учебного года в ленту не попадают
+ICAL_LESSONS = '''
+    SELECT id, day_of_week, lesson_date, time_start, time_end, subject, room, notes, homework, created_at
+    FROM schedule
+    WHERE {owner} = %s AND (lesson_date IS NULL OR lesson_date >= %s)
+    ORDER BY sort_date, day_order, time_start, id
+'''
+
+# Пересборка без реальных изменений (тот же ETag) не сдвигает Last-Modified
+ICAL_SAVE = '''
+    INSERT INTO schedule_ical (scope, owner_id, window_start, payload, etag)
+    VALUES (%(scope)s, %(owner_id)s, %(window_start)s, %(payload)s, %(etag)s)
+    ON CONFLICT (scope, owner_id) DO UPDATE SET
+        window_start = EXCLUDED.window_start,
+        payload = EXCLUDED.payload,
+        etag = EXCLUDED.etag,
+        modified_at = CASE WHEN schedule_ical.etag = EXCLUDED.etag THEN schedule_ical.modified_at
+                           ELSE COALESCE(schedule_ical.changed_at, CURRENT_TIMESTAMP) END,
+        changed_at = NULL
+    RETURNING payload, etag, modified_at
+'''
+
+
+def encode_cursor(lesson_date: Optional[date], day_order: int, time_start: time, row_id: int) -> str:
+    key = [lesson_date.isoformat() if lesson_date else '-infinity', day_order, str(time_start), row_id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(value: str) -> List[Any]:
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        lesson_date, day_order, time_start, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return [str(lesson_date), int(day_order), str(time_start), int(row_id)]
+    except (ValueError, TypeError):
+        raise ValueError('Некорректный cursor')
+
+
+def build_schedule_filters(params: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    '''Условия WHERE для GET; ValueError на некорректных параметрах'''
+    where: List[str] = []
+    args: List[Any] = []
+    
+    for field in ('class_id', 'teacher_id'):
+        if params.get(field):
+            where.append(f's.{field} = %s')
+            args.append(int(params[field]))
+    if params.get('day_of_week'):
+        if params['day_of_week'] not in DAY_ORDER:
+            raise ValueError('Некорректный day_of_week')
+        where.append('s.day_order = %s')
+        args.append(DAY_ORDER[params['day_of_week']])
+    if params.get('date_from'):
+        where.append('s.sort_date >= %s')
+        args.append(date.fromisoformat(params['date_from']))
+    if params.get('date_to'):
+        where.append('s.sort_date <= %s AND s.lesson_date IS NOT NULL')
+        args.append(date.fromisoformat(params['date_to']))
+    if params.get('cursor'):
+        lesson_date, day_order, time_start, row_id = decode_cursor(params['cursor'])
+        # Первое условие - диапазон по ведущей колонке индекса, второе отсекает уже отданное внутри даты
+        where.append('s.sort_date <= %s::date AND (s.sort_date < %s::date OR (s.day_order, s.time_start, s.id) > (%s, %s::time, %s))')
+        args.extend([lesson_date, lesson_date, day_order, time_start, row_id])
+    
+    return where, args
+
+
+def json_response(status_code: int, payload: Any) -> Dict[str, Any]:
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': json.dumps(payload)
+    }
+
+
+def parse_template_slot(item: Dict[str, Any]) -> Dict[str, Any]:
+    '''Проверяет слот недельного шаблона; ValueError с описанием ошибки'''
+    if item.get('day_of_week') not in DAY_ORDER:
+        raise ValueError('Некорректный day_of_week')
+    time_start = time.fromisoformat(str(item.get('time_start')))
+    time_end = time.fromisoformat(str(item.get('time_end')))
+    if time_start >= time_end:
+        raise ValueError('time_start должен быть раньше time_end')
+    if not str(item.get('subject') or '').strip():
+        raise ValueError('subject обязателен')
+    return {
+        'id': int(item['id']) if item.get('id') else None,
+        'day_of_week': item['day_of_week'],
+        'time_start': time_start,
+        'time_end': time_end,
+        'subject': str(item['subject']).strip(),
+        'subject_id': int(item['subject_id']) if item.get('subject_id') else None,
+        'teacher': item.get('teacher') or '',
+        'teacher_id': int(item['teacher_id']) if item.get('teacher_id') else None,
+        'room': str(item.get('room') or '').strip(),
+        'notes': item.get('notes') or ''
+    }
+
+
+def parse_holidays(values: List[Any]) -> List[date]:
+    '''Выходные: отдельные даты "YYYY-MM-DD" или диапазоны {"from": ..., "to": ...}'''
+    days: List[date] = []
+    for value in values or []:
+        if isinstance(value, dict):
+            current, last = date.fromisoformat(value['from']), date.fromisoformat(value['to'])
+            if (last - current).days > MAX_TERM_DAYS:
+                raise ValueError('Слишком длинный диапазон выходных')
+            while current <= last:
+                days.append(current)
+                current += timedelta(days=1)
+        else:
+            days.append(date.fromisoformat(str(value)))
+    return days
+
+
+def template_to_json(row: Dict[str, Any]) -> Dict[str, Any]:
+    item = dict(row)
+    item['time_start'] = str(item['time_start'])
+    item['time_end'] = str(item['time_end'])
+    return item
+
+
+def handle_templates(method: str, event: Dict[str, Any], cur, conn) -> Dict[str, Any]:
+    '''GET - недельный шаблон класса, PUT - заменить шаблон (слоты с id обновляются на месте)'''
+    if method == 'GET':
+        class_id = (event.get('queryStringParameters') or {}).get('class_id')
+        if not class_id:
+            return json_response(400, {'error': 'class_id обязателен'})
+        db.run(cur, f'SELECT {TEMPLATE_COLUMNS} FROM schedule_templates WHERE class_id = %s ORDER BY time_start, id', (int(class_id),))
+        slots = sorted(cur.fetchall(), key=lambda r: (DAY_ORDER[r['day_of_week']], r['time_start'], r['id']))
+        return json_response(200, {'templates': [template_to_json(r) for r in slots]})
+    
+    if method == 'PUT':
+        body_data = json.loads(event.get('body', '{}'))
+        try:
+            class_id = int(body_data.get('class_id'))
+            slots = [parse_template_slot(item) for item in body_data.get('slots', [])]
+        except (TypeError, ValueError, KeyError) as e:
+            return json_response(400, {'error': str(e)})
+        
+        keep_ids = [slot['id'] for slot in slots if slot['id']]
+        db.run(cur, 'DELETE FROM schedule_templates WHERE class_id = %s AND id <> ALL(%s)', (class_id, keep_ids))
+        for slot in slots:
+            values = (slot['day_of_week'], slot['time_start'], slot['time_end'], slot['subject'], slot['subject_id'],
+                      slot['teacher'], slot['teacher_id'], slot['room'], slot['notes'])
+            if slot['id']:
+                db.run(cur, '''
+                    UPDATE schedule_templates
+                    SET day_of_week = %s, time_start = %s, time_end = %s, subject = %s, subject_id = %s,
+                        teacher = %s, teacher_id = %s, room = %s, notes = %s
+                    WHERE id = %s AND class_id = %s
+                ''', values + (slot['id'], class_id))
+                if cur.rowcount == 0:
+                    conn.rollback()
+                    return json_response(404, {'error': f"Слот {slot['id']} не найден в шаблоне класса"})
+            else:
+                db.run(cur, '''
+                    INSERT INTO schedule_templates
+                    (class_id, day_of_week, time_start, time_end, subject, subject_id, teacher, teacher_id, room, notes)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ''', (class_id,) + values)
+        conn.commit()
+        
+        db.run(cur, f'SELECT {TEMPLATE_COLUMNS} FROM schedule_templates WHERE class_id = %s ORDER BY id', (class_id,))
+        return json_response(200, {'success': True, 'templates': [template_to_json(r) for r in cur.fetchall()]})
+    
+    return json_response(405, {'error': 'Method not allowed'})
+
+
+def expand_term(event: Dict[str, Any], cur, conn) -> Dict[str, Any]:
+    '''
+    Разворачивает недельный шаблон класса в датированные уроки за период одним
+    INSERT ... SELECT по generate_series. Повторный вызов идемпотентен: уроки
+    из шаблона обновляются по (template_id, lesson_date) с сохранением notes и
+    homework, а уроки удалённых слотов и выходных дней удаляются.
+    '''
+    body_data = json.loads(event.get('body', '{}'))
+    try:
+        class_id = int(body_data.get('class_id'))
+        date_from = date.fromisoformat(body_data.get('date_from', ''))
+        date_to = date.fromisoformat(body_data.get('date_to', ''))
+        holidays = parse_holidays(body_data.get('holidays'))
+    except (TypeError, ValueError, KeyError) as e:
+        return json_response(400, {'error': str(e)})
+    if date_from > date_to or (date_to - date_from).days > MAX_TERM_DAYS:
+        return json_response(400, {'error': f'date_from должен быть не позже date_to, период - не длиннее {MAX_TERM_DAYS} дней'})
+    
+    term_days = '''
+        SELECT d::date AS lesson_date,
+               (ARRAY['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday'])[EXTRACT(ISODOW FROM d)] AS day_of_week
+        FROM generate_series(%(date_from)s::date, %(date_to)s::date, interval '1 day') d
+        WHERE d::date <> ALL(%(holidays)s::date[])
+    '''
+    args = {'class_id': class_id, 'date_from': date_from, 'date_to': date_to, 'holidays': holidays}
+    
+    db.run(cur, f'''
+        DELETE FROM schedule s
+        WHERE s.class_id = %(class_id)s AND s.template_id IS NOT NULL
+          AND s.lesson_date BETWEEN %(date_from)s AND %(date_to)s
+          AND NOT EXISTS (
+              SELECT 1 FROM schedule_templates t JOIN ({term_days}) td ON td.day_of_week = t.day_of_week
+              WHERE t.class_id = %(class_id)s AND t.id = s.template_id AND td.lesson_date = s.lesson_date
+          )
+    ''', args)
+    removed = cur.rowcount
+    
+    db.run(cur, f'''
+        INSERT INTO schedule (day_of_week, time_start, time_end, subject, subject_id, teacher, teacher_id, class_id, room, notes, lesson_date, homework, homework_files, template_id)
+        SELECT t.day_of_week, t.time_start, t.time_end, t.subject, t.subject_id, t.teacher, t.teacher_id, t.class_id, t.room, t.notes, td.lesson_date, '', '', t.id
+        FROM schedule_templates t
+        JOIN ({term_days}) td ON td.day_of_week = t.day_of_week
+        WHERE t.class_id = %(class_id)s
+        ON CONFLICT (template_id, lesson_date) WHERE template_id IS NOT NULL DO UPDATE SET
+            day_of_week = EXCLUDED.day_of_week, time_start = EXCLUDED.time_start, time_end = EXCLUDED.time_end,
+            subject = EXCLUDED.subject, subject_id = EXCLUDED.subject_id, teacher = EXCLUDED.teacher,
+            teacher_id = EXCLUDED.teacher_id, class_id = EXCLUDED.class_id, room = EXCLUDED.room
+        RETURNING id, (xmax = 0) AS inserted
+    ''', args)
+    upserted = cur.fetchall()
+    
+    # Пересечения только сообщаются: шаблон мог быть уже согласован с другими классами вручную
+    expanded_ids = {row['id'] for row in upserted}
+    clashes, clashes_truncated = scan_clashes(conn, date_from, date_to, expanded_ids)
+    conn.commit()
+    
+    created = sum(1 for row in upserted if row['inserted'])
+    return json_response(200, {
+        'success': True,
+        'created': created,
+        'updated': len(upserted) - created,
+        'removed': removed,
+        'clashes': clashes,
+        'clashes_truncated': clashes_truncated
+    })
+
+
+def lesson_values(body_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'day_of_week': body_data.get('day_of_week', ''),
+        'time_start': body_data.get('time_start', ''),
+        'time_end': body_data.get('time_end', ''),
+        'subject': body_data.get('subject', ''),
+        'subject_id': body_data.get('subject_id') or None,
+        'teacher': body_data.get('teacher', ''),
+        'teacher_id': body_data.get('teacher_id') or None,
+        'class_id': body_data.get('class_id') or None,
+        'room': str(body_data.get('room') or '').strip(),
+        'notes': body_data.get('notes', ''),
+        'lesson_date': body_data.get('lesson_date') or None,
+        'homework': body_data.get('homework', ''),
+        'homework_files': storage.externalize_files(body_data.get('homework_files', ''))
+    }
+
+
+def find_write_conflicts(cur, lesson: Dict[str, Any], exclude_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    '''
+    Проверка одной записи: ищет уроки того же учителя, класса или кабинета,
+    пересекающиеся по времени в тот же день. Идёт по индексам *_slot.
+    Перед проверкой берёт advisory-локи ресурсов, чтобы параллельные записи
+    не прошли проверку одновременно.
+    '''
+    lock_keys = sorted(
+        f'{kind}:{lesson[field]}'
+        for kind, field in (('teacher', 'teacher_id'), ('class', 'class_id'), ('room', 'room'))
+        if lesson[field]
+    )
+    if not lock_keys:
+        return []
+    db.run(cur, 'SELECT pg_advisory_xact_lock(hashtext(k)) FROM unnest(%s::text[]) k', (lock_keys,))
+    
+    db.run(cur, '''
+        SELECT s.id, s.lesson_date, s.time_start, s.time_end,
+               s.teacher_id = %(teacher_id)s AS teacher_clash,
+               s.class_id = %(class_id)s AS class_clash,
+               s.room <> '' AND s.room = %(room)s AS room_clash
+        FROM schedule s
+        WHERE s.day_order = %(day_order)s
+          AND s.time_start < %(time_end)s::time AND s.time_end > %(time_start)s::time
+          AND (%(lesson_date)s::date IS NULL OR s.lesson_date IS NULL OR s.lesson_date = %(lesson_date)s::date)
+          AND (s.teacher_id = %(teacher_id)s OR s.class_id = %(class_id)s OR (s.room <> '' AND s.room = %(room)s))
+          AND s.id <> %(exclude_id)s
+        ORDER BY s.time_start, s.id
+        LIMIT 20
+    ''', {**lesson, 'day_order': DAY_ORDER.get(lesson['day_of_week']), 'exclude_id': exclude_id or 0})
+    
+    conflicts = []
+    for row in cur.fetchall():
+        conflicts.append({
+            'id': row['id'],
+            'lesson_date': row['lesson_date'].isoformat() if row['lesson_date'] else None,
+            'time_start': str(row['time_start']),
+            'time_end': str(row['time_end']),
+            'resources': [kind for kind in ('teacher', 'class', 'room') if row[f'{kind}_clash']]
+        })
+    return conflicts
+
+
+def scan_clashes(conn, date_from: Optional[date], date_to: Optional[date],
+                 lesson_ids: Optional[Set[Any]] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    '''Все пересечения за период (плюс еженедельные уроки без даты) одним проходом sweep line'''
+    query = f'SELECT {CLASH_COLUMNS} FROM schedule WHERE (teacher_id IS NOT NULL OR class_id IS NOT NULL OR room <> \'\')'
+    args: List[Any] = []
+    if date_from:
+        query += ' AND (lesson_date IS NULL OR lesson_date >= %s)'
+        args.append(date_from)
+    if date_to:
+        query += ' AND (lesson_date IS NULL OR lesson_date <= %s)'
+        args.append(date_to)
+    with conn.cursor() as plain_cur:
+        db.run(plain_cur, query, args)
+        rows = plain_cur.fetchall()
+    return find_clashes(rows, MAX_CLASHES_REPORTED, lesson_ids)
+
+
+def parse_week(value: str) -> date:
+    '''Понедельник ISO-недели вида 2026-W37; ValueError на некорректном значении'''
+    try:
+        year, week = value.split('-W')
+        return date.fromisocalendar(int(year), int(week), 1)
+    except ValueError:
+        raise ValueError('Некорректная неделя, ожидается формат 2026-W37')
+
+
+def handle_clashes(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    params = event.get('queryStringParameters') or {}
+    try:
+        if params.get('week'):
+            date_from = parse_week(params['week'])
+            date_to = date_from + timedelta(days=6)
+        else:
+            date_from = date.fromisoformat(params['date_from']) if params.get('date_from') else None
+            date_to = date.fromisoformat(params['date_to']) if params.get('date_to') else None
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
+    
+    clashes, truncated = scan_clashes(conn, date_from, date_to)
+    return json_response(200, {'total': len(clashes), 'truncated': truncated, 'clashes': clashes})
+
+
+def handle_week(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    '''
+    Расписание класса или учителя на ISO-неделю: готовый JSON из schedule_week_grid
+    одним чтением по ключу. При промахе сетка собирается в PostgreSQL и сохраняется;
+    триггеры на schedule удаляют только сетки затронутых классов, учителей и недель.
+    '''
+    params = event.get('queryStringParameters') or {}
+    try:
+        owners = [(scope, int(params[field])) for scope, field in WEEK_GRID_OWNERS.items() if params.get(field)]
+        if len(owners) != 1:
+            raise ValueError('Нужен ровно один из class_id или teacher_id')
+        scope, owner_id = owners[0]
+        week_start = parse_week(params['week']) if params.get('week') else date.fromisoformat(params['date']) if params.get('date') else date.today()
+        week_start -= timedelta(days=week_start.weekday())
+    except (KeyError, ValueError) as e:
+        return json_response(400, {'error': str(e)})
+    
+    with conn.cursor() as plain_cur:
+        db.run(plain_cur, WEEK_GRID_LOOKUP, (scope, owner_id, week_start))
+        row = plain_cur.fetchone()
+        cache_status = 'hit'
+        if row is None:
+            # Shared-блокировка владельца: запись в schedule держит её эксклюзивно до коммита,
+            # поэтому сетка строится по снимку, в котором эта запись уже видна
+            db.run(plain_cur, "SELECT pg_advisory_xact_lock_shared(hashtext('week_grid:' || %s), %s)", (scope, owner_id))
+            iso_year, iso_week, _ = week_start.isocalendar()
+            db.run(plain_cur, WEEK_GRID_BUILD.format(columns=SCHEDULE_COLUMNS, owner=WEEK_GRID_OWNERS[scope]), {
+                'scope': scope,
+                'owner_id': owner_id,
+                'week': f'{iso_year}-W{iso_week:02d}',
+                'week_start': week_start,
+                'week_end': week_start + timedelta(days=6)
+            })
+            row = plain_cur.fetchone()
+            conn.commit()
+            cache_status = 'miss'
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'X-Week-Grid': cache_status
+        },
+        'isBase64Encoded': False,
+        'body': row[0]
+    }
+
+
+def handle_ical(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    '''
+    Подписка iCalendar класса или учителя на учебный год. Готовая лента лежит в schedule_ical;
+    запись в schedule помечает устаревшими только ленты затронутых классов и учителей
+    (forget_week_grid), и лента пересобирается при следующем запросе. Календарные клиенты
+    опрашивают ленту с If-None-Match / If-Modified-Since и без изменений получают 304.
+    '''
+    params = event.get('queryStringParameters') or {}
+    try:
+        owners = [(scope, int(params[field])) for scope, field in WEEK_GRID_OWNERS.items() if params.get(field)]
+        if len(owners) != 1:
+            raise ValueError('Нужен ровно один из class_id или teacher_id')
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
+    scope, owner_id = owners[0]
+    year_start, year_end = ical.school_year(date.today())
+    
+    with conn.cursor() as plain_cur:
+        db.run(plain_cur, ICAL_LOOKUP, (scope, owner_id, year_start))
+        row = plain_cur.fetchone()
+        cache_status = 'hit'
+        if row is None:
+            db.run(plain_cur, ICAL_NAMES[scope], (owner_id,))
+            name = plain_cur.fetchone()
+            if name is None:
+                conn.rollback()
+                return json_response(404, {'error': 'Класс или учитель не найден'})
+            # Та же shared-блокировка владельца, что и у недельной сетки
+            db.run(plain_cur, "SELECT pg_advisory_xact_lock_shared(hashtext('week_grid:' || %s), %s)", (scope, owner_id))
+            db.run(plain_cur, ICAL_LESSONS.format(owner=WEEK_GRID_OWNERS[scope]), (owner_id, year_start))
+            payload = ical.render_calendar(name[0], plain_cur.fetchall(), year_start, year_end, conn.schema)
+            db.run(plain_cur, ICAL_SAVE, {
+                'scope': scope,
+                'owner_id': owner_id,
+                'window_start': year_start,
+                'payload': payload,
+                'etag': hashlib.md5(payload.encode('utf-8')).hexdigest()
+            })
+            row = plain_cur.fetchone()
+            conn.commit()
+            cache_status = 'miss'
+    
+    payload, etag, modified_at = row
+    etag = f'"ical-{etag}"'
+    headers = {
+        'Content-Type': 'text/calendar; charset=utf-8',
+        'Content-Disposition': f'inline; filename="{scope}-{owner_id}.ics"',
+        'Access-Control-Allow-Origin': '*',
+        **db.etag_headers(etag),
+        'Last-Modified': format_datetime(modified_at, usegmt=True),
+        'Access-Control-Expose-Headers': 'ETag, Last-Modified',
+        'X-Ical-Cache': cache_status
+    }
+    not_modified = db.is_not_modified(event, etag)
+    since = db.request_header(event, 'If-Modified-Since')
+    if not not_modified and since and not db.request_header(event, 'If-None-Match'):
+        try:
+            not_modified = modified_at.replace(microsecond=0) <= parsedate_to_datetime(since)
+        except (TypeError, ValueError):
+            pass
+    if not_modified:
+        return {'statusCode': 304, 'headers': headers, 'isBase64Encoded': False, 'body': ''}
+    return {'statusCode': 200, 'headers': headers, 'isBase64Encoded': False, 'body': payload}
+
+
+def request_bytes(event: Dict[str, Any]) -> bytes:
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        return base64.b64decode(body)
+    return body.encode('utf-8') if isinstance(body, str) else bytes(body)
+
+
+def upload_status(upload_id: str, meta: Dict[str, Any], received: int) -> Dict[str, Any]:
+    return {'upload_id': upload_id, 'size': meta['size'], 'received': received, 'chunk_size': storage.FILES_CHUNK_SIZE}
+
+
+def handle_upload(method: str, event: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Докачиваемая загрузка вложения частями:
+    POST {name, type, size, sha256?} - начать (если файл с таким sha256 уже есть, сразу ссылка);
+    PUT ?upload_id=&offset= с байтами части в теле - дописать; GET ?upload_id= - сколько получено.
+    Последняя часть завершает загрузку и возвращает ссылку {name, type, size, sha256}.
+    '''
+    params = event.get('queryStringParameters') or {}
+    store = storage.tenant_store()
+    try:
+        if method == 'POST':
+            body_data = json.loads(event.get('body') or '{}')
+            size = int(body_data.get('size'))
+            if size < 0 or size > storage.FILES_MAX_SIZE:
+                raise storage.StorageError(f'Размер файла от 0 до {storage.FILES_MAX_SIZE} байт')
+            name, content_type = str(body_data.get('name') or 'file'), str(body_data.get('type') or '')
+            sha256 = (body_data.get('sha256') or '').lower() or None
+            if sha256 and store.size(sha256) == size:
+                return json_response(200, {'complete': True, 'file': storage.file_ref(name, content_type, size, sha256)})
+            upload_id = store.start_upload({'name': name, 'type': content_type, 'size': size, 'sha256': sha256})
+            if size == 0:
+                sha256 = store.finish_upload(upload_id)
+                return json_response(200, {'complete': True, 'file': storage.file_ref(name, content_type, 0, sha256)})
+            return json_response(201, {'complete': False, **upload_status(upload_id, {'size': size}, 0)})
+        
+        upload_id = params.get('upload_id', '')
+        if method == 'GET':
+            meta, received = store.upload_state(upload_id)
+            return json_response(200, upload_status(upload_id, meta, received))
+        
+        if method == 'PUT':
+            received = store.append_chunk(upload_id, int(params.get('offset', '')), request_bytes(event))
+            meta, _ = store.upload_state(upload_id)
+            if received < meta['size']:
+                return json_response(200, {'complete': False, **upload_status(upload_id, meta, received)})
+            sha256 = store.finish_upload(upload_id)
+            return json_response(200, {'complete': True, 'file': storage.file_ref(meta['name'], meta['type'], meta['size'], sha256)})
+    except KeyError:
+        return json_response(404, {'error': 'Загрузка не найдена или устарела'})
+    except (TypeError, ValueError) as e:
+        return json_response(400, {'error': str(e)})
+    
+    return json_response(405, {'error': 'Method not allowed'})
+
+
+def handle_download(event: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Вложение по sha256; Range: bytes=... отдаёт 206 с частью, ETag - сам sha256. Тип берётся
+    из метаданных блоба, а не из запроса: ссылка с type=text/html отдала бы чужой HTML с нашего домена.
+    '''
+    params = event.get('queryStringParameters') or {}
+    sha256 = (params.get('sha256') or '').lower()
+    store = storage.tenant_store()
+    try:
+        size = store.size(sha256)
+    except storage.StorageError as e:
+        return json_response(400, {'error': str(e)})
+    if size is None:
+        return json_response(404, {'error': 'Файл не найден'})
+    
+    etag = f'"{sha256}"'
+    name = params.get('name') or sha256
+    headers = {
+        'Content-Type': store.content_type(sha256),
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(name)}",
+        'X-Content-Type-Options': 'nosniff',
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Content-Range, Accept-Ranges, Content-Length, ETag'
+    }
+    if db.is_not_modified(event, etag):
+        return {'statusCode': 304, 'headers': headers, 'isBase64Encoded': False, 'body': ''}
+    
+    try:
+        byte_range = storage.parse_range(db.request_header(event, 'Range'), size)
+    except storage.StorageError:
+        return {'statusCode': 416, 'headers': {**headers, 'Content-Range': f'bytes */{size}'}, 'isBase64Encoded': False, 'body': ''}
+    status = 200
+    start, end = 0, size - 1
+    if byte_range and byte_range != (0, size - 1):
+        status, (start, end) = 206, byte_range
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    data = store.read_range(sha256, start, end) if size else b''
+    return {
+        'statusCode': status,
+        'headers': {**headers, 'Content-Length': str(len(data))},
+        'isBase64Encoded': True,
+        'body': base64.b64encode(data).decode('ascii')
+    }
+
+
+def generate_timetable(event: Dict[str, Any], cur, conn) -> Dict[str, Any]:
+    '''
+    Составляет недельное расписание по квотам часов и записывает его в schedule
+    уроками без даты (повторяются каждую неделю), заменяя прежние недельные уроки
+    этих классов. С save_templates=true пишет и шаблоны для action=expand.
+    '''
+    body_data = json.loads(event.get('body', '{}'))
+    try:
+        days = body_data.get('days') or timetable.DEFAULT_DAYS
+        if any(day not in DAY_ORDER for day in days):
+            raise ValueError('Некорректный день в days')
+        periods = [(str(p['time_start']), str(p['time_end'])) for p in body_data['periods']] \
+            if body_data.get('periods') else timetable.DEFAULT_PERIODS
+        for start, end in periods:
+            if time.fromisoformat(start) >= time.fromisoformat(end):
+                raise ValueError('time_start урока должен быть раньше time_end')
+        quotas = [{
+            'class_id': int(q['class_id']),
+            'subject_id': int(q['subject_id']),
+            'hours': int(q['hours']),
+            **({'teacher_id': int(q['teacher_id'])} if q.get('teacher_id') else {})
+        } for q in body_data.get('quotas', [])]
+        if not quotas or any(not 0 < q['hours'] <= len(days) * len(periods) for q in quotas):
+            raise ValueError('Нужны quotas с hours от 1 до числа слотов в неделе')
+        unavailable: Dict[int, Set[int]] = {}
+        for item in body_data.get('unavailable', []):
+            day_index = days.index(item['day_of_week'])
+            blocked = item.get('periods', range(len(periods)))
+            unavailable.setdefault(int(item['teacher_id']), set()).update(
+                day_index * len(periods) + int(p) for p in blocked)
+        attempts = max(1, min(int(body_data.get('attempts', 8)), 64))
+        time_limit = min(float(body_data.get('time_limit', 20)), MAX_GENERATOR_SECONDS)
+    except (TypeError, ValueError, KeyError) as e:
+        return json_response(400, {'error': str(e)})
+    
+    db.run(cur, "SELECT id, full_name, subject_id FROM users WHERE role = 'teacher' AND subject_id IS NOT NULL")
+    teachers = {row['id']: row for row in cur.fetchall()}
+    # Явно указанный учитель должен вести предмет квоты, иначе решатель поставил бы его на чужой урок
+    wrong_teacher = [q for q in quotas if 'teacher_id' in q and (
+        q['teacher_id'] not in teachers or teachers[q['teacher_id']]['subject_id'] != q['subject_id'])]
+    if wrong_teacher:
+        return json_response(400, {'error': 'Учитель в квоте не ведёт этот предмет', 'quotas': wrong_teacher})
+    subject_names = {subject_id: row[0] for subject_id, row in db.reference_cache.get(conn, 'subjects').items()}
+    
+    # Недельные уроки других классов уже занимают учителей
+    class_ids = sorted({q['class_id'] for q in quotas})
+    db.run(cur, '''
+        SELECT teacher_id, day_of_week, time_start, time_end FROM schedule
+        WHERE lesson_date IS NULL AND teacher_id IS NOT NULL AND (class_id IS NULL OR NOT (class_id = ANY(%s)))
+    ''', (class_ids,))
+    for row in cur.fetchall():
+        if row['day_of_week'] not in days:
+            continue
+        day_index = days.index(row['day_of_week'])
+        for period_index, (start, end) in enumerate(periods):
+            if row['time_start'] < time.fromisoformat(end) and row['time_end'] > time.fromisoformat(start):
+                unavailable.setdefault(row['teacher_id'], set()).add(day_index * len(periods) + period_index)
+    
+    started = clock.monotonic()
+    attempt_log: List[Dict[str, Any]] = []
+    result = timetable.generate(
+        quotas, {t: row['subject_id'] for t, row in teachers.items()}, unavailable,
+        len(days), len(periods), attempts=attempts, time_limit=time_limit,
+        progress=attempt_log.append
+    )
+    
+    rows = []
+    for item in result['placements']:
+        start, end = periods[item['period']]
+        teacher = teachers.get(item['teacher_id'])
+        rows.append((days[item['day']], start, end, subject_names.get(item['subject_id'], ''), item['subject_id'],
+                     teacher['full_name'] if teacher else '', item['teacher_id'], item['class_id'], ''))
+    
+    if not body_data.get('dry_run'):
+        db.run(cur, 'DELETE FROM schedule WHERE lesson_date IS NULL AND template_id IS NULL AND class_id = ANY(%s)', (class_ids,))
+        execute_values(cur, '''
+            INSERT INTO schedule (day_of_week, time_start, time_end, subject, subject_id, teacher, teacher_id, class_id, notes)
+            VALUES %s
+        ''', rows, page_size=1000)
+        if body_data.get('save_templates'):
+            db.run(cur, 'DELETE FROM schedule_templates WHERE class_id = ANY(%s)', (class_ids,))
+            execute_values(cur, '''
+                INSERT INTO schedule_templates (day_of_week, time_start, time_end, subject, subject_id, teacher, teacher_id, class_id, notes)
+                VALUES %s
+            ''', rows, page_size=1000)
+        conn.commit()
+    
+    return json_response(200, {
+        'success': not result['unplaced'] and not result['problems'],
+        'placed': len(result['placements']),
+        'unplaced': result['unplaced'],
+        'problems': result['problems'],
+        'seed': result['seed'],
+        'iterations': result['iterations'],
+        'seconds': round(clock.monotonic() - started, 3),
+        'attempts': attempt_log,
+        'lessons': None if not body_data.get('dry_run') else [
+            dict(zip(('day_of_week', 'time_start', 'time_end', 'subject', 'subject_id', 'teacher', 'teacher_id', 'class_id'), row))
+            for row in rows
+        ]
+    })
+
+
+def conflict_response(conflicts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return json_response(409, {'error': 'Урок пересекается с уже запланированными', 'conflicts': conflicts})
+
+
+@db.instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -21,69 +758,114 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Tenant, Authorization, If-None-Match, If-Modified-Since, Range',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    db_url = os.environ.get('DATABASE_URL')
+    params = event.get('queryStringParameters') or {}
+    if params.get('pool') == 'stats':
+        return db.pool_stats_response(event)
+    # Файлы не трогают БД: соединение из пула не берём
+    if params.get('action') == 'upload':
+        return handle_upload(method, event)
+    if params.get('action') == 'download' and method == 'GET':
+        return handle_download(event)
     
     try:
-        conn = psycopg2.connect(db_url)
+        conn = db.acquire()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # GET - получить все расписание
+        action = params.get('action')
+        if action == 'templates':
+            return handle_templates(method, event, cur, conn)
+        if action == 'expand' and method == 'POST':
+            return expand_term(event, cur, conn)
+        if action == 'clashes' and method == 'GET':
+            return handle_clashes(event, conn)
+        if action == 'week' and method == 'GET':
+            return handle_week(event, conn)
+        if action == 'ical' and method == 'GET':
+            return handle_ical(event, conn)
+        if action == 'generate' and method == 'POST':
+            return generate_timetable(event, cur, conn)
+        
+        # GET - получить расписание (с фильтрами и keyset-пагинацией по limit/cursor)
         if method == 'GET':
-            query = "SELECT s.*, sub.name as subject_name, sub.color as subject_color FROM schedule s LEFT JOIN subjects sub ON s.subject_id = sub.id ORDER BY s.lesson_date DESC NULLS LAST, CASE s.day_of_week WHEN 'monday' THEN 1 WHEN 'tuesday' THEN 2 WHEN 'wednesday' THEN 3 WHEN 'thursday' THEN 4 WHEN 'friday' THEN 5 WHEN 'saturday' THEN 6 WHEN 'sunday' THEN 7 END, s.time_start"
-            cur.execute(query)
-            schedules = cur.fetchall()
+            try:
+                where, args = build_schedule_filters(params)
+                limit = min(int(params['limit']), MAX_PAGE_SIZE) if params.get('limit') else None
+                if limit is not None and limit < 1:
+                    raise ValueError('limit должен быть положительным')
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': str(e)})
+                }
             
-            result = [dict(s) for s in schedules]
-            for item in result:
-                if item.get('time_start'):
-                    item['time_start'] = str(item['time_start'])
-                if item.get('time_end'):
-                    item['time_end'] = str(item['time_end'])
-                if item.get('created_at'):
-                    item['created_at'] = item['created_at'].isoformat()
-                if item.get('lesson_date'):
-                    item['lesson_date'] = item['lesson_date'].isoformat()
+            etag = db.make_etag('schedule', conn, ['schedule', 'subjects'])
+            if db.is_not_modified(event, etag):
+                return db.not_modified_response(etag)
+            
+            query = f"SELECT {SCHEDULE_COLUMNS}, s.day_order FROM schedule s"
+            if where:
+                query += ' WHERE ' + ' AND '.join(where)
+            query += ' ORDER BY s.sort_date DESC, s.day_order, s.time_start, s.id'
+            if limit is not None:
+                query += ' LIMIT %s'
+                args.append(limit + 1)
+            subjects = db.reference_cache.get(conn, 'subjects')
+            # Кортежи вместо RealDictCursor: строки кодируются общим сериализатором
+            with conn.cursor() as plain_cur:
+                db.run(plain_cur, query, args)
+                schedules = plain_cur.fetchall()
+                
+                next_cursor = None
+                if limit is not None and len(schedules) > limit:
+                    schedules = schedules[:limit]
+                    last = schedules[-1]
+                    next_cursor = encode_cursor(last[11], last[-1], last[2], last[0])
+                
+                result = db.shape_rows(plain_cur, schedules, skip=['day_order'], columnar=db.wants_columnar(event), extra=[
+                    ('subject_name', lambda r: subjects.get(r[5], (None, None))[0]),
+                    ('subject_color', lambda r: subjects.get(r[5], (None, None))[1])
+                ])
             
             return {
                 'statusCode': 200,
                 'headers': {
                     'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
+                    'Access-Control-Allow-Origin': '*',
+                    **db.etag_headers(etag)
                 },
                 'isBase64Encoded': False,
-                'body': json.dumps({'schedules': result})
+                'body': db.dumps({'schedules': result, 'next_cursor': next_cursor})
             }
         
         # POST - создать новую запись
         if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            day = body_data.get('day_of_week', '')
-            time_start = body_data.get('time_start', '')
-            time_end = body_data.get('time_end', '')
-            subject = body_data.get('subject', '')
-            subject_id = body_data.get('subject_id', '')
-            teacher = body_data.get('teacher', '')
-            notes = body_data.get('notes', '')
-            lesson_date = body_data.get('lesson_date', '')
-            homework = body_data.get('homework', '')
-            homework_files = body_data.get('homework_files', '')
-            
-            subject_id_value = f"{subject_id}" if subject_id else "NULL"
-            lesson_date_value = f"'{lesson_date}'" if lesson_date else "NULL"
+            try:
+                lesson = lesson_values(json.loads(event.get('body', '{}')))
+            except storage.StorageError as e:
+                return json_response(400, {'error': str(e)})
+            conflicts = find_write_conflicts(cur, lesson)
+            if conflicts:
+                conn.rollback()
+                return conflict_response(conflicts)
             
-            query = f"""
-                INSERT INTO schedule (day_of_week, time_start, time_end, subject, subject_id, teacher, notes, lesson_date, homework, homework_files) 
-                VALUES ('{day}', '{time_start}', '{time_end}', '{subject}', {subject_id_value}, '{teacher}', '{notes}', {lesson_date_value}, '{homework}', '{homework_files}')
+            query = """
+                INSERT INTO schedule (day_of_week, time_start, time_end, subject, subject_id, teacher, teacher_id, class_id, room, notes, lesson_date, homework, homework_files) 
+                VALUES (%(day_of_week)s, %(time_start)s, %(time_end)s, %(subject)s, %(subject_id)s, %(teacher)s, %(teacher_id)s, %(class_id)s, %(room)s, %(notes)s, %(lesson_date)s, %(homework)s, %(homework_files)s)
                 RETURNING id
             """
-            cur.execute(query)
+            db.run(cur, query, lesson)
             result = cur.fetchone()
             conn.commit()
             
@@ -103,28 +885,35 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         # PUT - обновить запись
         if method == 'PUT':
             body_data = json.loads(event.get('body', '{}'))
-            schedule_id = body_data.get('id')
-            day = body_data.get('day_of_week', '')
-            time_start = body_data.get('time_start', '')
-            time_end = body_data.get('time_end', '')
-            subject = body_data.get('subject', '')
-            subject_id = body_data.get('subject_id', '')
-            teacher = body_data.get('teacher', '')
-            notes = body_data.get('notes', '')
-            lesson_date = body_data.get('lesson_date', '')
-            homework = body_data.get('homework', '')
-            homework_files = body_data.get('homework_files', '')
+            schedule_id = int(body_data.get('id'))
+            try:
+                lesson = lesson_values(body_data)
+            except storage.StorageError as e:
+                return json_response(400, {'error': str(e)})
+            
+            # Старые клиенты не присылают учителя, класс и кабинет - сохраняем текущие
+            db.run(cur, 'SELECT teacher_id, class_id, room FROM schedule WHERE id = %s', (schedule_id,))
+            existing = cur.fetchone()
+            if not existing:
+                return json_response(404, {'error': 'Запись не найдена'})
+            for field in ('teacher_id', 'class_id', 'room'):
+                if field not in body_data:
+                    lesson[field] = existing[field]
             
-            subject_id_value = f"{subject_id}" if subject_id else "NULL"
-            lesson_date_value = f"'{lesson_date}'" if lesson_date else "NULL"
+            conflicts = find_write_conflicts(cur, lesson, exclude_id=schedule_id)
+            if conflicts:
+                conn.rollback()
+                return conflict_response(conflicts)
             
-            query = f"""
+            query = """
                 UPDATE schedule 
-                SET day_of_week = '{day}', time_start = '{time_start}', time_end = '{time_end}',
-                    subject = '{subject}', subject_id = {subject_id_value}, teacher = '{teacher}', notes = '{notes}', lesson_date = {lesson_date_value}, homework = '{homework}', homework_files = '{homework_files}'
-                WHERE id = {schedule_id}
+                SET day_of_week = %(day_of_week)s, time_start = %(time_start)s, time_end = %(time_end)s,
+                    subject = %(subject)s, subject_id = %(subject_id)s, teacher = %(teacher)s, teacher_id = %(teacher_id)s,
+                    class_id = %(class_id)s, room = %(room)s, notes = %(notes)s, lesson_date = %(lesson_date)s,
+                    homework = %(homework)s, homework_files = %(homework_files)s
+                WHERE id = %(id)s
             """
-            cur.execute(query)
+            db.run(cur, query, {**lesson, 'id': schedule_id})
             conn.commit()
             
             return {
@@ -142,8 +931,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             params = event.get('queryStringParameters', {})
             schedule_id = params.get('id', '')
             
-            query = f"DELETE FROM schedule WHERE id = {schedule_id}"
-            cur.execute(query)
+            db.run(cur, 'DELETE FROM schedule WHERE id = %s', (schedule_id,))
             conn.commit()
             
             return {
@@ -180,4 +968,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            db.release(conn)
\ No newline at end of file
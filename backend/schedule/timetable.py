@@ -0,0 +1,287 @@
+'''
+Business: Автоматическое составление недельного расписания всех классов
+Args: квоты часов (класс, предмет), учителя с subject_id, недоступные учителям слоты
+Returns: размещение уроков по слотам (день, урок) и список неразмещённых уроков
+'''
+
+import importlib
+import math
+import operator
+import os
+import random
+import site
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+DEFAULT_DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']
+DEFAULT_PERIODS = [
+    ('08:30', '09:15'), ('09:25', '10:10'), ('10:30', '11:15'), ('11:35', '12:20'),
+    ('12:30', '13:15'), ('13:25', '14:10'), ('14:20', '15:05')
+]
+TABU_TENURE = 7
+
+# (class_id, subject_id, teacher_id) - один урок в неделю
+Lesson = Tuple[int, int, int]
+
+
+def assign_teachers(
+    quotas: List[Dict[str, Any]],
+    teacher_subjects: Dict[int, int],
+    capacity: Dict[int, int]
+) -> Tuple[List[Lesson], List[Dict[str, Any]]]:
+    '''
+    Назначает учителя каждой паре (класс, предмет): явно указанного в квоте или
+    наименее загруженного из учителей этого предмета. Пара целиком ведётся одним учителем.
+    '''
+    by_subject: Dict[int, List[int]] = {}
+    for teacher_id, subject_id in teacher_subjects.items():
+        by_subject.setdefault(subject_id, []).append(teacher_id)
+
+    load: Dict[int, int] = {teacher_id: 0 for teacher_id in teacher_subjects}
+    lessons: List[Lesson] = []
+    problems: List[Dict[str, Any]] = []
+    # Большие квоты раздаём первыми, пока у учителей есть запас
+    for quota in sorted(quotas, key=lambda q: -q['hours']):
+        teacher_id = quota.get('teacher_id')
+        if teacher_id is None:
+            candidates = by_subject.get(quota['subject_id'], [])
+            if not candidates:
+                problems.append({**quota, 'reason': 'Нет учителя по предмету'})
+                continue
+            teacher_id = min(candidates, key=lambda t: (load[t] + quota['hours'] > capacity.get(t, 0), load[t], t))
+        load[teacher_id] = load.get(teacher_id, 0) + quota['hours']
+        lessons.extend([(quota['class_id'], quota['subject_id'], teacher_id)] * quota['hours'])
+
+    for teacher_id, hours in load.items():
+        if hours > capacity.get(teacher_id, 0):
+            problems.append({'teacher_id': teacher_id, 'hours': hours, 'available': capacity.get(teacher_id, 0),
+                             'reason': 'Нагрузка учителя больше числа доступных слотов'})
+    return lessons, problems
+
+
+def solve(problem: Dict[str, Any], seed: int) -> Dict[str, Any]:
+    '''
+    Одна попытка: жадная расстановка от самых стеснённых уроков, затем ремонт -
+    неразмещённый урок ставится в слот с наименьшим числом мешающих уроков,
+    мешающие снимаются и возвращаются в очередь (с табу на повторное снятие).
+    '''
+    rng = random.Random(seed)
+    n_days, n_periods = problem['n_days'], problem['n_periods']
+    n_slots = n_days * n_periods
+    lessons: List[Lesson] = problem['lessons']
+    unavailable: Dict[int, Set[int]] = problem['unavailable']
+    deadline = time.monotonic() + problem['time_limit']
+
+    day_limit: Dict[Tuple[int, int], int] = {}
+    for class_id, subject_id, _ in lessons:
+        day_limit[(class_id, subject_id)] = day_limit.get((class_id, subject_id), 0) + 1
+    for key, hours in day_limit.items():
+        day_limit[key] = math.ceil(hours / n_days) + 1
+
+    allowed: List[List[int]] = []
+    for _, _, teacher_id in lessons:
+        blocked = unavailable.get(teacher_id, set())
+        allowed.append([slot for slot in range(n_slots) if slot not in blocked])
+
+    slot_of: List[Optional[int]] = [None] * len(lessons)
+    class_at: Dict[Tuple[int, int], int] = {}
+    teacher_at: Dict[Tuple[int, int], int] = {}
+    per_day: Dict[Tuple[int, int, int], int] = {}
+    tabu: Dict[int, int] = {}
+
+    def place(index: int, slot: int) -> None:
+        class_id, subject_id, teacher_id = lessons[index]
+        slot_of[index] = slot
+        class_at[(class_id, slot)] = index
+        teacher_at[(teacher_id, slot)] = index
+        key = (class_id, subject_id, slot // n_periods)
+        per_day[key] = per_day.get(key, 0) + 1
+
+    def unplace(index: int) -> None:
+        class_id, subject_id, teacher_id = lessons[index]
+        slot = slot_of[index]
+        slot_of[index] = None
+        del class_at[(class_id, slot)]
+        del teacher_at[(teacher_id, slot)]
+        per_day[(class_id, subject_id, slot // n_periods)] -= 1
+
+    def day_ok(index: int, slot: int) -> bool:
+        class_id, subject_id, _ = lessons[index]
+        return per_day.get((class_id, subject_id, slot // n_periods), 0) < day_limit[(class_id, subject_id)]
+
+    def score(index: int, slot: int) -> float:
+        # Ранние уроки - компактнее день класса, одинаковые предметы - в разные дни
+        class_id, subject_id, _ = lessons[index]
+        same_day = per_day.get((class_id, subject_id, slot // n_periods), 0)
+        return slot % n_periods + 3 * same_day + rng.random()
+
+    # Сначала уроки учителей с наименьшим запасом свободных слотов
+    teacher_load: Dict[int, int] = {}
+    for _, _, teacher_id in lessons:
+        teacher_load[teacher_id] = teacher_load.get(teacher_id, 0) + 1
+    order = list(range(len(lessons)))
+    rng.shuffle(order)
+    order.sort(key=lambda i: len(allowed[i]) - teacher_load[lessons[i][2]])
+
+    queue: List[int] = []
+    for index in order:
+        class_id, _, teacher_id = lessons[index]
+        free = [s for s in allowed[index]
+                if (class_id, s) not in class_at and (teacher_id, s) not in teacher_at and day_ok(index, s)]
+        if free:
+            place(index, min(free, key=lambda s: score(index, s)))
+        else:
+            queue.append(index)
+
+    best_unplaced = list(queue)
+    best_slots = list(slot_of)
+    iterations = 0
+    while queue and iterations < problem['max_iterations'] and time.monotonic() < deadline:
+        iterations += 1
+        index = queue.pop(rng.randrange(len(queue)))
+        class_id, _, teacher_id = lessons[index]
+        candidates = []
+        for slot in allowed[index]:
+            if not day_ok(index, slot):
+                continue
+            blockers = {class_at.get((class_id, slot)), teacher_at.get((teacher_id, slot))} - {None}
+            if any(tabu.get(b, 0) > iterations for b in blockers):
+                continue
+            candidates.append((len(blockers), rng.random(), slot, blockers))
+        if not candidates:
+            queue.append(index)
+            continue
+        _, _, slot, blockers = min(candidates, key=lambda c: c[:3])
+        for blocker in blockers:
+            unplace(blocker)
+            queue.append(blocker)
+        place(index, slot)
+        tabu[index] = iterations + TABU_TENURE
+
+        if len(queue) < len(best_unplaced):
+            best_unplaced = list(queue)
+            best_slots = list(slot_of)
+
+    return {
+        'seed': seed,
+        'slots': best_slots,
+        'unplaced': best_unplaced,
+        'iterations': iterations
+    }
+
+
+class _ThisModule:
+    '''
+    Ссылка на этот модуль для задачи пула процессов: в дочернем процессе он
+    импортируется по имени из каталога функции, переданного в initializer.
+    Сама solve по имени не передаётся - там, где модуль загружен по пути (локальный
+    шлюз), pickle не нашёл бы её ни в родителе, ни в дочернем процессе.
+    '''
+
+    def __reduce__(self):
+        return importlib.import_module, (__name__,)
+
+
+def run_attempts(
+    problem: Dict[str, Any],
+    attempts: int,
+    workers: int,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Dict[str, Any]:
+    '''
+    Запускает независимые попытки с разными seed на нескольких ядрах и
+    возвращает лучшую. Там, где процессы недоступны (нет /dev/shm), попытки
+    идут последовательно в текущем процессе.
+    '''
+    best: Optional[Dict[str, Any]] = None
+    done = 0
+
+    def accept(result: Dict[str, Any]) -> bool:
+        nonlocal best, done
+        done += 1
+        if best is None or len(result['unplaced']) < len(best['unplaced']):
+            best = result
+        if progress:
+            progress({'attempt': done, 'attempts': attempts, 'unplaced': len(result['unplaced']),
+                      'best_unplaced': len(best['unplaced'])})
+        return not best['unplaced']
+
+    seeds = [problem.get('seed', 0) + i for i in range(attempts)]
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=site.addsitedir,
+                                     initargs=(os.path.dirname(os.path.abspath(__file__)),)) as executor:
+                futures = [executor.submit(operator.methodcaller('solve', problem, seed), _ThisModule())
+                           for seed in seeds]
+                for future in as_completed(futures):
+                    if accept(future.result()):
+                        for pending in futures:
+                            pending.cancel()
+                        break
+            return best
+        except (OSError, NotImplementedError):
+            pass
+
+    for seed in seeds[done:]:
+        if accept(solve(problem, seed)):
+            break
+    return best
+
+
+def generate(
+    quotas: List[Dict[str, Any]],
+    teacher_subjects: Dict[int, int],
+    unavailable: Dict[int, Set[int]],
+    n_days: int,
+    n_periods: int,
+    attempts: int = 8,
+    time_limit: float = 20.0,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Dict[str, Any]:
+    n_slots = n_days * n_periods
+    capacity = {t: n_slots - len(unavailable.get(t, set())) for t in teacher_subjects}
+    lessons, problems = assign_teachers(quotas, teacher_subjects, capacity)
+
+    problem = {
+        'n_days': n_days,
+        'n_periods': n_periods,
+        'lessons': lessons,
+        'unavailable': unavailable,
+        'time_limit': time_limit,
+        'max_iterations': 200 * max(len(lessons), 1)
+    }
+    workers = workers or min(attempts, os.cpu_count() or 1)
+    best = run_attempts(problem, attempts, workers, progress)
+
+    placements = [
+        {'class_id': c, 'subject_id': s, 'teacher_id': t, 'day': slot // n_periods, 'period': slot % n_periods}
+        for (c, s, t), slot in zip(lessons, best['slots']) if slot is not None
+    ]
+    unplaced = [
+        {'class_id': lessons[i][0], 'subject_id': lessons[i][1], 'teacher_id': lessons[i][2],
+         'reason': 'Не найден свободный слот для класса и учителя'}
+        for i in best['unplaced']
+    ]
+    return {'placements': placements, 'unplaced': unplaced, 'problems': problems,
+            'seed': best['seed'], 'iterations': best['iterations']}
+
+
+if __name__ == '__main__':
+    # Прогон на синтетической школе: python timetable.py [классов] [учителей]
+    n_classes = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    n_teachers = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    subjects = list(range(1, 16))
+    hours = [5, 4, 3, 3, 2, 2, 2, 2, 2, 2, 1, 2, 1, 1, 1]
+    # Учителей по предмету пропорционально его часам
+    weighted = [s for s, h in zip(subjects, hours) for _ in range(h)]
+    teachers = {t: weighted[t % len(weighted)] for t in range(1, n_teachers + 1)}
+    demo_quotas = [{'class_id': c, 'subject_id': s, 'hours': h}
+                   for c in range(1, n_classes + 1) for s, h in zip(subjects, hours)]
+    started = time.monotonic()
+    result = generate(demo_quotas, teachers, {}, len(DEFAULT_DAYS), len(DEFAULT_PERIODS),
+                      progress=lambda p: print(p, file=sys.stderr))
+    print({'placed': len(result['placements']), 'unplaced': len(result['unplaced']),
+           'problems': len(result['problems']), 'seconds': round(time.monotonic() - started, 2)})
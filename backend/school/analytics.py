@@ -0,0 +1,263 @@
+'''
+Business: Аналитика оценок школы или класса - распределения, перцентили, тренды, группа риска,
+          сравнение учителей; все метрики считаются векторно на NumPy за несколько проходов
+Args: колонки оценок (ученик, предмет, учитель, класс, оценка, день) одной выборкой из PostgreSQL
+Returns: отчёт-словарь; готовый JSON кэшируется на процесс по (область, период) и версиям таблиц
+'''
+
+import os
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+RISK_AVERAGE = float(os.environ.get('ANALYTICS_RISK_AVERAGE', '3.0'))
+RISK_MIN_GRADES = int(os.environ.get('ANALYTICS_RISK_MIN_GRADES', '3'))
+AT_RISK_LIMIT = 100
+CACHE_SIZE = int(os.environ.get('ANALYTICS_CACHE_SIZE', '32'))
+# Справочники, от которых зависит отчёт: их версии - в entity_versions
+SOURCE_TABLES = ['users', 'subjects', 'classes']
+PERCENTILES = (0.25, 0.5, 0.75)
+EPOCH = date(1970, 1, 1)
+# 1970-01-01 - четверг, первый понедельник - 5 января (день 4)
+MONDAY_OFFSET = 4
+
+# Одна строка, по колонке на поле: значения упакованы в bytea (int4send - 4 байта big-endian)
+# и без разбора превращаются в массивы через np.frombuffer - ни кортежа, ни числа Python на оценку
+GRADE_COLUMNS_QUERY = '''
+    SELECT COALESCE(string_agg(int4send(g.student_id), ''), ''),
+           COALESCE(string_agg(int4send(g.subject_id), ''), ''),
+           COALESCE(string_agg(int4send(g.teacher_id), ''), ''),
+           COALESCE(string_agg(int4send(COALESCE(u.class_id, 0)), ''), ''),
+           COALESCE(string_agg(int2send(g.grade::smallint), ''), ''),
+           COALESCE(string_agg(int4send(COALESCE(g.lesson_date, g.created_at::date) - DATE '1970-01-01'), ''), '')
+    FROM grades g
+    JOIN users u ON u.id = g.student_id
+    WHERE COALESCE(g.lesson_date, g.created_at::date) BETWEEN %(date_from)s AND %(date_to)s
+      AND (%(class_id)s::integer IS NULL OR u.class_id = %(class_id)s)
+'''
+
+
+# Версия оценок - xid последней транзакции из change_log, менявшей grades, среди тех, что
+# завершены для всех (меньше xmin снимка): их изменения видны чтению оценок после этого запроса,
+# а каждая следующая запись оценок, завершившись, даёт xid больше. Тот же принцип, что у
+# entity_versions, но журнал оценок уже ведёт change_log.
+GRADES_VERSION_QUERY = '''
+    SELECT l.xid::text FROM change_log l
+    WHERE l.table_name = 'grades' AND l.xid < pg_snapshot_xmin(pg_current_snapshot())
+    ORDER BY l.xid DESC
+    LIMIT 1
+'''
+
+
+class GradeColumns(NamedTuple):
+    student: np.ndarray
+    subject: np.ndarray
+    teacher: np.ndarray
+    klass: np.ndarray
+    grade: np.ndarray
+    day: np.ndarray
+
+
+class GroupStats(NamedTuple):
+    ids: np.ndarray
+    count: np.ndarray
+    mean: np.ndarray
+    histogram: np.ndarray
+    percentiles: np.ndarray
+    slope: np.ndarray
+
+
+def grades_version(cursor) -> int:
+    cursor.execute(GRADES_VERSION_QUERY)
+    row = cursor.fetchone()
+    return int(row[0]) if row else 0
+
+
+def load_columns(cursor, date_from: date, date_to: date, class_id: Optional[int]) -> GradeColumns:
+    cursor.execute(GRADE_COLUMNS_QUERY, {'date_from': date_from, 'date_to': date_to, 'class_id': class_id})
+    students, subjects, teachers, classes, grades, days = cursor.fetchone()
+    return GradeColumns(
+        student=np.frombuffer(students, dtype='>i4').astype(np.int32),
+        subject=np.frombuffer(subjects, dtype='>i4').astype(np.int32),
+        teacher=np.frombuffer(teachers, dtype='>i4').astype(np.int32),
+        klass=np.frombuffer(classes, dtype='>i4').astype(np.int32),
+        grade=np.frombuffer(grades, dtype='>i2').astype(np.int8),
+        day=np.frombuffer(days, dtype='>i4').astype(np.int32)
+    )
+
+
+def group_stats(keys: np.ndarray, grades: np.ndarray, days: np.ndarray) -> GroupStats:
+    '''
+    Метрики по группам за один проход bincount на каждую: число оценок, среднее, гистограмма
+    1..5, перцентили по накопленной гистограмме (nearest-rank) и наклон линейного тренда
+    оценки по дате (изменение среднего за 30 дней; None, если все оценки в один день).
+    '''
+    ids, index = np.unique(keys, return_inverse=True)
+    n = len(ids)
+    y = grades.astype(np.float64)
+    count = np.bincount(index, minlength=n)
+    total = np.bincount(index, weights=y, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    histogram = np.bincount(index * 5 + (grades.astype(np.intp) - 1), minlength=n * 5).reshape(n, 5)
+    cumulative = histogram.cumsum(axis=1)
+    ranks = np.ceil(np.outer(count, PERCENTILES))
+    percentiles = np.stack([(cumulative < ranks[:, [i]]).sum(axis=1) + 1 for i in range(len(PERCENTILES))], axis=1)
+
+    # Дни сдвигаются к среднему по группе, чтобы суммы квадратов не теряли точность
+    x = days.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x -= (np.bincount(index, weights=x, minlength=n) / count)[index]
+        sxx = np.bincount(index, weights=x * x, minlength=n)
+        sxy = np.bincount(index, weights=x * y, minlength=n)
+        slope = np.where(sxx > 0, sxy / sxx * 30, np.nan)
+    return GroupStats(ids, count, mean, histogram, percentiles, slope)
+
+
+def number(value: float, digits: int = 2) -> Optional[float]:
+    # + 0.0 убирает -0.0 после округления
+    return None if np.isnan(value) else round(float(value), digits) + 0.0
+
+
+def stats_item(stats: GroupStats, i: int) -> Dict[str, Any]:
+    p25, median, p75 = (int(v) for v in stats.percentiles[i])
+    return {
+        'count': int(stats.count[i]),
+        'average': number(stats.mean[i]),
+        'distribution': [int(v) for v in stats.histogram[i]],
+        'p25': p25,
+        'median': median,
+        'p75': p75,
+        'trend': number(stats.slope[i], 3)
+    }
+
+
+def grouped(stats: GroupStats, id_field: str, names: Dict[Any, Tuple]) -> List[Dict[str, Any]]:
+    items = []
+    for i, key in enumerate(stats.ids):
+        key = int(key)
+        items.append({id_field: key, 'name': names.get(key, (None,))[0], **stats_item(stats, i)})
+    return items
+
+
+def weekly_trend(columns: GradeColumns) -> List[Dict[str, Any]]:
+    '''Средний балл по неделям (понедельник недели) для линии тренда'''
+    weeks = columns.day - (columns.day - MONDAY_OFFSET) % 7
+    ids, index = np.unique(weeks, return_inverse=True)
+    count = np.bincount(index, minlength=len(ids))
+    total = np.bincount(index, weights=columns.grade.astype(np.float64), minlength=len(ids))
+    return [
+        {'week_start': (EPOCH + timedelta(days=int(week))).isoformat(), 'count': int(c), 'average': round(float(t / c), 2)}
+        for week, c, t in zip(ids, count, total)
+    ]
+
+
+def teacher_comparison(columns: GradeColumns, users: Dict[Any, Tuple]) -> List[Dict[str, Any]]:
+    '''
+    Учителя со своими метриками и vs_subject_average - насколько их оценки в среднем выше
+    или ниже средней по тем же предметам в этой области: строгость без поправки на предмет
+    сравнивала бы математику с физкультурой.
+    '''
+    stats = group_stats(columns.teacher, columns.grade, columns.day)
+    subject_ids, subject_index = np.unique(columns.subject, return_inverse=True)
+    y = columns.grade.astype(np.float64)
+    subject_mean = np.bincount(subject_index, weights=y) / np.bincount(subject_index)
+    residual = y - subject_mean[subject_index]
+    teacher_index = np.searchsorted(stats.ids, columns.teacher)
+    deviation = np.bincount(teacher_index, weights=residual, minlength=len(stats.ids)) / stats.count
+    items = grouped(stats, 'teacher_id', users)
+    for item, value in zip(items, deviation):
+        item['vs_subject_average'] = number(value)
+    items.sort(key=lambda item: item['vs_subject_average'])
+    return items
+
+
+def at_risk_students(columns: GradeColumns, users: Dict[Any, Tuple], subjects: Dict[Any, Tuple]) -> Tuple[int, List[Dict[str, Any]]]:
+    '''
+    Ученики, у которых хотя бы по одному предмету средний балл ниже RISK_AVERAGE
+    при не меньше RISK_MIN_GRADES оценках. Сначала те, у кого больше таких предметов.
+    '''
+    pair = columns.student.astype(np.int64) << 32 | columns.subject.astype(np.int64)
+    pairs = group_stats(pair, columns.grade, columns.day)
+    failing = (pairs.count >= RISK_MIN_GRADES) & (pairs.mean < RISK_AVERAGE)
+    if not failing.any():
+        return 0, []
+    students = group_stats(columns.student, columns.grade, columns.day)
+    student_row = {int(s): i for i, s in enumerate(students.ids)}
+    klass = np.zeros(len(students.ids), dtype=np.int32)
+    klass[np.searchsorted(students.ids, columns.student)] = columns.klass
+
+    by_student: Dict[int, List[Dict[str, Any]]] = {}
+    for i in np.flatnonzero(failing):
+        student_id, subject_id = int(pairs.ids[i] >> 32), int(pairs.ids[i] & 0xFFFFFFFF)
+        by_student.setdefault(student_id, []).append({
+            'subject_id': subject_id,
+            'subject_name': subjects.get(subject_id, (None,))[0],
+            'average': number(pairs.mean[i]),
+            'count': int(pairs.count[i])
+        })
+    items = []
+    for student_id, failed in by_student.items():
+        i = student_row[student_id]
+        failed.sort(key=lambda s: s['average'])
+        items.append({
+            'student_id': student_id,
+            'student_name': users.get(student_id, (None,))[0],
+            'class_id': int(klass[i]) or None,
+            'average': number(students.mean[i]),
+            'trend': number(students.slope[i], 3),
+            'subjects': failed
+        })
+    items.sort(key=lambda s: (-len(s['subjects']), s['average']))
+    return len(items), items[:AT_RISK_LIMIT]
+
+
+def build_report(columns: GradeColumns, references: Dict[str, Dict[Any, Tuple]]) -> Dict[str, Any]:
+    users, subjects, classes = references['users'], references['subjects'], references['classes']
+    if not len(columns.grade):
+        return {'overview': None, 'by_class': [], 'by_subject': [], 'by_teacher': [], 'weekly': [],
+                'at_risk_count': 0, 'at_risk': []}
+    overview = group_stats(np.zeros(len(columns.grade), dtype=np.int8), columns.grade, columns.day)
+    at_risk_count, at_risk = at_risk_students(columns, users, subjects)
+    return {
+        'overview': stats_item(overview, 0),
+        'by_class': grouped(group_stats(columns.klass, columns.grade, columns.day), 'class_id', classes),
+        'by_subject': grouped(group_stats(columns.subject, columns.grade, columns.day), 'subject_id', subjects),
+        'by_teacher': teacher_comparison(columns, users),
+        'weekly': weekly_trend(columns),
+        'at_risk_count': at_risk_count,
+        'at_risk': at_risk
+    }
+
+
+class ReportCache:
+    '''
+    Готовые отчёты (JSON) на процесс, LRU на CACHE_SIZE ключей. Отчёт действителен, пока
+    не изменились версия оценок и версии SOURCE_TABLES - запись оценки сбрасывает его.
+    '''
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: 'OrderedDict[Tuple, Tuple[List[int], str]]' = OrderedDict()
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, key: Tuple, versions: Sequence[int]) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != list(versions):
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Tuple, versions: Sequence[int], payload: str) -> None:
+        self.builds += 1
+        self._entries[key] = (list(versions), payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+report_cache = ReportCache(CACHE_SIZE)
@@ -0,0 +1,184 @@
+'''
+Business: Журнал оценок класса (предмет × ученик × дата) в CSV или XLSX потоком
+Args: rows - кортежи (subject_id, subject_name, student_id, student_name, lesson_date, grade),
+      упорядоченные по предмету, ученику и дате; dates - даты-колонки журнала
+Returns: генераторы кусков файла; в памяти держится одна строка журнала и текущий кусок
+'''
+
+import csv
+import io
+import zipfile
+from datetime import date
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+GradeRow = Tuple[Any, ...]
+CHUNK_BYTES = 256 * 1024
+CLASS_AVERAGE_LABEL = 'Средний по классу'
+
+
+def average(total: int, count: int) -> Optional[float]:
+    return round(total / count, 2) if count else None
+
+
+def gradebook_rows(rows: Iterable[GradeRow], dates: Sequence[date]) -> Iterator[List[Any]]:
+    '''
+    Сворачивает поток оценок в строки журнала: предмет, ученик, оценки по датам
+    (несколько за день - через пробел), средний балл. После каждого предмета -
+    строка со средним по классу за каждую дату.
+    '''
+    column = {d: i for i, d in enumerate(dates)}
+    yield ['Предмет', 'Ученик'] + [d.isoformat() for d in dates] + ['Средний']
+
+    subject_key = student_key = None
+    subject_name = student_name = ''
+    cells: List[List[int]] = []
+    day_totals: List[List[int]] = []
+
+    def student_line() -> List[Any]:
+        grades = [g for cell in cells for g in cell]
+        return ([subject_name, student_name] + [cell_value(cell) for cell in cells] +
+                [average(sum(grades), len(grades))])
+
+    def subject_line() -> List[Any]:
+        all_total = sum(t for t, _ in day_totals)
+        all_count = sum(c for _, c in day_totals)
+        return ([subject_name, CLASS_AVERAGE_LABEL] + [average(t, c) for t, c in day_totals] +
+                [average(all_total, all_count)])
+
+    for subject_id, name, student_id, full_name, lesson_date, grade in rows:
+        if (subject_id, student_id) != (subject_key, student_key) and student_key is not None:
+            yield student_line()
+        if subject_id != subject_key:
+            if subject_key is not None:
+                yield subject_line()
+            subject_key, subject_name = subject_id, name or ''
+            day_totals = [[0, 0] for _ in dates]
+            student_key = None
+        if student_id != student_key:
+            student_key, student_name = student_id, full_name or ''
+            cells = [[] for _ in dates]
+        i = column.get(lesson_date)
+        if i is not None:
+            cells[i].append(grade)
+            day_totals[i][0] += grade
+            day_totals[i][1] += 1
+
+    if student_key is not None:
+        yield student_line()
+    if subject_key is not None:
+        yield subject_line()
+
+
+def cell_value(grades: List[int]) -> Any:
+    if not grades:
+        return None
+    return grades[0] if len(grades) == 1 else ' '.join(str(g) for g in grades)
+
+
+def csv_chunks(lines: Iterable[List[Any]]) -> Iterator[str]:
+    '''CSV с BOM, чтобы Excel открыл кириллицу без мастера импорта'''
+    buffer = io.StringIO()
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer)
+    for line in lines:
+        writer.writerow(['' if v is None else v for v in line])
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _ChunkSink:
+    '''Файловый объект для ZipFile без seek: копит записанные байты до следующей выдачи'''
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.parts)
+        self.parts, self.size = [], 0
+        return data
+
+
+XLSX_STATIC = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Журнал" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    )
+}
+
+
+def column_letter(index: int) -> str:
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def xlsx_cell(ref: str, value: Any) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    text = ''.join(ch for ch in str(value) if ch in '\t\n\r' or ch >= ' ')
+    return f'<c r="{ref}" t="inlineStr"><is><t>{escape(text)}</t></is></c>'
+
+
+def xlsx_chunks(lines: Iterable[List[Any]]) -> Iterator[bytes]:
+    '''
+    Минимальная книга XLSX (один лист, строки inlineStr) без сторонних библиотек.
+    ZIP пишется в поток с дескрипторами данных, лист сжимается по мере записи строк.
+    '''
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            letters: List[str] = []
+            for r, line in enumerate(lines, start=1):
+                while len(letters) < len(line):
+                    letters.append(column_letter(len(letters)))
+                cells = ''.join(xlsx_cell(f'{letters[i]}{r}', v) for i, v in enumerate(line))
+                sheet.write(f'<row r="{r}">{cells}</row>'.encode('utf-8'))
+                if sink.size >= CHUNK_BYTES:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
@@ -1,8 +1,39 @@
+import base64
+import csv
+import io
 import json
-import os
-import psycopg2
-from typing import Dict, Any
+import re
+from datetime import date, timedelta
+from itertools import islice
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from urllib.parse import quote
 
+from psycopg2.extras import execute_values
+
+import db
+import gradebook
+import storage
+
+STREAM_BATCH_SIZE = 2000
+# Строк на страницу выгрузки stream=true: тело ответа собирается строкой, и только потолок
+# страницы держит пик памяти постоянным; следующая страница - по курсору из X-Next-Cursor
+STREAM_PAGE_ROWS = 20000
+BULK_GRADES_LIMIT = 5000
+DASHBOARD_HOMEWORK_DAYS = 14
+DASHBOARD_HOMEWORK_LIMIT = 20
+DASHBOARD_RECENT_GRADES = 10
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_SOURCES = ('homework', 'lesson')
+# По умолчанию ранжируются не больше стольких самых свежих совпадений из каждого источника:
+# частое слово находится в десятках тысяч записей, а ранг пришлось бы считать для каждой
+# (~100-200 мс вместо единиц). Более релевантная, но старая запись за окно не попадёт -
+# для этого rank=all ранжирует все совпадения
+SEARCH_RANK_WINDOW = 1000
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+
+@db.instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Универсальный API для школьной системы - классы, учителя, ДЗ, оценки
@@ -17,14 +48,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Tenant, Authorization, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    params = event.get('queryStringParameters', {}) or {}
+    if params.get('pool') == 'stats':
+        return db.pool_stats_response(event)
+    
+    conn = db.acquire()
     cursor = conn.cursor()
     
     headers = {
@@ -33,7 +67,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     }
     
     try:
-        params = event.get('queryStringParameters', {}) or {}
         entity = params.get('entity', 'classes')
         
         if entity == 'classes':
@@ -44,10 +77,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return handle_homework(method, event, cursor, conn, headers)
         elif entity == 'grades':
             return handle_grades(method, event, cursor, conn, headers)
+        elif entity == 'grade_stats':
+            return handle_grade_stats(method, event, cursor, conn, headers)
+        elif entity == 'dashboard':
+            return handle_dashboard(method, event, cursor, conn, headers)
+        elif entity == 'search':
+            return handle_search(method, event, cursor, conn, headers)
+        elif entity == 'gradebook':
+            return handle_gradebook(method, event, cursor, conn, headers)
+        elif entity == 'changes':
+            return handle_changes(method, event, cursor, conn, headers)
+        elif entity == 'analytics':
+            return handle_analytics(method, event, cursor, conn, headers)
         
     finally:
         cursor.close()
-        conn.close()
+        db.release(conn)
     
     return {
         'statusCode': 400,
@@ -58,30 +103,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
 def handle_classes(method, event, cursor, conn, headers):
     if method == 'GET':
+        etag = db.make_etag('classes', conn, ['classes', 'users'])
+        if db.is_not_modified(event, etag):
+            return db.not_modified_response(etag)
+        
         cursor.execute('''
             SELECT c.id, c.name, c.description, c.created_at,
                    COUNT(DISTINCT u.id) as student_count
-            FROM t_p2953915_edu_schedule_platfor.classes c
-            LEFT JOIN t_p2953915_edu_schedule_platfor.users u 
+            FROM classes c
+            LEFT JOIN users u 
                 ON c.id = u.class_id AND u.role = 'student'
             GROUP BY c.id, c.name, c.description, c.created_at
             ORDER BY c.name
         ''')
         
-        classes = []
-        for row in cursor.fetchall():
-            classes.append({
-                'id': row[0],
-                'name': row[1],
-                'description': row[2],
-                'created_at': row[3].isoformat() if row[3] else None,
-                'student_count': row[4]
-            })
+        classes = db.shape_rows(cursor, cursor.fetchall(), columnar=db.wants_columnar(event))
         
         return {
             'statusCode': 200,
-            'headers': headers,
-            'body': json.dumps(classes)
+            'headers': {**headers, **db.etag_headers(etag)},
+            'body': db.dumps(classes)
         }
     
     elif method == 'POST':
@@ -90,13 +131,14 @@ def handle_classes(method, event, cursor, conn, headers):
         description = body.get('description', '')
         
         cursor.execute('''
-            INSERT INTO t_p2953915_edu_schedule_platfor.classes (name, description)
+            INSERT INTO classes (name, description)
             VALUES (%s, %s)
             RETURNING id, name, description, created_at
         ''', (name, description))
         
         row = cursor.fetchone()
         conn.commit()
+        db.reference_cache.invalidate('classes')
         
         return {
             'statusCode': 201,
@@ -113,34 +155,33 @@ def handle_classes(method, event, cursor, conn, headers):
         params = event.get('queryStringParameters', {})
         class_id = params.get('id')
         
-        cursor.execute('DELETE FROM t_p2953915_edu_schedule_platfor.classes WHERE id = %s', (class_id,))
+        cursor.execute('DELETE FROM classes WHERE id = %s', (class_id,))
         conn.commit()
+        db.reference_cache.invalidate('classes')
         
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'success': True})}
 
 
 def handle_teachers(method, event, cursor, conn, headers):
     if method == 'GET':
+        etag = db.make_etag('teachers', conn, ['users', 'subjects'])
+        if db.is_not_modified(event, etag):
+            return db.not_modified_response(etag)
+        
         cursor.execute('''
-            SELECT u.id, u.email, u.full_name, u.subject_id, s.name as subject_name, s.color
-            FROM t_p2953915_edu_schedule_platfor.users u
-            LEFT JOIN t_p2953915_edu_schedule_platfor.subjects s ON u.subject_id = s.id
+            SELECT u.id, u.email, u.full_name, u.subject_id
+            FROM users u
             WHERE u.role = 'teacher'
             ORDER BY u.full_name
         ''')
         
-        teachers = []
-        for row in cursor.fetchall():
-            teachers.append({
-                'id': row[0],
-                'email': row[1],
-                'full_name': row[2],
-                'subject_id': row[3],
-                'subject_name': row[4],
-                'subject_color': row[5]
-            })
+        subjects = db.reference_cache.get(conn, 'subjects')
+        teachers = db.shape_rows(cursor, cursor.fetchall(), columnar=db.wants_columnar(event), extra=[
+            ('subject_name', lambda r: subjects.get(r[3], (None, None))[0]),
+            ('subject_color', lambda r: subjects.get(r[3], (None, None))[1])
+        ])
         
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(teachers)}
+        return {'statusCode': 200, 'headers': {**headers, **db.etag_headers(etag)}, 'body': db.dumps(teachers)}
     
     elif method == 'POST':
         body = json.loads(event.get('body', '{}'))
@@ -150,7 +191,7 @@ def handle_teachers(method, event, cursor, conn, headers):
         subject_id = body.get('subject_id')
         
         cursor.execute('''
-            INSERT INTO t_p2953915_edu_schedule_platfor.users 
+            INSERT INTO users 
             (email, password, role, full_name, subject_id)
             VALUES (%s, %s, 'teacher', %s, %s)
             RETURNING id, email, full_name, subject_id
@@ -158,6 +199,7 @@ def handle_teachers(method, event, cursor, conn, headers):
         
         row = cursor.fetchone()
         conn.commit()
+        db.reference_cache.invalidate('users')
         
         return {
             'statusCode': 201,
@@ -173,21 +215,23 @@ def handle_teachers(method, event, cursor, conn, headers):
         subject_id = body.get('subject_id')
         
         cursor.execute('''
-            UPDATE t_p2953915_edu_schedule_platfor.users
+            UPDATE users
             SET email = %s, full_name = %s, subject_id = %s
             WHERE id = %s AND role = 'teacher'
             RETURNING id
         ''', (email, full_name, subject_id, teacher_id))
         
         conn.commit()
+        db.reference_cache.invalidate('users')
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'success': True})}
     
     elif method == 'DELETE':
         params = event.get('queryStringParameters', {})
         teacher_id = params.get('id')
         
-        cursor.execute('DELETE FROM t_p2953915_edu_schedule_platfor.users WHERE id = %s AND role = %s', (teacher_id, 'teacher'))
+        cursor.execute('DELETE FROM users WHERE id = %s AND role = %s', (teacher_id, 'teacher'))
         conn.commit()
+        db.reference_cache.invalidate('users')
         
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'success': True})}
 
@@ -200,14 +244,8 @@ def handle_homework(method, event, cursor, conn, headers):
         
         query = '''
             SELECT h.id, h.class_id, h.subject_id, h.teacher_id, h.title, 
-                   h.description, h.due_date, h.created_at,
-                   s.name as subject_name, s.color as subject_color,
-                   c.name as class_name,
-                   u.full_name as teacher_name
-            FROM t_p2953915_edu_schedule_platfor.homework h
-            JOIN t_p2953915_edu_schedule_platfor.subjects s ON h.subject_id = s.id
-            JOIN t_p2953915_edu_schedule_platfor.classes c ON h.class_id = c.id
-            JOIN t_p2953915_edu_schedule_platfor.users u ON h.teacher_id = u.id
+                   h.description, h.due_date, h.created_at
+            FROM homework h
             WHERE 1=1
         '''
         
@@ -219,33 +257,20 @@ def handle_homework(method, event, cursor, conn, headers):
             query += ' AND h.teacher_id = %s'
             params_list.append(teacher_id)
         
-        query += ' ORDER BY h.due_date DESC, h.created_at DESC'
+        extra = homework_extra(conn)
+        if wants_stream(event):
+            return stream_response(conn, query, params_list, HOMEWORK_STREAM_ORDER, extra, event, headers)
         
+        query += ' ORDER BY h.due_date DESC, h.created_at DESC'
         cursor.execute(query, params_list)
+        homework_list = db.shape_rows(cursor, cursor.fetchall(), extra, columnar=db.wants_columnar(event))
         
-        homework_list = []
-        for row in cursor.fetchall():
-            homework_list.append({
-                'id': row[0],
-                'class_id': row[1],
-                'subject_id': row[2],
-                'teacher_id': row[3],
-                'title': row[4],
-                'description': row[5],
-                'due_date': row[6].isoformat() if row[6] else None,
-                'created_at': row[7].isoformat() if row[7] else None,
-                'subject_name': row[8],
-                'subject_color': row[9],
-                'class_name': row[10],
-                'teacher_name': row[11]
-            })
-        
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(homework_list)}
+        return {'statusCode': 200, 'headers': headers, 'body': db.dumps(homework_list)}
     
     elif method == 'POST':
         body = json.loads(event.get('body', '{}'))
         cursor.execute('''
-            INSERT INTO t_p2953915_edu_schedule_platfor.homework 
+            INSERT INTO homework 
             (class_id, subject_id, teacher_id, title, description, due_date)
             VALUES (%s, %s, %s, %s, %s, %s)
             RETURNING id
@@ -259,7 +284,7 @@ def handle_homework(method, event, cursor, conn, headers):
     
     elif method == 'DELETE':
         params = event.get('queryStringParameters', {})
-        cursor.execute('DELETE FROM t_p2953915_edu_schedule_platfor.homework WHERE id = %s', (params.get('id'),))
+        cursor.execute('DELETE FROM homework WHERE id = %s', (params.get('id'),))
         conn.commit()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'success': True})}
 
@@ -273,37 +298,33 @@ def handle_grades(method, event, cursor, conn, headers):
         
         if student_id and params.get('stats') == 'true':
             cursor.execute('''
-                SELECT s.name as subject_name, s.color,
-                       AVG(g.grade) as avg_grade,
-                       COUNT(g.id) as grade_count
-                FROM t_p2953915_edu_schedule_platfor.grades g
-                JOIN t_p2953915_edu_schedule_platfor.subjects s ON g.subject_id = s.id
-                WHERE g.student_id = %s
-                GROUP BY s.id, s.name, s.color
-                ORDER BY s.name
+                SELECT gs.subject_id, gs.grade_sum, gs.grade_count,
+                       gs.count_1, gs.count_2, gs.count_3, gs.count_4, gs.count_5
+                FROM grade_stats gs
+                WHERE gs.student_id = %s AND gs.grade_count > 0
             ''', (student_id,))
             
-            stats = []
-            for row in cursor.fetchall():
-                stats.append({
-                    'subject_name': row[0],
-                    'subject_color': row[1],
-                    'avg_grade': round(float(row[2]), 2) if row[2] else 0,
-                    'grade_count': row[3]
-                })
+            subject = db.reference_cache.lookup(conn, 'subjects', (None, None))
+            rows = cursor.fetchall()
+            with db.span('shape'):
+                stats = []
+                for row in rows:
+                    subject_name, subject_color = subject(row[0])
+                    stats.append({
+                        'subject_name': subject_name,
+                        'subject_color': subject_color,
+                        'avg_grade': round(row[1] / row[2], 2),
+                        'grade_count': row[2],
+                        'grade_distribution': {str(grade): row[2 + grade] for grade in range(1, 6)}
+                    })
+                stats.sort(key=lambda item: item['subject_name'] or '')
             
-            return {'statusCode': 200, 'headers': headers, 'body': json.dumps(stats)}
+            return {'statusCode': 200, 'headers': headers, 'body': db.dumps(stats)}
         
         query = '''
             SELECT g.id, g.student_id, g.subject_id, g.teacher_id, g.grade, 
-                   g.comment, g.lesson_date, g.created_at,
-                   s.name as subject_name, s.color as subject_color,
-                   st.full_name as student_name,
-                   t.full_name as teacher_name
-            FROM t_p2953915_edu_schedule_platfor.grades g
-            JOIN t_p2953915_edu_schedule_platfor.subjects s ON g.subject_id = s.id
-            JOIN t_p2953915_edu_schedule_platfor.users st ON g.student_id = st.id
-            JOIN t_p2953915_edu_schedule_platfor.users t ON g.teacher_id = t.id
+                   g.comment, g.lesson_date, g.created_at
+            FROM grades g
             WHERE 1=1
         '''
         
@@ -318,33 +339,23 @@ def handle_grades(method, event, cursor, conn, headers):
             query += ' AND g.subject_id = %s'
             params_list.append(subject_id)
         
-        query += ' ORDER BY g.lesson_date DESC, g.created_at DESC'
+        extra = grade_extra(conn)
+        if wants_stream(event):
+            return stream_response(conn, query, params_list, GRADES_STREAM_ORDER, extra, event, headers)
         
+        query += ' ORDER BY g.lesson_date DESC, g.created_at DESC'
         cursor.execute(query, params_list)
+        grades = db.shape_rows(cursor, cursor.fetchall(), extra, columnar=db.wants_columnar(event))
         
-        grades = []
-        for row in cursor.fetchall():
-            grades.append({
-                'id': row[0],
-                'student_id': row[1],
-                'subject_id': row[2],
-                'teacher_id': row[3],
-                'grade': row[4],
-                'comment': row[5],
-                'lesson_date': row[6].isoformat() if row[6] else None,
-                'created_at': row[7].isoformat() if row[7] else None,
-                'subject_name': row[8],
-                'subject_color': row[9],
-                'student_name': row[10],
-                'teacher_name': row[11]
-            })
-        
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(grades)}
+        return {'statusCode': 200, 'headers': headers, 'body': db.dumps(grades)}
     
     elif method == 'POST':
+        if (event.get('queryStringParameters') or {}).get('bulk') == 'true':
+            return handle_grades_bulk(event, cursor, conn, headers)
+        
         body = json.loads(event.get('body', '{}'))
         cursor.execute('''
-            INSERT INTO t_p2953915_edu_schedule_platfor.grades 
+            INSERT INTO grades 
             (student_id, subject_id, teacher_id, grade, comment, lesson_date)
             VALUES (%s, %s, %s, %s, %s, %s)
             RETURNING id
@@ -358,6 +369,788 @@ def handle_grades(method, event, cursor, conn, headers):
     
     elif method == 'DELETE':
         params = event.get('queryStringParameters', {})
-        cursor.execute('DELETE FROM t_p2953915_edu_schedule_platfor.grades WHERE id = %s', (params.get('id'),))
+        cursor.execute('DELETE FROM grades WHERE id = %s', (params.get('id'),))
         conn.commit()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'success': True})}
+
+
+def read_bulk_grades(event) -> List[Dict[str, Any]]:
+    '''Строки пакета оценок из JSON ({"grades": [...]} или массив) либо из CSV с заголовком'''
+    raw = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        raw = base64.b64decode(raw).decode('utf-8-sig')
+    content_type = db.request_header(event, 'Content-Type') or ''
+    if 'text/csv' in content_type:
+        return list(csv.DictReader(io.StringIO(raw)))
+    
+    data = json.loads(raw or '[]')
+    if isinstance(data, dict):
+        if 'csv' in data:
+            return list(csv.DictReader(io.StringIO(data['csv'])))
+        data = data.get('grades', [])
+    if not isinstance(data, list):
+        raise ValueError('Ожидается массив оценок')
+    return data
+
+
+def strict_int(value: Any) -> Optional[int]:
+    '''Целое из JSON-числа или строки CSV; int() молча округлил бы 4.7 и принял бы True'''
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and re.fullmatch(r'\s*-?\d+\s*', value):
+        return int(value)
+    return None
+
+
+def validate_grade_row(item: Any) -> Tuple[Optional[tuple], List[str]]:
+    if not isinstance(item, dict):
+        return None, ['Строка должна быть объектом']
+    
+    errors = []
+    values = {}
+    for field in ('student_id', 'subject_id', 'teacher_id', 'grade'):
+        value = strict_int(item.get(field))
+        if value is None:
+            errors.append(f'{field}: требуется целое число')
+        else:
+            values[field] = value
+    if 'grade' in values and not 1 <= values['grade'] <= 5:
+        errors.append('grade: допустимы значения от 1 до 5')
+    
+    lesson_date = item.get('lesson_date') or None
+    if lesson_date is not None:
+        try:
+            lesson_date = date.fromisoformat(str(lesson_date))
+        except ValueError:
+            errors.append('lesson_date: требуется дата YYYY-MM-DD')
+    
+    if errors:
+        return None, errors
+    return (values['student_id'], values['subject_id'], values['teacher_id'],
+            values['grade'], item.get('comment') or '', lesson_date), []
+
+
+def missing_ids(cursor, query: str, ids: set) -> set:
+    cursor.execute(query, (list(ids),))
+    return ids - {row[0] for row in cursor.fetchall()}
+
+
+def handle_grades_bulk(event, cursor, conn, headers):
+    '''
+    Пакетное выставление оценок: все строки проверяются заранее, затем
+    вставляются одним INSERT ... VALUES и одним commit. При любой ошибке
+    не вставляется ничего, а в ответе - результат по каждой строке.
+    '''
+    try:
+        items = read_bulk_grades(event)
+    except (ValueError, csv.Error) as e:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+    
+    if not items:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Пустой пакет оценок'})}
+    if len(items) > BULK_GRADES_LIMIT:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'Не больше {BULK_GRADES_LIMIT} оценок за запрос'})}
+    
+    rows = []
+    results = []
+    for index, item in enumerate(items):
+        row, errors = validate_grade_row(item)
+        rows.append(row)
+        results.append({'index': index, 'errors': errors})
+    
+    valid = [row for row in rows if row]
+    unknown_students = missing_ids(cursor, "SELECT id FROM users WHERE id = ANY(%s) AND role = 'student'", {r[0] for r in valid})
+    unknown_subjects = missing_ids(cursor, 'SELECT id FROM subjects WHERE id = ANY(%s)', {r[1] for r in valid})
+    unknown_teachers = missing_ids(cursor, "SELECT id FROM users WHERE id = ANY(%s) AND role = 'teacher'", {r[2] for r in valid})
+    for row, result in zip(rows, results):
+        if not row:
+            continue
+        if row[0] in unknown_students:
+            result['errors'].append('student_id: ученик не найден')
+        if row[1] in unknown_subjects:
+            result['errors'].append('subject_id: предмет не найден')
+        if row[2] in unknown_teachers:
+            result['errors'].append('teacher_id: учитель не найден')
+    
+    if any(result['errors'] for result in results):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'success': False, 'results': [r for r in results if r['errors']]})
+        }
+    
+    inserted = execute_values(cursor, '''
+        INSERT INTO grades
+        (student_id, subject_id, teacher_id, grade, comment, lesson_date)
+        VALUES %s
+        RETURNING id
+    ''', rows, page_size=len(rows), fetch=True)
+    conn.commit()
+    
+    for result, row in zip(results, inserted):
+        result['id'] = row[0]
+        del result['errors']
+    
+    return {'statusCode': 201, 'headers': headers, 'body': json.dumps({'success': True, 'results': results})}
+
+
+GRADE_STATS_AGGREGATE = '''
+    SELECT student_id, subject_id, COUNT(*) as grade_count, SUM(grade) as grade_sum,
+           COUNT(*) FILTER (WHERE grade = 1) as count_1, COUNT(*) FILTER (WHERE grade = 2) as count_2,
+           COUNT(*) FILTER (WHERE grade = 3) as count_3, COUNT(*) FILTER (WHERE grade = 4) as count_4,
+           COUNT(*) FILTER (WHERE grade = 5) as count_5
+    FROM grades
+    GROUP BY student_id, subject_id
+'''
+
+
+def handle_grade_stats(method, event, cursor, conn, headers):
+    '''GET - сверка grade_stats с grades, POST - полная пересборка сводки'''
+    if method == 'GET':
+        cursor.execute(f'''
+            SELECT COALESCE(a.student_id, gs.student_id), COALESCE(a.subject_id, gs.subject_id),
+                   COALESCE(a.grade_count, 0), COALESCE(gs.grade_count, 0),
+                   COALESCE(a.grade_sum, 0), COALESCE(gs.grade_sum, 0)
+            FROM ({GRADE_STATS_AGGREGATE}) a
+            FULL JOIN grade_stats gs
+                ON gs.student_id = a.student_id AND gs.subject_id = a.subject_id
+            WHERE (a.student_id IS NULL AND gs.grade_count <> 0)
+               OR (gs.student_id IS NULL)
+               OR (a.grade_count, a.grade_sum, a.count_1, a.count_2, a.count_3, a.count_4, a.count_5)
+                  IS DISTINCT FROM (gs.grade_count, gs.grade_sum, gs.count_1, gs.count_2, gs.count_3, gs.count_4, gs.count_5)
+        ''')
+        
+        drift = []
+        for row in cursor.fetchall():
+            drift.append({
+                'student_id': row[0],
+                'subject_id': row[1],
+                'expected_count': row[2],
+                'stored_count': row[3],
+                'expected_sum': row[4],
+                'stored_sum': row[5]
+            })
+        
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'consistent': not drift, 'drift': drift})}
+    
+    elif method == 'POST':
+        # Блокируем запись в grades, чтобы триггер не менял сводку во время пересборки
+        cursor.execute('LOCK TABLE grades IN SHARE MODE')
+        cursor.execute('DELETE FROM grade_stats')
+        cursor.execute(f'''
+            INSERT INTO grade_stats
+            (student_id, subject_id, grade_count, grade_sum, count_1, count_2, count_3, count_4, count_5)
+            {GRADE_STATS_AGGREGATE}
+        ''')
+        rebuilt = cursor.rowcount
+        conn.commit()
+        
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'success': True, 'rows': rebuilt})}
+
+
+DASHBOARD_QUERY = '''
+    WITH me AS (
+        SELECT u.id, u.full_name, COALESCE(%(class_id)s, u.class_id) AS class_id
+        FROM users u
+        WHERE u.id = %(student_id)s AND u.role = 'student'
+    ),
+    week_lessons AS (
+        SELECT s.id, s.day_of_week, s.lesson_date, s.time_start, s.time_end, s.subject, s.subject_id,
+               sub.name AS subject_name, sub.color AS subject_color, s.teacher, s.teacher_id, s.room, s.notes, s.homework
+        FROM me
+        JOIN schedule s ON s.class_id = me.class_id
+        LEFT JOIN subjects sub ON sub.id = s.subject_id
+        WHERE s.lesson_date BETWEEN %(week_start)s AND %(week_end)s
+           OR (s.lesson_date IS NULL AND NOT EXISTS (
+                SELECT 1 FROM schedule d
+                WHERE d.class_id = me.class_id AND d.lesson_date BETWEEN %(week_start)s AND %(week_end)s
+           ))
+    ),
+    due_homework AS (
+        SELECT h.id, h.subject_id, sub.name AS subject_name, sub.color AS subject_color, h.title, h.description,
+               h.due_date, h.teacher_id, t.full_name AS teacher_name
+        FROM me
+        JOIN homework h ON h.class_id = me.class_id
+        LEFT JOIN subjects sub ON sub.id = h.subject_id
+        LEFT JOIN users t ON t.id = h.teacher_id
+        WHERE h.due_date BETWEEN %(today)s AND %(homework_until)s
+        ORDER BY h.due_date, h.id
+        LIMIT %(homework_limit)s
+    ),
+    recent_grades AS (
+        SELECT g.id, g.subject_id, sub.name AS subject_name, sub.color AS subject_color, g.grade, g.comment,
+               g.lesson_date, g.teacher_id, t.full_name AS teacher_name
+        FROM me
+        JOIN grades g ON g.student_id = me.id
+        LEFT JOIN subjects sub ON sub.id = g.subject_id
+        LEFT JOIN users t ON t.id = g.teacher_id
+        ORDER BY g.lesson_date DESC NULLS LAST, g.created_at DESC
+        LIMIT %(recent_limit)s
+    ),
+    averages AS (
+        SELECT sub.name AS subject_name, sub.color AS subject_color,
+               ROUND(gs.grade_sum::numeric / gs.grade_count, 2) AS avg_grade, gs.grade_count,
+               json_build_object('1', gs.count_1, '2', gs.count_2, '3', gs.count_3, '4', gs.count_4, '5', gs.count_5) AS grade_distribution
+        FROM me
+        JOIN grade_stats gs ON gs.student_id = me.id AND gs.grade_count > 0
+        LEFT JOIN subjects sub ON sub.id = gs.subject_id
+    )
+    SELECT json_build_object(
+        'student', (SELECT json_build_object('id', me.id, 'full_name', me.full_name, 'class_id', me.class_id) FROM me),
+        'week_start', %(week_start)s::date,
+        'lessons', COALESCE((SELECT json_agg(l ORDER BY l.lesson_date NULLS FIRST,
+            array_position(ARRAY['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']::varchar[], l.day_of_week),
+            l.time_start, l.id) FROM week_lessons l), '[]'),
+        'homework', COALESCE((SELECT json_agg(h ORDER BY h.due_date, h.id) FROM due_homework h), '[]'),
+        'recent_grades', COALESCE((SELECT json_agg(g) FROM recent_grades g), '[]'),
+        'averages', COALESCE((SELECT json_agg(a ORDER BY a.subject_name) FROM averages a), '[]')
+    )::text, EXISTS (SELECT 1 FROM me)
+'''
+
+
+def handle_dashboard(method, event, cursor, conn, headers):
+    '''
+    Главный экран ученика одним запросом к БД: уроки недели, ближайшие ДЗ,
+    последние оценки и средние по предметам. JSON собирается в PostgreSQL
+    одним выражением с CTE и отдаётся как есть, без разбора в Python.
+    '''
+    if method != 'GET':
+        return {'statusCode': 405, 'headers': headers, 'body': json.dumps({'error': 'Method not allowed'})}
+    
+    params = event.get('queryStringParameters') or {}
+    # Ученик с сессионным токеном может не передавать student_id/class_id: они есть в токене
+    session = db.session_from_event(event) or {}
+    try:
+        student_id = int(params.get('student_id') or session.get('id'))
+        class_id = int(params['class_id']) if params.get('class_id') else None
+        if class_id is None and student_id == session.get('id'):
+            class_id = session.get('class_id')
+        today = date.fromisoformat(params['date']) if params.get('date') else date.today()
+    except (TypeError, ValueError) as e:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'Некорректные параметры: {e}'})}
+    
+    week_start = today - timedelta(days=today.weekday())
+    cursor.execute(DASHBOARD_QUERY, {
+        'student_id': student_id,
+        'class_id': class_id,
+        'today': today,
+        'week_start': week_start,
+        'week_end': week_start + timedelta(days=6),
+        'homework_until': today + timedelta(days=DASHBOARD_HOMEWORK_DAYS),
+        'homework_limit': DASHBOARD_HOMEWORK_LIMIT,
+        'recent_limit': DASHBOARD_RECENT_GRADES
+    })
+    payload, found = cursor.fetchone()
+    if not found:
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Ученик не найден'})}
+    
+    return {'statusCode': 200, 'headers': headers, 'body': payload}
+
+
+SEARCH_QUERY = '''
+    WITH hits AS (
+        SELECT c.id, c.class_id, c.subject_id, c.teacher_id, c.source, c.title, c.body, c.on_date,
+               ts_rank_cd(c.search_vector, websearch_to_tsquery('russian', %(q)s)) AS rank
+        FROM (
+            (SELECT h.id, h.class_id, h.subject_id, h.teacher_id, 'homework'::text AS source, h.title,
+                    h.description AS body, h.due_date AS on_date, h.search_vector
+             FROM homework h
+             WHERE %(homework)s AND h.search_vector @@ websearch_to_tsquery('russian', %(q)s)
+               AND (%(class_id)s::integer IS NULL OR h.class_id = %(class_id)s)
+             ORDER BY h.due_date DESC
+             LIMIT %(window)s)
+            UNION ALL
+            (SELECT s.id, s.class_id, s.subject_id, s.teacher_id, 'lesson'::text, s.subject::text,
+                    concat_ws(E'\\n', NULLIF(s.homework, ''), NULLIF(s.notes, '')), s.lesson_date, s.search_vector
+             FROM schedule s
+             WHERE %(lessons)s AND s.search_vector @@ websearch_to_tsquery('russian', %(q)s)
+               AND (%(class_id)s::integer IS NULL OR s.class_id = %(class_id)s)
+             ORDER BY s.lesson_date DESC
+             LIMIT %(window)s)
+        ) c
+    ),
+    page AS (
+        SELECT * FROM hits
+        WHERE %(after_rank)s::real IS NULL OR hits.rank < %(after_rank)s::real
+           OR (hits.rank = %(after_rank)s::real AND (hits.source, hits.id) > (%(after_source)s::text, %(after_id)s::integer))
+        ORDER BY hits.rank DESC, hits.source, hits.id
+        LIMIT %(limit)s
+    )
+    SELECT p.id, p.class_id, p.subject_id, p.teacher_id, p.source, p.title,
+           ts_headline('russian', p.body, websearch_to_tsquery('russian', %(q)s), 'StartSel=<mark>, StopSel=</mark>, MaxWords=30, MinWords=10, MaxFragments=2') AS snippet,
+           p.on_date, p.rank
+    FROM page p
+    ORDER BY p.rank DESC, p.source, p.id
+'''
+
+
+def encode_search_cursor(rank: float, source: str, row_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, source, row_id]).encode()).decode().rstrip('=')
+
+
+def decode_search_cursor(value: str) -> Tuple[float, str, int]:
+    try:
+        rank, source, row_id = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+        return float(rank), str(source), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Некорректный cursor')
+
+
+def handle_search(method, event, cursor, conn, headers):
+    '''
+    Полнотекстовый поиск по ДЗ (title, description) и урокам (homework, notes) с русской
+    морфологией. Векторы - генерируемые колонки с GIN-индексами, результаты упорядочены по
+    ts_rank_cd среди SEARCH_RANK_WINDOW самых свежих совпадений каждого источника (rank=all -
+    среди всех); страницы по cursor (ранг, источник, id), подсветка только для строк страницы.
+    '''
+    if method != 'GET':
+        return {'statusCode': 405, 'headers': headers, 'body': json.dumps({'error': 'Method not allowed'})}
+    
+    params = event.get('queryStringParameters') or {}
+    text = (params.get('q') or '').strip()
+    try:
+        if not text:
+            raise ValueError('q обязателен')
+        limit = min(int(params.get('limit') or SEARCH_PAGE_SIZE), SEARCH_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError('limit должен быть положительным')
+        source = params.get('source')
+        if source and source not in SEARCH_SOURCES:
+            raise ValueError(f'source: одно из {", ".join(SEARCH_SOURCES)}')
+        class_id = int(params['class_id']) if params.get('class_id') else None
+        rank_all = params.get('rank') == 'all'
+        after = decode_search_cursor(params['cursor']) if params.get('cursor') else (None, None, None)
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+    
+    cursor.execute(SEARCH_QUERY, {
+        'q': text,
+        'homework': source in (None, 'homework'),
+        'lessons': source in (None, 'lesson'),
+        'class_id': class_id,
+        'after_rank': after[0],
+        'after_source': after[1],
+        'after_id': after[2],
+        'limit': limit + 1,
+        # LIMIT NULL в PostgreSQL - без ограничения
+        'window': None if rank_all else SEARCH_RANK_WINDOW
+    })
+    rows = cursor.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_search_cursor(last[8], last[4], last[0])
+    
+    results = db.shape_rows(cursor, rows, homework_extra(conn), columnar=db.wants_columnar(event))
+    return {'statusCode': 200, 'headers': headers, 'body': db.dumps({
+        'results': results,
+        'next_cursor': next_cursor,
+        'ranked': 'all' if rank_all else f'latest {SEARCH_RANK_WINDOW} per source'
+    })}
+
+
+# Граница стабильности журнала: транзакции с xid ниже xmin снимка завершены, новых записей
+# с таким xid уже не появится
+CHANGES_HORIZON = '''
+    SELECT pg_snapshot_xmin(pg_current_snapshot())::text, pruned_before::text
+    FROM change_log_horizon
+'''
+
+CHANGES_LOG_SCOPE = '''
+        (SELECT xid, seq, table_name, row_id, op FROM change_log
+         WHERE {scope} AND (xid, seq) > (%(after_xid)s::xid8, %(after_seq)s::bigint) AND xid < %(horizon)s::xid8
+         ORDER BY xid, seq
+         LIMIT %(limit)s)
+'''
+
+# Три упорядоченных среза по частичным индексам (класс, ученик, общие) сливаются без сортировки всего журнала
+CHANGES_LOG = '''
+    SELECT xid::text, seq, table_name, row_id, op FROM (
+        {}
+        UNION ALL
+        {}
+        UNION ALL
+        {}
+    ) l
+    ORDER BY l.xid, l.seq
+    LIMIT %(limit)s
+'''.format(
+    CHANGES_LOG_SCOPE.format(scope='class_id = %(class_id)s'),
+    CHANGES_LOG_SCOPE.format(scope='student_id = %(student_id)s'),
+    CHANGES_LOG_SCOPE.format(scope='class_id IS NULL AND student_id IS NULL')
+)
+
+# Текущее состояние изменённых строк; строка вне области клиента (удалена или перенесена
+# в другой класс) не находится и уходит клиенту как tombstone
+CHANGES_ROWS = {
+    'schedule': '''
+        SELECT id, to_jsonb(t) - ARRAY['search_vector', 'day_order', 'sort_date']
+        FROM schedule t
+        WHERE id = ANY(%(ids)s) AND (t.class_id = %(class_id)s OR t.class_id IS NULL)
+    ''',
+    'homework': '''
+        SELECT id, to_jsonb(t) - 'search_vector'
+        FROM homework t
+        WHERE id = ANY(%(ids)s) AND t.class_id = %(class_id)s
+    ''',
+    'grades': '''
+        SELECT id, to_jsonb(t)
+        FROM grades t
+        WHERE id = ANY(%(ids)s) AND t.student_id = %(student_id)s
+    ''',
+    'subjects': 'SELECT id, to_jsonb(t) FROM subjects t WHERE id = ANY(%(ids)s)',
+    'classes': 'SELECT id, to_jsonb(t) FROM classes t WHERE id = ANY(%(ids)s)'
+}
+
+
+def encode_sync_cursor(xid: int, seq: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([xid, seq]).encode()).decode().rstrip('=')
+
+
+def decode_sync_cursor(value: str) -> Tuple[int, int]:
+    try:
+        xid, seq = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+        return int(xid), int(seq)
+    except (ValueError, TypeError):
+        raise ValueError('Некорректный cursor')
+
+
+def handle_changes(method, event, cursor, conn, headers):
+    '''
+    Дельта-синхронизация для офлайн-PWA: строки schedule, homework, grades, subjects и classes,
+    изменённые после курсора since, в текущем состоянии, и tombstone {deleted: true} для удалённых
+    или ушедших из области. Область - класс (class_id) или ученик (student_id: его класс и его
+    оценки). Без since возвращается только текущий курсор: его берут до полной загрузки списков.
+    410 - история до курсора очищена или таблица была очищена TRUNCATE: нужна полная синхронизация.
+    '''
+    if method != 'GET':
+        return {'statusCode': 405, 'headers': headers, 'body': json.dumps({'error': 'Method not allowed'})}
+    
+    params = event.get('queryStringParameters') or {}
+    session = db.session_from_event(event) or {}
+    try:
+        class_id = int(params['class_id']) if params.get('class_id') else None
+        student_id = int(params['student_id']) if params.get('student_id') else None
+        if class_id is None and student_id is None:
+            student_id, class_id = session.get('id'), session.get('class_id')
+        if class_id is None and student_id is None:
+            raise ValueError('нужен class_id или student_id')
+        limit = min(int(params.get('limit') or SYNC_PAGE_SIZE), SYNC_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError('limit должен быть положительным')
+        after = decode_sync_cursor(params['since']) if params.get('since') else None
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'Некорректные параметры: {e}'})}
+    
+    if student_id is not None and class_id is None:
+        cursor.execute('SELECT class_id FROM users WHERE id = %s', (student_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Ученик не найден'})}
+        class_id = row[0]
+    
+    cursor.execute(CHANGES_HORIZON)
+    horizon, pruned_before = (int(v) for v in cursor.fetchone())
+    fresh_cursor = encode_sync_cursor(horizon, 0)
+    if after is None:
+        return {'statusCode': 200, 'headers': headers, 'body': db.dumps({'changes': [], 'cursor': fresh_cursor, 'has_more': False})}
+    
+    resync = {'statusCode': 410, 'headers': headers, 'body': db.dumps({
+        'error': 'История изменений недоступна, нужна полная синхронизация', 'cursor': fresh_cursor
+    })}
+    if after[0] < pruned_before:
+        return resync
+    
+    cursor.execute(CHANGES_LOG, {
+        'class_id': class_id,
+        'student_id': student_id,
+        'after_xid': str(after[0]),
+        'after_seq': after[1],
+        'horizon': str(horizon),
+        'limit': limit + 1
+    })
+    log = cursor.fetchall()
+    has_more = len(log) > limit
+    log = log[:limit]
+    if any(op == 'T' for _, _, _, _, op in log):
+        return resync
+    
+    # Несколько изменений одной строки отдаются одним её текущим состоянием, в порядке последнего изменения
+    keys: Dict[Tuple[str, int], None] = {}
+    for _, _, table_name, row_id, _ in log:
+        keys.pop((table_name, row_id), None)
+        keys[(table_name, row_id)] = None
+    current: Dict[Tuple[str, int], Any] = {}
+    for table_name, query in CHANGES_ROWS.items():
+        ids = [row_id for table, row_id in keys if table == table_name]
+        if ids:
+            cursor.execute(query, {'ids': ids, 'class_id': class_id, 'student_id': student_id})
+            current.update(((table_name, row_id), data) for row_id, data in cursor.fetchall())
+    
+    changes = [
+        {'table': table, 'id': row_id, 'row': current[(table, row_id)]} if (table, row_id) in current
+        else {'table': table, 'id': row_id, 'deleted': True}
+        for table, row_id in keys
+    ]
+    if has_more:
+        next_cursor = encode_sync_cursor(int(log[-1][0]), log[-1][1])
+    else:
+        next_cursor = encode_sync_cursor(*max(after, (horizon, 0)))
+    return {'statusCode': 200, 'headers': headers, 'body': db.dumps({'changes': changes, 'cursor': next_cursor, 'has_more': has_more})}
+
+
+GRADEBOOK_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+GRADEBOOK_DATES = '''
+    SELECT DISTINCT g.lesson_date
+    FROM grades g
+    JOIN users u ON u.id = g.student_id
+    WHERE u.class_id = %(class_id)s AND g.lesson_date BETWEEN %(date_from)s AND %(date_to)s
+    ORDER BY g.lesson_date
+'''
+
+GRADEBOOK_GRADES = '''
+    SELECT g.subject_id, sub.name, g.student_id, u.full_name, g.lesson_date, g.grade
+    FROM grades g
+    JOIN users u ON u.id = g.student_id
+    LEFT JOIN subjects sub ON sub.id = g.subject_id
+    WHERE u.class_id = %(class_id)s AND g.lesson_date BETWEEN %(date_from)s AND %(date_to)s
+    ORDER BY sub.name, g.subject_id, u.full_name, g.student_id, g.lesson_date, g.id
+'''
+
+
+def school_year(today: date) -> Tuple[date, date]:
+    start_year = today.year if today.month >= 9 else today.year - 1
+    return date(start_year, 9, 1), date(start_year + 1, 8, 31)
+
+
+def gradebook_chunks(conn, args: Dict[str, Any], dates: List[date], file_format: str) -> Iterator[Any]:
+    '''Оценки идут серверным курсором пачками по STREAM_BATCH_SIZE прямо в writer журнала'''
+    cur = conn.cursor(name='school_gradebook')
+    cur.itersize = STREAM_BATCH_SIZE
+    try:
+        cur.execute(GRADEBOOK_GRADES, args)
+        lines = gradebook.gradebook_rows(cur, dates)
+        writer = gradebook.xlsx_chunks if file_format == 'xlsx' else gradebook.csv_chunks
+        yield from writer(lines)
+    finally:
+        cur.close()
+
+
+def handle_gradebook(method, event, cursor, conn, headers):
+    '''
+    Журнал класса за период: строки - предмет и ученик, колонки - даты с оценками и средний
+    балл, после каждого предмета - средний по классу. CSV или XLSX (format=xlsx). Файл пишется
+    в хранилище вложений, в ответе - ссылка на него для action=download функции schedule.
+    '''
+    if method != 'GET':
+        return {'statusCode': 405, 'headers': headers, 'body': json.dumps({'error': 'Method not allowed'})}
+    
+    params = event.get('queryStringParameters') or {}
+    try:
+        class_id = int(params.get('class_id'))
+        default_from, default_to = school_year(date.today())
+        date_from = date.fromisoformat(params['date_from']) if params.get('date_from') else default_from
+        date_to = date.fromisoformat(params['date_to']) if params.get('date_to') else default_to
+        file_format = params.get('format') or 'csv'
+        if file_format not in GRADEBOOK_FORMATS:
+            raise ValueError(f'format: одно из {", ".join(GRADEBOOK_FORMATS)}')
+    except (TypeError, ValueError) as e:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'Некорректные параметры: {e}'})}
+    
+    args = {'class_id': class_id, 'date_from': date_from, 'date_to': date_to}
+    cursor.execute(GRADEBOOK_DATES, args)
+    dates = [row[0] for row in cursor.fetchall()]
+    
+    name = f'gradebook-{class_id}-{date_from}-{date_to}.{file_format}'
+    content_type = GRADEBOOK_FORMATS[file_format]
+    sha256, size = storage.tenant_store().put_chunks(gradebook_chunks(conn, args, dates, file_format), content_type)
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+        'file': storage.file_ref(name, content_type, size, sha256),
+        'download': f'?action=download&sha256={sha256}&name={quote(name)}'
+    })}
+
+
+def handle_analytics(method, event, cursor, conn, headers):
+    '''
+    Аналитика оценок школы или класса (class_id) за период date_from..date_to (по умолчанию
+    учебный год): распределения и перцентили по классам, предметам и учителям, недельный тренд,
+    группа риска. Отчёт кэшируется по (область, период) до изменения оценок или справочников.
+    '''
+    if method != 'GET':
+        return {'statusCode': 405, 'headers': headers, 'body': json.dumps({'error': 'Method not allowed'})}
+    
+    params = event.get('queryStringParameters') or {}
+    try:
+        class_id = int(params['class_id']) if params.get('class_id') else None
+        default_from, default_to = school_year(date.today())
+        date_from = date.fromisoformat(params['date_from']) if params.get('date_from') else default_from
+        date_to = date.fromisoformat(params['date_to']) if params.get('date_to') else default_to
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'Некорректные параметры: {e}'})}
+    
+    # NumPy грузится только здесь, а не при каждом холодном старте функции
+    import analytics
+    
+    versions = [analytics.grades_version(cursor), *db.table_versions(conn, analytics.SOURCE_TABLES)]
+    etag = '"analytics-%s-%s-%s-%s-%s"' % (db.current_tenant().slug, class_id or 'school', date_from, date_to,
+                                           '.'.join(str(v) for v in versions))
+    if db.is_not_modified(event, etag):
+        return db.not_modified_response(etag)
+    
+    key = (conn.schema, class_id, date_from, date_to)
+    payload = analytics.report_cache.get(key, versions)
+    cache_status = 'hit'
+    if payload is None:
+        columns = analytics.load_columns(cursor, date_from, date_to, class_id)
+        references = {name: db.reference_cache.get(conn, name) for name in ('users', 'subjects', 'classes')}
+        payload = db.dumps({
+            'class_id': class_id,
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'grades': len(columns.grade),
+            **analytics.build_report(columns, references)
+        })
+        analytics.report_cache.put(key, versions, payload)
+        cache_status = 'miss'
+    
+    return {'statusCode': 200, 'headers': {**headers, **db.etag_headers(etag), 'X-Analytics-Cache': cache_status}, 'body': payload}
+
+
+def homework_extra(conn) -> db.Extra:
+    '''Поля ДЗ из кэша справочников: предмет, класс и учитель (колонки class_id=1, subject_id=2, teacher_id=3)'''
+    subject = db.reference_cache.lookup(conn, 'subjects', (None, None))
+    class_ = db.reference_cache.lookup(conn, 'classes', (None,))
+    user = db.reference_cache.lookup(conn, 'users', (None,))
+    return [
+        ('subject_name', lambda r: subject(r[2])[0]),
+        ('subject_color', lambda r: subject(r[2])[1]),
+        ('class_name', lambda r: class_(r[1])[0]),
+        ('teacher_name', lambda r: user(r[3])[0])
+    ]
+
+
+def grade_extra(conn) -> db.Extra:
+    '''Поля оценки из кэша справочников: предмет, ученик и учитель (колонки student_id=1, subject_id=2, teacher_id=3)'''
+    subject = db.reference_cache.lookup(conn, 'subjects', (None, None))
+    user = db.reference_cache.lookup(conn, 'users', (None,))
+    return [
+        ('subject_name', lambda r: subject(r[2])[0]),
+        ('subject_color', lambda r: subject(r[2])[1]),
+        ('student_name', lambda r: user(r[1])[0]),
+        ('teacher_name', lambda r: user(r[3])[0])
+    ]
+
+
+def wants_ndjson(event) -> bool:
+    params = event.get('queryStringParameters') or {}
+    return params.get('format') == 'ndjson' or 'application/x-ndjson' in (db.request_header(event, 'Accept') or '')
+
+
+def wants_stream(event) -> bool:
+    params = event.get('queryStringParameters') or {}
+    return params.get('stream') == 'true' or wants_ndjson(event)
+
+
+# Порядок выгрузки: (выражение, тип, колонка строки) - все по убыванию, NULL первыми, как в
+# обычном списке; id в конце делает ключ уникальным для курсора следующей страницы
+StreamOrder = List[Tuple[str, str, int]]
+HOMEWORK_STREAM_ORDER: StreamOrder = [
+    ("COALESCE(h.due_date, 'infinity'::date)", 'date', 6),
+    ("COALESCE(h.created_at, 'infinity'::timestamp)", 'timestamp', 7),
+    ('h.id', 'integer', 0)
+]
+GRADES_STREAM_ORDER: StreamOrder = [
+    ("COALESCE(g.lesson_date, 'infinity'::date)", 'date', 6),
+    ("COALESCE(g.created_at, 'infinity'::timestamp)", 'timestamp', 7),
+    ('g.id', 'integer', 0)
+]
+
+
+def encode_stream_cursor(row: Tuple, order: StreamOrder) -> str:
+    key = [row[column].isoformat() if hasattr(row[column], 'isoformat') else row[column] for _, _, column in order]
+    key = ['infinity' if value is None else value for value in key]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_stream_cursor(value: str, order: StreamOrder) -> List[Any]:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+        if not isinstance(key, list) or len(key) != len(order):
+            raise ValueError
+        return [int(v) if kind == 'integer' else str(v) for v, (_, kind, _) in zip(key, order)]
+    except (ValueError, TypeError):
+        raise ValueError('Некорректный cursor')
+
+
+def stream_rows(conn, query: str, params_list: List[Any], extra: db.Extra, ndjson: bool,
+                limit: int, last: List[Tuple]) -> Iterator[str]:
+    '''
+    Читает выборку серверным (именованным) курсором пачками по STREAM_BATCH_SIZE
+    и отдаёт JSON-массив (или NDJSON) кусками - по одному на пачку, не больше limit строк.
+    Последняя отданная строка кладётся в last, а строка сверх limit - признак следующей страницы.
+    '''
+    cur = conn.cursor(name='school_stream')
+    cur.itersize = STREAM_BATCH_SIZE
+    try:
+        cur.execute(query, params_list)
+        rows_iter = iter(cur)
+        first = True
+        sent = 0
+        if not ndjson:
+            yield '['
+        while sent < limit:
+            rows = list(islice(rows_iter, min(STREAM_BATCH_SIZE, limit - sent)))
+            if not rows:
+                break
+            sent += len(rows)
+            last[:] = [rows[-1]]
+            encoded = [json.dumps(item) for item in db.shape_rows(cur, rows, extra)]
+            if ndjson:
+                yield '\n'.join(encoded) + '\n'
+            else:
+                yield ('' if first else ', ') + ', '.join(encoded)
+            first = False
+        if not ndjson:
+            yield ']'
+        if sent == limit and next(rows_iter, None) is not None:
+            last.append(None)
+    finally:
+        cur.close()
+
+
+def stream_response(conn, query: str, params_list: List[Any], order: StreamOrder, extra: db.Extra,
+                    event, headers) -> Dict[str, Any]:
+    '''
+    Страница выгрузки: до STREAM_PAGE_ROWS строк после cursor. Платформа принимает body только
+    строкой, поэтому куски склеиваются здесь, а пик памяти ограничен размером страницы;
+    курсор следующей страницы - в X-Next-Cursor (нет заголовка - выгрузка закончена).
+    '''
+    params = event.get('queryStringParameters') or {}
+    ndjson = wants_ndjson(event)
+    args = list(params_list)
+    if params.get('cursor'):
+        try:
+            after = decode_stream_cursor(params['cursor'], order)
+        except ValueError as e:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'Некорректные параметры: {e}'})}
+        query += ' AND (%s) < (%s)' % (', '.join(expr for expr, _, _ in order),
+                                       ', '.join(f'%s::{kind}' for _, kind, _ in order))
+        args.extend(after)
+    query += ' ORDER BY ' + ', '.join(f'{expr} DESC' for expr, _, _ in order)
+    
+    last: List[Tuple] = []
+    body = ''.join(stream_rows(conn, query, args, extra, ndjson, STREAM_PAGE_ROWS, last))
+    headers = {**headers, 'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+    if ndjson:
+        headers['Content-Type'] = 'application/x-ndjson'
+    if len(last) == 2:
+        headers['X-Next-Cursor'] = encode_stream_cursor(last[0], order)
+    return {'statusCode': 200, 'headers': headers, 'body': body}
@@ -0,0 +1,314 @@
+'''
+Business: Хранилище вложений ДЗ по содержимому (SHA-256) с докачиваемой загрузкой частями
+Args: FILES_ROOT - каталог локального хранилища; байты файла целиком или частями по смещению
+Returns: ссылки {name, type, size, sha256} для schedule.homework_files и чтение диапазонов байт
+
+Одинаковые файлы (один и тот же лист с заданием для разных классов) хранятся один раз:
+blobs/ab/cd/<sha256>, рядом <sha256>.json с типом содержимого. Незавершённые загрузки лежат
+в uploads/<upload_id>/ и докачиваются с того смещения, до которого дошли. У каждой школы
+своё хранилище: основная схема - в корне FILES_ROOT, остальные - в FILES_ROOT/tenants/<схема>. Запуск как скрипта переносит старые base64-вложения
+из schedule.homework_files в хранилище: python storage.py migrate (DATABASE_URL из окружения).
+'''
+
+import base64
+import binascii
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import db
+
+FILES_ROOT = os.environ.get('FILES_ROOT', '/tmp/edu-files')
+FILES_MAX_SIZE = int(os.environ.get('FILES_MAX_SIZE', str(50 * 1024 * 1024)))
+FILES_CHUNK_SIZE = int(os.environ.get('FILES_CHUNK_SIZE', str(1024 * 1024)))
+UPLOAD_TTL = 24 * 3600
+READ_BLOCK = 256 * 1024
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+DATA_URL_RE = re.compile(r'^data:([^;,]*)(;base64)?,', re.IGNORECASE)
+
+
+class StorageError(ValueError):
+    '''Ошибка клиента: неверные параметры, смещение или контрольная сумма'''
+
+
+class LocalBlobStore:
+    '''Блобы и незавершённые загрузки в локальном каталоге; запись блоба атомарна (rename)'''
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob_path(self, sha256: str) -> str:
+        if not SHA256_RE.match(sha256 or ''):
+            raise StorageError('Некорректный sha256')
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256[2:4], sha256)
+
+    def upload_dir(self, upload_id: str) -> str:
+        if not UPLOAD_ID_RE.match(upload_id or ''):
+            raise StorageError('Некорректный upload_id')
+        return os.path.join(self.root, 'uploads', upload_id)
+
+    def content_type(self, sha256: str) -> str:
+        '''Тип, с которым блоб был загружен; у файлов до появления метаданных - octet-stream'''
+        try:
+            with open(self.blob_path(sha256) + '.json') as f:
+                return json.load(f).get('type') or 'application/octet-stream'
+        except (FileNotFoundError, ValueError):
+            return 'application/octet-stream'
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.blob_path(sha256))
+
+    def size(self, sha256: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.blob_path(sha256))
+        except FileNotFoundError:
+            return None
+
+    def _commit(self, staged: str, sha256: str, content_type: str) -> None:
+        '''
+        Переносит готовый файл в blobs; если такой блоб уже есть - просто удаляет копию.
+        Тип записывается до самого блоба и только первым загрузившим: по нему отдаётся файл.
+        '''
+        target = self.blob_path(sha256)
+        if os.path.exists(target):
+            os.remove(staged)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not os.path.exists(target + '.json'):
+            staged_meta = f'{staged}.json'
+            with open(staged_meta, 'w') as f:
+                json.dump({'type': content_type or 'application/octet-stream'}, f)
+            os.replace(staged_meta, target + '.json')
+        os.replace(staged, target)
+
+    def put_bytes(self, data: bytes, content_type: str = '') -> str:
+        sha256 = hashlib.sha256(data).hexdigest()
+        if self.exists(sha256):
+            return sha256
+        staging = os.path.join(self.root, 'uploads')
+        os.makedirs(staging, exist_ok=True)
+        staged = os.path.join(staging, f'put-{uuid.uuid4().hex}')
+        with open(staged, 'wb') as f:
+            f.write(data)
+        self._commit(staged, sha256, content_type)
+        return sha256
+
+    def put_chunks(self, chunks: Iterable[Any], content_type: str = '') -> Tuple[str, int]:
+        '''Файл из потока кусков (str пишется в UTF-8); в памяти только текущий кусок'''
+        staging = os.path.join(self.root, 'uploads')
+        os.makedirs(staging, exist_ok=True)
+        staged = os.path.join(staging, f'put-{uuid.uuid4().hex}')
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(staged, 'wb') as f:
+                for chunk in chunks:
+                    data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                    digest.update(data)
+                    size += len(data)
+                    f.write(data)
+            sha256 = digest.hexdigest()
+            self._commit(staged, sha256, content_type)
+        except BaseException:
+            if os.path.exists(staged):
+                os.remove(staged)
+            raise
+        return sha256, size
+
+    def read_range(self, sha256: str, start: int, end: int) -> bytes:
+        '''Байты [start, end] включительно'''
+        with open(self.blob_path(sha256), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def start_upload(self, meta: Dict[str, Any]) -> str:
+        self.cleanup_uploads()
+        upload_id = uuid.uuid4().hex
+        directory = self.upload_dir(upload_id)
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        open(os.path.join(directory, 'data'), 'wb').close()
+        return upload_id
+
+    def upload_state(self, upload_id: str) -> Tuple[Dict[str, Any], int]:
+        directory = self.upload_dir(upload_id)
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+            return meta, os.path.getsize(os.path.join(directory, 'data'))
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+
+    def _locked_data(self, upload_id: str, mode: str):
+        '''
+        Файл загрузки под flock: повтор части после обрыва может прийти в другой экземпляр
+        функции одновременно с оригиналом, и без блокировки обе копии прошли бы проверку смещения
+        '''
+        directory = self.upload_dir(upload_id)
+        try:
+            f = open(os.path.join(directory, 'data'), mode)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+        fcntl.flock(f, fcntl.LOCK_EX)
+        # Пока ждали блокировку, загрузку мог завершить другой запрос
+        if not os.path.isdir(directory):
+            f.close()
+            raise KeyError(upload_id)
+        return f
+
+    def append_chunk(self, upload_id: str, offset: int, chunk: bytes) -> int:
+        '''Дописывает часть строго с текущего конца файла; возвращает полученный объём'''
+        meta, _ = self.upload_state(upload_id)
+        with self._locked_data(upload_id, 'ab') as f:
+            received = os.fstat(f.fileno()).st_size
+            if offset != received:
+                raise StorageError(f'Ожидалось смещение {received}')
+            if received + len(chunk) > meta['size']:
+                raise StorageError('Часть выходит за объявленный размер файла')
+            f.write(chunk)
+        return received + len(chunk)
+
+    def finish_upload(self, upload_id: str) -> str:
+        '''Считает SHA-256 собранного файла, сверяет с заявленным и переносит в blobs'''
+        meta, _ = self.upload_state(upload_id)
+        directory = self.upload_dir(upload_id)
+        staged = os.path.join(directory, 'data')
+        with self._locked_data(upload_id, 'rb') as f:
+            digest = hashlib.sha256()
+            for block in iter(lambda: f.read(READ_BLOCK), b''):
+                digest.update(block)
+            sha256 = digest.hexdigest()
+            if meta.get('sha256') and meta['sha256'] != sha256:
+                shutil.rmtree(directory, ignore_errors=True)
+                raise StorageError('Контрольная сумма не совпадает, загрузите файл заново')
+            self._commit(staged, sha256, meta.get('type', ''))
+            shutil.rmtree(directory, ignore_errors=True)
+        return sha256
+
+    def cleanup_uploads(self) -> None:
+        '''Удаляет загрузки, не получавшие данных дольше UPLOAD_TTL'''
+        staging = os.path.join(self.root, 'uploads')
+        if not os.path.isdir(staging):
+            return
+        deadline = time.time() - UPLOAD_TTL
+        for name in os.listdir(staging):
+            path = os.path.join(staging, name)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def tenant_store() -> LocalBlobStore:
+    '''Хранилище школы текущего запроса: файлы одной школы не открываются по sha256 из другой'''
+    schema = db.current_tenant().schema
+    if schema == db.DB_SCHEMA:
+        # Основная схема остаётся в корне, где уже лежат её файлы
+        return LocalBlobStore(FILES_ROOT)
+    return LocalBlobStore(os.path.join(FILES_ROOT, 'tenants', schema))
+
+
+def file_ref(name: str, content_type: str, size: int, sha256: str) -> Dict[str, Any]:
+    return {'name': name, 'type': content_type or 'application/octet-stream', 'size': size, 'sha256': sha256}
+
+
+def externalize_files(value: Any) -> Any:
+    '''
+    Вложения из тела POST/PUT расписания: элементы с data (data URL, как шлёт старый
+    клиент) сохраняются в хранилище и заменяются ссылками; ссылки проходят как есть.
+    Значение, которое не является JSON-списком, возвращается без изменений.
+    '''
+    if not value:
+        return value
+    try:
+        items = json.loads(value) if isinstance(value, str) else value
+    except ValueError:
+        return value
+    if not isinstance(items, list):
+        return value
+    store = tenant_store()
+    refs: List[Dict[str, Any]] = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise StorageError('Вложение должно быть объектом')
+        if item.get('data'):
+            match = DATA_URL_RE.match(item['data'])
+            if not match or not match.group(2):
+                raise StorageError('data вложения должен быть base64 data URL')
+            try:
+                payload = base64.b64decode(item['data'][match.end():], validate=True)
+            except binascii.Error:
+                raise StorageError('Некорректный base64 во вложении')
+            if len(payload) > FILES_MAX_SIZE:
+                raise StorageError('Файл больше FILES_MAX_SIZE')
+            sha256 = store.put_bytes(payload, item.get('type') or match.group(1))
+            refs.append(file_ref(item.get('name') or sha256, item.get('type') or match.group(1), len(payload), sha256))
+        elif item.get('sha256'):
+            size = store.size(item['sha256'])
+            if size is None:
+                raise StorageError(f'Файл {item["sha256"]} не загружен')
+            refs.append(file_ref(item.get('name') or item['sha256'], item.get('type', ''), size, item['sha256']))
+        else:
+            raise StorageError('Вложение без data и без sha256')
+    return json.dumps(refs, ensure_ascii=False)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    '''
+    Один диапазон из Range: bytes=a-b, bytes=a- или bytes=-n. None - отдать файл целиком
+    (заголовка нет или он не про байты/с несколькими диапазонами), StorageError - 416.
+    '''
+    if not header or not header.strip().lower().startswith('bytes=') or ',' in header:
+        return None
+    spec = header.strip()[6:].strip()
+    first, sep, last = spec.partition('-')
+    if not sep:
+        return None
+    try:
+        if first == '':
+            length = int(last)
+            if length <= 0:
+                raise StorageError('Пустой диапазон')
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise StorageError('Диапазон за пределами файла')
+    return start, end
+
+
+if __name__ == '__main__':
+    import sys
+    import psycopg2
+
+    if sys.argv[1:] != ['migrate']:
+        raise SystemExit('usage: python storage.py migrate')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        read_cur, write_cur = conn.cursor(), conn.cursor()
+        moved = 0
+        read_cur.execute('''SELECT id, homework_files FROM schedule WHERE homework_files LIKE '%"data"%' ''')
+        for row_id, files in read_cur.fetchall():
+            try:
+                refs = externalize_files(files)
+            except (StorageError, ValueError) as e:
+                print(f'schedule {row_id}: пропущено ({e})', file=sys.stderr)
+                continue
+            write_cur.execute('UPDATE schedule SET homework_files = %s WHERE id = %s', (refs, row_id))
+            moved += 1
+        conn.commit()
+        print(f'перенесено записей: {moved}')
+    finally:
+        conn.close()
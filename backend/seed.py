@@ -0,0 +1,213 @@
+'''
+Business: Заполнение БД синтетической школой продакшн-объёма для замеров
+Args: --classes, --students-per-class, --teachers, --weeks, --start; DATABASE_URL из окружения
+Returns: классы, ученики, учителя, расписание на учебный год, ДЗ и оценки, загруженные через COPY
+
+Запуск: DATABASE_URL=postgresql://... python backend/seed.py --classes 30 --students-per-class 25
+Повторный запуск добавляет ещё одну школу с новой меткой (--tag), старые данные не трогаются.
+'''
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+import psycopg2
+
+DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']
+PERIODS = [
+    ('08:30', '09:15'), ('09:25', '10:10'), ('10:30', '11:15'),
+    ('11:35', '12:20'), ('12:30', '13:15'), ('13:25', '14:10')
+]
+FIRST_NAMES = ['Иван', 'Мария', 'Алексей', 'Анна', 'Дмитрий', 'Елена', 'Сергей', 'Ольга', 'Никита', 'Дарья']
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Волков', 'Соколов', 'Лебедев', 'Козлов']
+COPY_BATCH_ROWS = 50000
+# Оценки 4 и 5 встречаются чаще, как в настоящем журнале
+GRADE_WEIGHTS = [(1, 2), (2, 8), (3, 25), (4, 35), (5, 30)]
+
+
+def copy_value(value: Any) -> str:
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def copy_rows(cur, table: str, columns: Sequence[str], rows: Iterable[Tuple]) -> int:
+    '''COPY FROM STDIN пачками по COPY_BATCH_ROWS, чтобы не держать всю таблицу в памяти'''
+    statement = f'COPY {table} ({", ".join(columns)}) FROM STDIN'
+    total = 0
+    buffer = io.StringIO()
+    in_buffer = 0
+    for row in rows:
+        buffer.write('\t'.join(copy_value(v) for v in row))
+        buffer.write('\n')
+        in_buffer += 1
+        if in_buffer == COPY_BATCH_ROWS:
+            buffer.seek(0)
+            cur.copy_expert(statement, buffer)
+            total += in_buffer
+            buffer, in_buffer = io.StringIO(), 0
+    if in_buffer:
+        buffer.seek(0)
+        cur.copy_expert(statement, buffer)
+        total += in_buffer
+    return total
+
+
+def person_name(rng: random.Random) -> str:
+    return f'{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}'
+
+
+def timed(label: str, step: Callable[[], int]) -> int:
+    started = time.monotonic()
+    count = step()
+    print(f'{label}: {count} строк за {time.monotonic() - started:.1f} с', file=sys.stderr)
+    return count
+
+
+def seed(conn, args: argparse.Namespace) -> Dict[str, int]:
+    rng = random.Random(args.seed)
+    tag = args.tag
+    counts: Dict[str, int] = {}
+    cur = conn.cursor()
+
+    cur.execute('SELECT id, name FROM subjects ORDER BY id')
+    subjects: List[Tuple[int, str]] = cur.fetchall()
+    if not subjects:
+        raise SystemExit('В таблице subjects нет предметов: сначала примените db_migrations')
+
+    counts['classes'] = timed('classes', lambda: copy_rows(
+        cur, 'classes', ['name', 'description'],
+        ((f'{5 + c % 7}{"АБВГДЕЖЗ"[c // 7 % 8]}-{tag}-{c}', 'Синтетический класс') for c in range(args.classes))
+    ))
+    cur.execute('SELECT id FROM classes WHERE name LIKE %s ORDER BY id', (f'%-{tag}-%',))
+    class_ids = [r[0] for r in cur.fetchall()]
+
+    # Учителя распределены по предметам по кругу, чтобы у каждого предмета был хотя бы один
+    counts['teachers'] = timed('teachers', lambda: copy_rows(
+        cur, 'users', ['email', 'password', 'role', 'full_name', 'subject_id'],
+        ((f'teacher{t}.{tag}@seed.local', 'teacher123', 'teacher', person_name(rng), subjects[t % len(subjects)][0])
+         for t in range(args.teachers))
+    ))
+    cur.execute("SELECT id, subject_id FROM users WHERE email LIKE %s AND role = 'teacher' ORDER BY id",
+                (f'teacher%.{tag}@seed.local',))
+    teachers_by_subject: Dict[int, List[int]] = {}
+    for teacher_id, subject_id in cur.fetchall():
+        teachers_by_subject.setdefault(subject_id, []).append(teacher_id)
+    teacher_names = {}
+
+    counts['students'] = timed('students', lambda: copy_rows(
+        cur, 'users', ['email', 'password', 'role', 'full_name', 'class_id'],
+        ((f'student{c}_{s}.{tag}@seed.local', 'student123', 'student', person_name(rng), class_id)
+         for c, class_id in enumerate(class_ids) for s in range(args.students_per_class))
+    ))
+    cur.execute("SELECT id, class_id FROM users WHERE email LIKE %s AND role = 'student' ORDER BY id",
+                (f'student%.{tag}@seed.local',))
+    students_by_class: Dict[int, List[int]] = {}
+    for student_id, class_id in cur.fetchall():
+        students_by_class.setdefault(class_id, []).append(student_id)
+    cur.execute('SELECT id, full_name FROM users WHERE id = ANY(%s)',
+                ([t for ts in teachers_by_subject.values() for t in ts],))
+    teacher_names.update(cur.fetchall())
+
+    # Предмет слота сдвигается на номер класса: у классов с одним предметом в одном слоте
+    # номера отличаются на кратное числу предметов, и им достаются разные учителя
+    def subject_at(c: int, slot: int) -> Tuple[int, str]:
+        return subjects[(c + slot) % len(subjects)]
+
+    def teacher_for(c: int, subject_id: int) -> Any:
+        teachers = teachers_by_subject.get(subject_id)
+        return teachers[(c // len(subjects)) % len(teachers)] if teachers else None
+
+    week_starts = [args.start + timedelta(weeks=w) for w in range(args.weeks)]
+
+    def lessons() -> Iterable[Tuple]:
+        for week_start in week_starts:
+            for c, class_id in enumerate(class_ids):
+                for d, day in enumerate(DAYS):
+                    for p, (start, end) in enumerate(PERIODS):
+                        subject_id, subject_name = subject_at(c, d * len(PERIODS) + p)
+                        teacher_id = teacher_for(c, subject_id)
+                        yield (day, start, end, subject_name, teacher_names.get(teacher_id, ''), '',
+                               subject_id, week_start + timedelta(days=d), class_id, teacher_id,
+                               f'{100 + c}', '')
+
+    counts['schedule'] = timed('schedule', lambda: copy_rows(
+        cur, 'schedule',
+        ['day_of_week', 'time_start', 'time_end', 'subject', 'teacher', 'notes',
+         'subject_id', 'lesson_date', 'class_id', 'teacher_id', 'room', 'homework'],
+        lessons()
+    ))
+
+    def homework() -> Iterable[Tuple]:
+        for week_start in week_starts:
+            for c, class_id in enumerate(class_ids):
+                for subject_id, subject_name in subjects:
+                    teacher_id = teacher_for(c, subject_id)
+                    if teacher_id is None:
+                        continue
+                    yield (class_id, subject_id, teacher_id, f'{subject_name}: задание на неделю {week_start.isoformat()}',
+                           f'Параграф {rng.randint(1, 40)}, упражнения {rng.randint(1, 300)}-{rng.randint(301, 600)}',
+                           week_start + timedelta(days=rng.randint(1, 6)))
+
+    counts['homework'] = timed('homework', lambda: copy_rows(
+        cur, 'homework', ['class_id', 'subject_id', 'teacher_id', 'title', 'description', 'due_date'], homework()
+    ))
+
+    grades_values = [g for g, _ in GRADE_WEIGHTS]
+    grades_weights = [w for _, w in GRADE_WEIGHTS]
+
+    def grades() -> Iterable[Tuple]:
+        for week_start in week_starts:
+            for c, class_id in enumerate(class_ids):
+                for subject_id, _ in subjects:
+                    teacher_id = teacher_for(c, subject_id)
+                    if teacher_id is None:
+                        continue
+                    for student_id in students_by_class.get(class_id, []):
+                        if rng.random() < args.grade_rate:
+                            yield (student_id, subject_id, teacher_id,
+                                   rng.choices(grades_values, grades_weights)[0], '',
+                                   week_start + timedelta(days=rng.randint(0, len(DAYS) - 1)))
+
+    counts['grades'] = timed('grades', lambda: copy_rows(
+        cur, 'grades', ['student_id', 'subject_id', 'teacher_id', 'grade', 'comment', 'lesson_date'], grades()
+    ))
+
+    conn.commit()
+    timed('analyze', lambda: cur.execute('ANALYZE') or 0)
+    conn.commit()
+    cur.close()
+    return counts
+
+
+def school_year_start() -> date:
+    today = date.today()
+    year = today.year if today.month >= 9 else today.year - 1
+    first = date(year, 9, 1)
+    return first - timedelta(days=first.weekday())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Синтетическая школа для нагрузочных замеров')
+    parser.add_argument('--classes', type=int, default=30)
+    parser.add_argument('--students-per-class', type=int, default=25)
+    parser.add_argument('--teachers', type=int, default=60)
+    parser.add_argument('--weeks', type=int, default=34, help='недель расписания от --start')
+    parser.add_argument('--start', type=date.fromisoformat, default=school_year_start(),
+                        help='понедельник первой недели, по умолчанию начало учебного года')
+    parser.add_argument('--grade-rate', type=float, default=0.8,
+                        help='вероятность оценки ученику по предмету за неделю')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tag', default=str(int(time.time())), help='метка в email и названиях классов')
+    cli_args = parser.parse_args()
+
+    connection = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        print(seed(connection, cli_args))
+    finally:
+        connection.close()
@@ -6,11 +6,12 @@ Returns: HTTP response dict with students data or error
 '''
 
 import json
-import os
 from typing import Dict, Any
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+import db
+
+@db.instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -21,29 +22,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Tenant, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    db_url = os.environ.get('DATABASE_URL')
+    params = event.get('queryStringParameters') or {}
+    if params.get('pool') == 'stats':
+        return db.pool_stats_response(event)
     
     try:
-        conn = psycopg2.connect(db_url)
+        conn = db.acquire()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # GET - получить всех учеников
         if method == 'GET':
             query = "SELECT id, email, full_name, created_at FROM users WHERE role = 'student' ORDER BY created_at DESC"
-            cur.execute(query)
-            students = cur.fetchall()
-            
-            result = [dict(s) for s in students]
-            for item in result:
-                if item.get('created_at'):
-                    item['created_at'] = item['created_at'].isoformat()
+            with conn.cursor() as plain_cur:
+                db.run(plain_cur, query)
+                result = db.shape_rows(plain_cur, plain_cur.fetchall(), columnar=db.wants_columnar(event))
             
             return {
                 'statusCode': 200,
@@ -52,22 +51,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Access-Control-Allow-Origin': '*'
                 },
                 'isBase64Encoded': False,
-                'body': json.dumps({'students': result})
+                'body': db.dumps({'students': result})
             }
         
         # POST - создать нового ученика
         if method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
-            email = body_data.get('email', '').replace("'", "''")
-            password = body_data.get('password', '').replace("'", "''")
-            full_name = body_data.get('full_name', '').replace("'", "''")
+            email = body_data.get('email', '')
+            password = body_data.get('password', '')
+            full_name = body_data.get('full_name', '')
             
-            query = f"""
+            query = """
                 INSERT INTO users (email, password, role, full_name) 
-                VALUES ('{email}', '{password}', 'student', '{full_name}')
+                VALUES (%s, %s, 'student', %s)
                 RETURNING id
             """
-            cur.execute(query)
+            db.run(cur, query, (email, password, full_name))
             result = cur.fetchone()
             conn.commit()
             
@@ -89,8 +88,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             params = event.get('queryStringParameters', {})
             student_id = params.get('id', '')
             
-            query = f"DELETE FROM users WHERE id = {student_id} AND role = 'student'"
-            cur.execute(query)
+            db.run(cur, "DELETE FROM users WHERE id = %s AND role = 'student'", (student_id,))
             conn.commit()
             
             return {
@@ -127,4 +125,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
+            db.release(conn)
@@ -1,8 +1,9 @@
 import json
-import os
-import psycopg2
 from typing import Dict, Any
 
+import db
+
+@db.instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Управление школьными предметами
@@ -18,141 +19,136 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Tenant, Authorization, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
-    
-    if method == 'GET':
-        cur.execute('SELECT id, name, color, created_at FROM subjects ORDER BY name')
-        rows = cur.fetchall()
-        subjects = [{'id': r[0], 'name': r[1], 'color': r[2], 'created_at': r[3].isoformat()} for r in rows]
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps(subjects)
-        }
+    params = event.get('queryStringParameters') or {}
+    if params.get('pool') == 'stats':
+        return db.pool_stats_response(event)
     
-    if method == 'POST':
-        body = json.loads(event.get('body', '{}'))
-        name = body.get('name', '').strip()
-        color = body.get('color', '#3b82f6')
-        
-        if not name:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Название предмета обязательно'})
-            }
-        
-        cur.execute(
-            'INSERT INTO subjects (name, color) VALUES (%s, %s) RETURNING id, name, color, created_at',
-            (name, color)
-        )
-        row = cur.fetchone()
-        conn.commit()
-        subject = {'id': row[0], 'name': row[1], 'color': row[2], 'created_at': row[3].isoformat()}
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps(subject)
-        }
+    conn = db.acquire()
+    cur = conn.cursor()
     
-    if method == 'PUT':
-        body = json.loads(event.get('body', '{}'))
-        subject_id = body.get('id')
-        name = body.get('name', '').strip()
-        color = body.get('color', '#3b82f6')
-        
-        if not subject_id or not name:
-            cur.close()
-            conn.close()
+    try:
+        if method == 'GET':
+            etag = db.make_etag('subjects', conn, ['subjects'])
+            if db.is_not_modified(event, etag):
+                return db.not_modified_response(etag)
+            
+            cur.execute('SELECT id, name, color, created_at FROM subjects ORDER BY name')
+            subjects = db.shape_rows(cur, cur.fetchall(), columnar=db.wants_columnar(event))
+            
             return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'ID и название обязательны'})
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **db.etag_headers(etag)},
+                'isBase64Encoded': False,
+                'body': db.dumps(subjects)
             }
         
-        cur.execute(
-            'UPDATE subjects SET name = %s, color = %s WHERE id = %s RETURNING id, name, color, created_at',
-            (name, color, subject_id)
-        )
-        row = cur.fetchone()
-        conn.commit()
-        
-        if not row:
-            cur.close()
-            conn.close()
+        if method == 'POST':
+            body = json.loads(event.get('body', '{}'))
+            name = body.get('name', '').strip()
+            color = body.get('color', '#3b82f6')
+            
+            if not name:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Название предмета обязательно'})
+                }
+            
+            cur.execute(
+                'INSERT INTO subjects (name, color) VALUES (%s, %s) RETURNING id, name, color, created_at',
+                (name, color)
+            )
+            row = cur.fetchone()
+            conn.commit()
+            db.reference_cache.invalidate('subjects')
+            subject = {'id': row[0], 'name': row[1], 'color': row[2], 'created_at': row[3].isoformat()}
+            
             return {
-                'statusCode': 404,
+                'statusCode': 201,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Предмет не найден'})
+                'isBase64Encoded': False,
+                'body': json.dumps(subject)
             }
         
-        subject = {'id': row[0], 'name': row[1], 'color': row[2], 'created_at': row[3].isoformat()}
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps(subject)
-        }
-    
-    if method == 'DELETE':
-        params = event.get('queryStringParameters', {})
-        subject_id = params.get('id')
-        
-        if not subject_id:
-            cur.close()
-            conn.close()
+        if method == 'PUT':
+            body = json.loads(event.get('body', '{}'))
+            subject_id = body.get('id')
+            name = body.get('name', '').strip()
+            color = body.get('color', '#3b82f6')
+            
+            if not subject_id or not name:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'ID и название обязательны'})
+                }
+            
+            cur.execute(
+                'UPDATE subjects SET name = %s, color = %s WHERE id = %s RETURNING id, name, color, created_at',
+                (name, color, subject_id)
+            )
+            row = cur.fetchone()
+            conn.commit()
+            db.reference_cache.invalidate('subjects')
+            
+            if not row:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Предмет не найден'})
+                }
+            
+            subject = {'id': row[0], 'name': row[1], 'color': row[2], 'created_at': row[3].isoformat()}
+            
             return {
-                'statusCode': 400,
+                'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'ID обязателен'})
+                'isBase64Encoded': False,
+                'body': json.dumps(subject)
             }
         
-        cur.execute('UPDATE schedule SET subject_id = NULL WHERE subject_id = %s', (subject_id,))
-        cur.execute('DELETE FROM subjects WHERE id = %s RETURNING id', (subject_id,))
-        row = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        if not row:
+        if method == 'DELETE':
+            params = event.get('queryStringParameters', {})
+            subject_id = params.get('id')
+            
+            if not subject_id:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'ID обязателен'})
+                }
+            
+            cur.execute('UPDATE schedule SET subject_id = NULL WHERE subject_id = %s', (subject_id,))
+            cur.execute('DELETE FROM subjects WHERE id = %s RETURNING id', (subject_id,))
+            row = cur.fetchone()
+            conn.commit()
+            db.reference_cache.invalidate('subjects')
+            
+            if not row:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Предмет не найден'})
+                }
+            
             return {
-                'statusCode': 404,
+                'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Предмет не найден'})
+                'isBase64Encoded': False,
+                'body': json.dumps({'success': True})
             }
         
         return {
-            'statusCode': 200,
+            'statusCode': 405,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'success': True})
+            'body': json.dumps({'error': 'Метод не поддерживается'})
         }
-    
-    cur.close()
-    conn.close()
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Метод не поддерживается'})
-    }
+    finally:
+        cur.close()
+        db.release(conn)
@@ -0,0 +1,146 @@
+'''
+Business: Подключение новой школы и обновление схем всех школ
+Args: create <slug> | migrate [slug ...] | list; DATABASE_URL из окружения
+Returns: схема школы с таблицами из db_migrations и запись в реестре tenants
+
+Запуск: DATABASE_URL=postgresql://... python backend/tenants.py create gymnasium-5 --max-connections 4
+После новой миграции: python backend/tenants.py migrate - догоняет схемы всех школ.
+Основная схема (DB_SCHEMA) мигрирует платформой как раньше; её реестр tenants и общий
+revoked_tokens в схемы школ не копируются.
+'''
+
+import argparse
+import os
+import re
+import secrets
+import sys
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import psycopg2
+from psycopg2 import sql
+
+DB_SCHEMA = os.environ.get('DB_SCHEMA', 't_p2953915_edu_schedule_platfor')
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / 'db_migrations'
+# Таблицы уровня платформы: живут только в DB_SCHEMA
+CONTROL_MIGRATIONS = ('V0012', 'V0018')
+SLUG_RE = re.compile(r'^[a-z0-9][a-z0-9-]{1,30}$')
+SCHEMA_RE = re.compile(r'^[a-z_][a-z0-9_]{0,62}$')
+# Администратор, которого создаёт V0001; у новой школы ему задаётся свой вход
+SEED_ADMIN_EMAIL = '22'
+
+
+def migration_files() -> List[Tuple[str, Path]]:
+    files = []
+    for path in sorted(MIGRATIONS_DIR.glob('V*__*.sql')):
+        version = path.name.split('__', 1)[0]
+        if version not in CONTROL_MIGRATIONS:
+            files.append((version, path))
+    return files
+
+
+def migrate_schema(conn, schema: str) -> List[str]:
+    '''Недостающие миграции по порядку, каждая в своей транзакции с search_path на схему школы'''
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL('CREATE SCHEMA IF NOT EXISTS {}').format(sql.Identifier(schema)))
+        cur.execute(sql.SQL('''
+            CREATE TABLE IF NOT EXISTS {}.tenant_migrations (
+                version VARCHAR(16) PRIMARY KEY,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''').format(sql.Identifier(schema)))
+        cur.execute(sql.SQL('SELECT version FROM {}.tenant_migrations').format(sql.Identifier(schema)))
+        done = {row[0] for row in cur.fetchall()}
+    conn.commit()
+
+    applied = []
+    for version, path in migration_files():
+        if version in done:
+            continue
+        with conn.cursor() as cur:
+            cur.execute('SELECT set_config(%s, %s, true)', ('search_path', f'{sql.Identifier(schema).as_string(conn)}, public'))
+            # Ранние миграции ссылаются на основную схему явно - в схеме школы это её же таблицы
+            cur.execute(path.read_text(encoding='utf-8').replace(f'{DB_SCHEMA}.', ''))
+            cur.execute('INSERT INTO tenant_migrations (version) VALUES (%s)', (version,))
+        conn.commit()
+        applied.append(path.name)
+    return applied
+
+
+def create(conn, slug: str, schema: Optional[str], name: Optional[str], max_connections: Optional[int],
+           admin_email: str, admin_password: Optional[str]) -> None:
+    if not SLUG_RE.match(slug) or slug == 'default':
+        raise SystemExit(f'Некорректный slug: {slug}')
+    schema = schema or 'school_' + slug.replace('-', '_')
+    if not SCHEMA_RE.match(schema) or schema == DB_SCHEMA:
+        raise SystemExit(f'Некорректная схема: {schema}')
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT 1 FROM {DB_SCHEMA}.tenants WHERE slug = %s OR schema_name = %s', (slug, schema))
+        if cur.fetchone():
+            raise SystemExit(f'Школа {slug} или схема {schema} уже есть')
+    conn.rollback()
+
+    for applied in migrate_schema(conn, schema):
+        print(f'{slug}: {applied}', file=sys.stderr)
+    admin_password = admin_password or secrets.token_urlsafe(12)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL('UPDATE {}.users SET email = %s, password = %s WHERE email = %s AND role = %s')
+                    .format(sql.Identifier(schema)), (admin_email, admin_password, SEED_ADMIN_EMAIL, 'admin'))
+        cur.execute(f'''
+            INSERT INTO {DB_SCHEMA}.tenants (slug, schema_name, name, max_connections) VALUES (%s, %s, %s, %s)
+        ''', (slug, schema, name, max_connections))
+    conn.commit()
+    print(f'школа {slug} в схеме {schema}; администратор {admin_email} / {admin_password}')
+
+
+def migrate(conn, slugs: List[str]) -> None:
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT slug, schema_name FROM {DB_SCHEMA}.tenants ORDER BY slug')
+        registered = cur.fetchall()
+    conn.rollback()
+    unknown = set(slugs) - {slug for slug, _ in registered}
+    if unknown:
+        raise SystemExit(f'Неизвестные школы: {", ".join(sorted(unknown))}')
+    for slug, schema in registered:
+        if slugs and slug not in slugs:
+            continue
+        applied = migrate_schema(conn, schema)
+        print(f'{slug}: {", ".join(applied) if applied else "без изменений"}')
+
+
+def list_tenants(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT slug, schema_name, COALESCE(name, ''), COALESCE(max_connections::text, 'по умолчанию'), active
+            FROM {DB_SCHEMA}.tenants ORDER BY slug
+        ''')
+        for row in cur.fetchall():
+            print('\t'.join(str(v) for v in row))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Школы на отдельных схемах БД')
+    commands = parser.add_subparsers(dest='command', required=True)
+    create_parser = commands.add_parser('create', help='создать схему школы, применить миграции и зарегистрировать')
+    create_parser.add_argument('slug', help='идентификатор школы для X-Tenant: латиница, цифры и дефис')
+    create_parser.add_argument('--schema', help='схема БД, по умолчанию school_<slug>')
+    create_parser.add_argument('--name', help='название школы')
+    create_parser.add_argument('--max-connections', type=int, help='соединений пула на школу, по умолчанию TENANT_MAX_CONNECTIONS')
+    create_parser.add_argument('--admin-email', default='admin')
+    create_parser.add_argument('--admin-password', help='по умолчанию генерируется')
+    migrate_parser = commands.add_parser('migrate', help='догнать схемы школ до последней миграции')
+    migrate_parser.add_argument('slugs', nargs='*', help='по умолчанию все школы')
+    commands.add_parser('list', help='зарегистрированные школы')
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        if args.command == 'create':
+            create(connection, args.slug, args.schema, args.name, args.max_connections,
+                   args.admin_email, args.admin_password)
+        elif args.command == 'migrate':
+            migrate(connection, args.slugs)
+        else:
+            list_tenants(connection)
+    finally:
+        connection.close()
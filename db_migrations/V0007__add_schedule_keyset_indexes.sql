@@ -0,0 +1,14 @@
+-- Ключ сортировки расписания в виде колонок, чтобы keyset-пагинация шла по индексу
+ALTER TABLE schedule
+ADD COLUMN IF NOT EXISTS day_order SMALLINT GENERATED ALWAYS AS (
+    CASE day_of_week
+        WHEN 'monday' THEN 1 WHEN 'tuesday' THEN 2 WHEN 'wednesday' THEN 3
+        WHEN 'thursday' THEN 4 WHEN 'friday' THEN 5 WHEN 'saturday' THEN 6
+        WHEN 'sunday' THEN 7
+    END
+) STORED,
+ADD COLUMN IF NOT EXISTS sort_date DATE GENERATED ALWAYS AS (COALESCE(lesson_date, '-infinity'::date)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_schedule_keyset ON schedule(sort_date DESC, day_order, time_start, id);
+CREATE INDEX IF NOT EXISTS idx_schedule_class_keyset ON schedule(class_id, sort_date DESC, day_order, time_start, id);
+CREATE INDEX IF NOT EXISTS idx_schedule_teacher_keyset ON schedule(teacher_id, sort_date DESC, day_order, time_start, id);
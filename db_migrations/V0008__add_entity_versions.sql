@@ -0,0 +1,52 @@
+-- Версии таблиц для ETag / If-None-Match. Каждая пишущая транзакция оставляет строку
+-- (таблица, свой xid) в той же транзакции, что и запись. Строки разных транзакций не
+-- пересекаются, поэтому писатели одной таблицы не ждут друг друга, как ждали бы на общем
+-- счётчике. Версия таблицы - наибольший xid среди транзакций, завершённых для всех (меньше
+-- xmin снимка): всё, что она учитывает, видно следующему чтению, а каждая новая запись,
+-- завершившись, даёт версию больше.
+CREATE TABLE IF NOT EXISTS entity_versions (
+    table_name VARCHAR(63) NOT NULL,
+    xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    PRIMARY KEY (table_name, xid)
+);
+
+CREATE OR REPLACE FUNCTION bump_entity_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO entity_versions (table_name) VALUES (TG_TABLE_NAME) ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_classes_version ON classes;
+CREATE TRIGGER trg_classes_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON classes
+FOR EACH STATEMENT EXECUTE FUNCTION bump_entity_version();
+
+DROP TRIGGER IF EXISTS trg_users_version ON users;
+CREATE TRIGGER trg_users_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON users
+FOR EACH STATEMENT EXECUTE FUNCTION bump_entity_version();
+
+DROP TRIGGER IF EXISTS trg_subjects_version ON subjects;
+CREATE TRIGGER trg_subjects_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON subjects
+FOR EACH STATEMENT EXECUTE FUNCTION bump_entity_version();
+
+DROP TRIGGER IF EXISTS trg_schedule_version ON schedule;
+CREATE TRIGGER trg_schedule_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON schedule
+FOR EACH STATEMENT EXECUTE FUNCTION bump_entity_version();
+
+-- Оставляет по таблице только последнюю завершённую версию; запускать по расписанию:
+-- SELECT prune_entity_versions();
+CREATE OR REPLACE FUNCTION prune_entity_versions() RETURNS BIGINT AS $$
+DECLARE
+    removed BIGINT;
+BEGIN
+    DELETE FROM entity_versions v
+    USING (
+        SELECT table_name, max(xid) AS latest FROM entity_versions
+        WHERE xid < pg_snapshot_xmin(pg_current_snapshot())
+        GROUP BY table_name
+    ) k
+    WHERE v.table_name = k.table_name AND v.xid < k.latest;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    RETURN removed;
+END;
+$$ LANGUAGE plpgsql;
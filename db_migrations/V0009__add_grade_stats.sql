@@ -0,0 +1,61 @@
+-- Сводная статистика оценок ученика по предмету, поддерживается триггером на grades
+CREATE TABLE IF NOT EXISTS grade_stats (
+    student_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    subject_id INTEGER NOT NULL REFERENCES subjects(id) ON DELETE CASCADE,
+    grade_count INTEGER NOT NULL DEFAULT 0,
+    grade_sum INTEGER NOT NULL DEFAULT 0,
+    count_1 INTEGER NOT NULL DEFAULT 0,
+    count_2 INTEGER NOT NULL DEFAULT 0,
+    count_3 INTEGER NOT NULL DEFAULT 0,
+    count_4 INTEGER NOT NULL DEFAULT 0,
+    count_5 INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, subject_id)
+);
+
+CREATE OR REPLACE FUNCTION apply_grade_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE grade_stats SET
+            grade_count = grade_count - 1,
+            grade_sum = grade_sum - OLD.grade,
+            count_1 = count_1 - (OLD.grade = 1)::int,
+            count_2 = count_2 - (OLD.grade = 2)::int,
+            count_3 = count_3 - (OLD.grade = 3)::int,
+            count_4 = count_4 - (OLD.grade = 4)::int,
+            count_5 = count_5 - (OLD.grade = 5)::int
+        WHERE student_id = OLD.student_id AND subject_id = OLD.subject_id;
+        -- Пустая сводка не нужна и держала бы ссылку на удаляемого ученика или предмет
+        DELETE FROM grade_stats
+        WHERE student_id = OLD.student_id AND subject_id = OLD.subject_id AND grade_count = 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO grade_stats (student_id, subject_id, grade_count, grade_sum, count_1, count_2, count_3, count_4, count_5)
+        VALUES (
+            NEW.student_id, NEW.subject_id, 1, NEW.grade,
+            (NEW.grade = 1)::int, (NEW.grade = 2)::int, (NEW.grade = 3)::int, (NEW.grade = 4)::int, (NEW.grade = 5)::int
+        )
+        ON CONFLICT (student_id, subject_id) DO UPDATE SET
+            grade_count = grade_stats.grade_count + 1,
+            grade_sum = grade_stats.grade_sum + EXCLUDED.grade_sum,
+            count_1 = grade_stats.count_1 + EXCLUDED.count_1,
+            count_2 = grade_stats.count_2 + EXCLUDED.count_2,
+            count_3 = grade_stats.count_3 + EXCLUDED.count_3,
+            count_4 = grade_stats.count_4 + EXCLUDED.count_4,
+            count_5 = grade_stats.count_5 + EXCLUDED.count_5;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_grades_stats ON grades;
+CREATE TRIGGER trg_grades_stats AFTER INSERT OR UPDATE OF student_id, subject_id, grade OR DELETE ON grades
+FOR EACH ROW EXECUTE FUNCTION apply_grade_stats();
+
+-- Начальное заполнение по уже выставленным оценкам
+INSERT INTO grade_stats (student_id, subject_id, grade_count, grade_sum, count_1, count_2, count_3, count_4, count_5)
+SELECT student_id, subject_id, COUNT(*), SUM(grade),
+       COUNT(*) FILTER (WHERE grade = 1), COUNT(*) FILTER (WHERE grade = 2), COUNT(*) FILTER (WHERE grade = 3),
+       COUNT(*) FILTER (WHERE grade = 4), COUNT(*) FILTER (WHERE grade = 5)
+FROM grades
+GROUP BY student_id, subject_id
+ON CONFLICT (student_id, subject_id) DO NOTHING;
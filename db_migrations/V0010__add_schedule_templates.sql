@@ -0,0 +1,21 @@
+-- Недельный шаблон расписания класса, из которого разворачиваются уроки на четверть
+CREATE TABLE IF NOT EXISTS schedule_templates (
+    id SERIAL PRIMARY KEY,
+    class_id INTEGER NOT NULL REFERENCES classes(id),
+    day_of_week VARCHAR(20) NOT NULL CHECK (day_of_week IN ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')),
+    time_start TIME NOT NULL,
+    time_end TIME NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    subject_id INTEGER REFERENCES subjects(id) ON DELETE SET NULL,
+    teacher VARCHAR(255) NOT NULL DEFAULT '',
+    teacher_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_schedule_templates_class ON schedule_templates(class_id);
+
+-- Уроки, развёрнутые из шаблона, помнят слот; повторное разворачивание обновляет их на месте
+ALTER TABLE schedule ADD COLUMN IF NOT EXISTS template_id INTEGER;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_schedule_template_date ON schedule(template_id, lesson_date) WHERE template_id IS NOT NULL;
@@ -0,0 +1,7 @@
+-- Кабинет урока и индексы для поиска пересечений по учителю, классу и кабинету
+ALTER TABLE schedule ADD COLUMN IF NOT EXISTS room VARCHAR(50) NOT NULL DEFAULT '';
+ALTER TABLE schedule_templates ADD COLUMN IF NOT EXISTS room VARCHAR(50) NOT NULL DEFAULT '';
+
+CREATE INDEX IF NOT EXISTS idx_schedule_teacher_slot ON schedule(teacher_id, day_order, time_start) WHERE teacher_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_schedule_class_slot ON schedule(class_id, day_order, time_start) WHERE class_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_schedule_room_slot ON schedule(room, day_order, time_start) WHERE room <> '';
@@ -0,0 +1,10 @@
+-- Отозванные сессионные токены (logout). Функции держат список в памяти и сверяют его с таблицей раз в несколько секунд
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti VARCHAR(32) PRIMARY KEY,
+    user_id INTEGER,
+    expires_at BIGINT NOT NULL,
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Истёкшие записи не нужны: токен с истёкшим сроком и так не проходит проверку
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON revoked_tokens(expires_at);
@@ -0,0 +1,88 @@
+-- Готовые недельные сетки расписания класса или учителя: JSON ответа по ключу (scope, owner_id, неделя)
+CREATE TABLE IF NOT EXISTS schedule_week_grid (
+    scope VARCHAR(10) NOT NULL,
+    owner_id INTEGER NOT NULL,
+    week_start DATE NOT NULL,
+    payload TEXT NOT NULL,
+    built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (scope, owner_id, week_start)
+);
+
+-- Сбросить сетки по ключам; week_start = NULL - все недели владельца (еженедельный урок без даты).
+-- Advisory-блокировка владельца держится до конца транзакции записи: сборщик сетки берёт ту же
+-- блокировку в shared-режиме, поэтому не может сохранить сетку по снимку до этой записи.
+CREATE OR REPLACE FUNCTION forget_week_grid(scopes TEXT[], owners INTEGER[], weeks DATE[]) RETURNS void AS $$
+DECLARE
+    k RECORD;
+BEGIN
+    FOR k IN SELECT DISTINCT u.scope, u.owner_id FROM unnest(scopes, owners) AS u(scope, owner_id) ORDER BY 1, 2 LOOP
+        PERFORM pg_advisory_xact_lock(hashtext('week_grid:' || k.scope), k.owner_id);
+    END LOOP;
+    DELETE FROM schedule_week_grid g
+    USING unnest(scopes, owners, weeks) AS u(scope, owner_id, week_start)
+    WHERE g.scope = u.scope AND g.owner_id = u.owner_id
+      AND (u.week_start IS NULL OR g.week_start = u.week_start);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION invalidate_week_grid() RETURNS trigger AS $$
+DECLARE
+    scopes TEXT[];
+    owners INTEGER[];
+    weeks DATE[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(k.scope), array_agg(k.owner_id), array_agg(k.week_start) INTO scopes, owners, weeks
+        FROM (SELECT DISTINCT o.scope, o.owner_id, date_trunc('week', r.lesson_date)::date AS week_start
+              FROM new_rows r, LATERAL (VALUES ('class', r.class_id), ('teacher', r.teacher_id)) o(scope, owner_id)
+              WHERE o.owner_id IS NOT NULL) k;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(k.scope), array_agg(k.owner_id), array_agg(k.week_start) INTO scopes, owners, weeks
+        FROM (SELECT DISTINCT o.scope, o.owner_id, date_trunc('week', r.lesson_date)::date AS week_start
+              FROM (SELECT class_id, teacher_id, lesson_date FROM old_rows
+                    UNION ALL SELECT class_id, teacher_id, lesson_date FROM new_rows) r,
+                   LATERAL (VALUES ('class', r.class_id), ('teacher', r.teacher_id)) o(scope, owner_id)
+              WHERE o.owner_id IS NOT NULL) k;
+    ELSE
+        SELECT array_agg(k.scope), array_agg(k.owner_id), array_agg(k.week_start) INTO scopes, owners, weeks
+        FROM (SELECT DISTINCT o.scope, o.owner_id, date_trunc('week', r.lesson_date)::date AS week_start
+              FROM old_rows r, LATERAL (VALUES ('class', r.class_id), ('teacher', r.teacher_id)) o(scope, owner_id)
+              WHERE o.owner_id IS NOT NULL) k;
+    END IF;
+    IF scopes IS NOT NULL THEN
+        PERFORM forget_week_grid(scopes, owners, weeks);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_schedule_week_grid_insert ON schedule;
+CREATE TRIGGER trg_schedule_week_grid_insert AFTER INSERT ON schedule
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION invalidate_week_grid();
+
+DROP TRIGGER IF EXISTS trg_schedule_week_grid_update ON schedule;
+CREATE TRIGGER trg_schedule_week_grid_update AFTER UPDATE ON schedule
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION invalidate_week_grid();
+
+DROP TRIGGER IF EXISTS trg_schedule_week_grid_delete ON schedule;
+CREATE TRIGGER trg_schedule_week_grid_delete AFTER DELETE ON schedule
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION invalidate_week_grid();
+
+-- Названия и цвета предметов зашиты в сетки, а TRUNCATE не даёт строк - сбрасываем всё
+CREATE OR REPLACE FUNCTION clear_week_grid() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM schedule_week_grid;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_schedule_week_grid_truncate ON schedule;
+CREATE TRIGGER trg_schedule_week_grid_truncate AFTER TRUNCATE ON schedule
+FOR EACH STATEMENT EXECUTE FUNCTION clear_week_grid();
+
+DROP TRIGGER IF EXISTS trg_subjects_week_grid ON subjects;
+CREATE TRIGGER trg_subjects_week_grid AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON subjects
+FOR EACH STATEMENT EXECUTE FUNCTION clear_week_grid();
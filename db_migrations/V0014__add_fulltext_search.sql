@@ -0,0 +1,17 @@
+-- Полнотекстовый поиск по ДЗ и заметкам/домашнему заданию уроков (русская морфология).
+-- Векторы - генерируемые колонки: PostgreSQL пересчитывает их при каждой записи сам.
+ALTER TABLE homework ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+) STORED;
+
+ALTER TABLE schedule ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(homework, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(notes, '')), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_homework_search ON homework USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_schedule_search ON schedule USING GIN (search_vector);
+
+-- Для отбора самых свежих совпадений перед ранжированием
+CREATE INDEX IF NOT EXISTS idx_homework_due_date ON homework(due_date);
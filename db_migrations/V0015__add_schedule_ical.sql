@@ -0,0 +1,43 @@
+-- Готовые iCalendar-ленты класса или учителя. Запись в schedule не удаляет ленту, а помечает её
+-- устаревшей (payload = NULL, changed_at): ETag и время изменения нужны, чтобы после пересборки
+-- без реальных изменений календари по-прежнему получали 304
+CREATE TABLE IF NOT EXISTS schedule_ical (
+    scope VARCHAR(10) NOT NULL,
+    owner_id INTEGER NOT NULL,
+    window_start DATE NOT NULL,
+    payload TEXT,
+    etag VARCHAR(64) NOT NULL,
+    modified_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    changed_at TIMESTAMPTZ,
+    PRIMARY KEY (scope, owner_id)
+);
+
+-- Та же функция, что сбрасывает недельные сетки (V0013), теперь помечает и ленты владельцев
+CREATE OR REPLACE FUNCTION forget_week_grid(scopes TEXT[], owners INTEGER[], weeks DATE[]) RETURNS void AS $$
+DECLARE
+    k RECORD;
+BEGIN
+    FOR k IN SELECT DISTINCT u.scope, u.owner_id FROM unnest(scopes, owners) AS u(scope, owner_id) ORDER BY 1, 2 LOOP
+        PERFORM pg_advisory_xact_lock(hashtext('week_grid:' || k.scope), k.owner_id);
+    END LOOP;
+    DELETE FROM schedule_week_grid g
+    USING unnest(scopes, owners, weeks) AS u(scope, owner_id, week_start)
+    WHERE g.scope = u.scope AND g.owner_id = u.owner_id
+      AND (u.week_start IS NULL OR g.week_start = u.week_start);
+    UPDATE schedule_ical f
+    SET payload = NULL, changed_at = CURRENT_TIMESTAMP
+    FROM (SELECT DISTINCT scope, owner_id FROM unnest(scopes, owners) AS u(scope, owner_id)) u
+    WHERE f.scope = u.scope AND f.owner_id = u.owner_id AND f.payload IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION clear_ical() RETURNS trigger AS $$
+BEGIN
+    UPDATE schedule_ical SET payload = NULL, changed_at = CURRENT_TIMESTAMP WHERE payload IS NOT NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_schedule_ical_truncate ON schedule;
+CREATE TRIGGER trg_schedule_ical_truncate AFTER TRUNCATE ON schedule
+FOR EACH STATEMENT EXECUTE FUNCTION clear_ical();
@@ -0,0 +1,107 @@
+-- Журнал изменений для дельта-синхронизации PWA: каждая вставка, изменение и удаление в schedule,
+-- homework, grades, subjects и classes. Курсор клиента - (xid, seq): xid транзакции-писателя
+-- позволяет отдавать только записи завершённых транзакций, так что запись, закоммиченная позже
+-- соседней с большим seq, не будет пропущена. Данные строк не копируются - их читают из таблиц.
+CREATE TABLE IF NOT EXISTS change_log (
+    seq BIGSERIAL PRIMARY KEY,
+    xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    table_name VARCHAR(30) NOT NULL,
+    row_id INTEGER,
+    op CHAR(1) NOT NULL,
+    class_id INTEGER,
+    student_id INTEGER,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Область записи: класс (расписание, ДЗ), ученик (оценки) или общая (предметы, классы, TRUNCATE)
+CREATE INDEX IF NOT EXISTS idx_change_log_class ON change_log (class_id, xid, seq) WHERE class_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_change_log_student ON change_log (student_id, xid, seq) WHERE student_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_change_log_common ON change_log (xid, seq) WHERE class_id IS NULL AND student_id IS NULL;
+
+-- Граница очистки: курсоры с xid меньше неё требуют полной синхронизации
+CREATE TABLE IF NOT EXISTS change_log_horizon (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    pruned_before xid8 NOT NULL
+);
+INSERT INTO change_log_horizon (pruned_before) VALUES ('0') ON CONFLICT DO NOTHING;
+
+-- Аргументы триггера: колонка класса и колонка ученика ('' - нет такой области).
+-- При UPDATE, сменившем область (урок перенесён в другой класс), старая область тоже
+-- получает запись, чтобы её клиенты удалили строку у себя.
+CREATE OR REPLACE FUNCTION log_changes() RETURNS trigger AS $$
+DECLARE
+    scope_cols TEXT := concat_ws(', ', COALESCE(quote_ident(NULLIF(TG_ARGV[0], '')), 'NULL::integer'),
+                                       COALESCE(quote_ident(NULLIF(TG_ARGV[1], '')), 'NULL::integer'));
+    scope_col TEXT := quote_ident(COALESCE(NULLIF(TG_ARGV[0], ''), NULLIF(TG_ARGV[1], '')));
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        INSERT INTO change_log (table_name, op) VALUES (TG_TABLE_NAME, 'T');
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        EXECUTE format('INSERT INTO change_log (table_name, row_id, op, class_id, student_id)
+                        SELECT %L, id, %L, %s FROM new_rows',
+                       TG_TABLE_NAME, left(TG_OP, 1), scope_cols);
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        EXECUTE format('INSERT INTO change_log (table_name, row_id, op, class_id, student_id)
+                        SELECT %L, id, ''D'', %s FROM old_rows',
+                       TG_TABLE_NAME, scope_cols);
+    ELSIF TG_OP = 'UPDATE' AND scope_col IS NOT NULL THEN
+        EXECUTE format('INSERT INTO change_log (table_name, row_id, op, class_id, student_id)
+                        SELECT %L, id, ''U'', %s FROM old_rows o
+                        WHERE NOT EXISTS (SELECT 1 FROM new_rows n WHERE n.id = o.id AND n.%s IS NOT DISTINCT FROM o.%s)',
+                       TG_TABLE_NAME, scope_cols, scope_col, scope_col);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер с таблицами переходов допускает только одно событие, поэтому по три на таблицу
+DO $$
+DECLARE
+    t RECORD;
+BEGIN
+    FOR t IN SELECT * FROM (VALUES
+        ('schedule', 'class_id', ''),
+        ('homework', 'class_id', ''),
+        ('grades', '', 'student_id'),
+        ('subjects', '', ''),
+        ('classes', '', '')
+    ) AS v(table_name, class_col, student_col) LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%1$s_changes_insert ON %1$I;
+            CREATE TRIGGER trg_%1$s_changes_insert AFTER INSERT ON %1$I
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION log_changes(%2$L, %3$L)', t.table_name, t.class_col, t.student_col);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%1$s_changes_update ON %1$I;
+            CREATE TRIGGER trg_%1$s_changes_update AFTER UPDATE ON %1$I
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION log_changes(%2$L, %3$L)', t.table_name, t.class_col, t.student_col);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%1$s_changes_delete ON %1$I;
+            CREATE TRIGGER trg_%1$s_changes_delete AFTER DELETE ON %1$I
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION log_changes(%2$L, %3$L)', t.table_name, t.class_col, t.student_col);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%1$s_changes_truncate ON %1$I;
+            CREATE TRIGGER trg_%1$s_changes_truncate AFTER TRUNCATE ON %1$I
+            FOR EACH STATEMENT EXECUTE FUNCTION log_changes(%2$L, %3$L)', t.table_name, t.class_col, t.student_col);
+    END LOOP;
+END;
+$$;
+
+-- Удаляет записи старше keep целыми транзакциями и сдвигает границу; запускать по расписанию:
+-- SELECT prune_change_log(INTERVAL '30 days');
+CREATE OR REPLACE FUNCTION prune_change_log(keep INTERVAL) RETURNS BIGINT AS $$
+DECLARE
+    boundary xid8;
+    removed BIGINT;
+BEGIN
+    SELECT max(xid) INTO boundary FROM change_log WHERE changed_at < CURRENT_TIMESTAMP - keep;
+    IF boundary IS NULL THEN
+        RETURN 0;
+    END IF;
+    UPDATE change_log_horizon SET pruned_before = boundary WHERE pruned_before < boundary;
+    DELETE FROM change_log WHERE xid < boundary;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    RETURN removed;
+END;
+$$ LANGUAGE plpgsql;
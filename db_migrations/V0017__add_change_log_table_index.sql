@@ -0,0 +1,5 @@
+-- Версия оценок для кэша аналитики - xid последней завершённой транзакции, менявшей grades,
+-- из change_log (V0016). Общий счётчик в entity_versions обновлял бы одну строку при каждой
+-- записи оценок и держал её блокировку до коммита - все писатели оценок выстроились бы в очередь.
+-- Индекс отдаёт версию одним шагом назад от границы завершённых транзакций.
+CREATE INDEX IF NOT EXISTS idx_change_log_table_xid ON change_log (table_name, xid);
@@ -0,0 +1,12 @@
+-- Реестр школ. Данные каждой школы живут в своей схеме с теми же таблицами (backend/tenants.py
+-- создаёт её и прогоняет в ней миграции); функции выбирают схему через search_path соединения.
+-- Школа по умолчанию - основная схема проекта, в реестр её вносить не нужно.
+CREATE TABLE IF NOT EXISTS tenants (
+    slug VARCHAR(32) PRIMARY KEY,
+    schema_name VARCHAR(63) UNIQUE NOT NULL,
+    name VARCHAR(255),
+    -- Сколько соединений пула функции школа может занять одновременно; NULL - TENANT_MAX_CONNECTIONS
+    max_connections INTEGER CHECK (max_connections > 0),
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
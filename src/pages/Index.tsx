@@ -1015,7 +1015,9 @@ export default function Index() {
                                     {JSON.parse(schedule.homework_files).map((file: any, idx: number) => (
                                       <a 
                                         key={idx}
-                                        href={file.data}
+                                        href={file.sha256
+                                          ? `${API.schedule}?action=download&sha256=${file.sha256}&name=${encodeURIComponent(file.name)}`
+                                          : file.data}
                                         download={file.name}
                                         className="flex items-center gap-2 text-xs text-orange-700 hover:text-orange-900 hover:underline"
                                       >